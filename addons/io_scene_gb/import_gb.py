@@ -2,6 +2,7 @@ import bpy
 import bmesh
 import math
 import os
+import pose
 import utility
 
 from mathutils import Matrix, Vector, Quaternion
@@ -50,34 +51,36 @@ def add_animation(self, obj, pose_matrices):
     p1 = (Matrix.Scale(-1, 4, (0, 1, 0)) * Matrix.Rotation(math.pi / 2, 4, 'X'))
     p2 = (Matrix.Scale(-1, 4, (1, 0, 0)) * Matrix.Rotation(math.pi / 2, 4, 'Z')).inverted()
 
+    # The armature may stem from another file, so use its hierarchy
+    bones = [obj.pose.bones['Bone.%03d' % i]
+            for i in range(self.keyframes.shape[1])]
+
+    parents = [int(b.parent.name[-3:]) if b.parent else pose.NO_PARENT
+            for b in bones]
+
+    world_matrices = pose.world_matrices(self.keyframes, pose_matrices, parents)
+
     zipped = zip(
-        self.keyframes,
+        world_matrices,
         self.keyframe_frames,
         self.keyframe_events
     )
 
-    for keyframe, frame, event in zipped:
-        frame = math.ceil(frame * 30 / 1000)
-
-        for i, m in enumerate(keyframe):
-            pose = obj.pose.bones['Bone.%03d' % i]
-
-            matrix = pose_matrices[m]
+    for matrices, frame, event in zipped:
+        frame = math.ceil(int(frame) * 30 / 1000)
 
-            for parent in pose.parent_recursive:
-                matrix = pose_matrices[keyframe[int(parent.name[-3:])]] * matrix
-
-            matrix = Matrix.Scale(1 if SCALE > 0 else -1, 4) * p1 * matrix * p2
+        for bone, matrix in zip(bones, matrices):
+            matrix = Matrix.Scale(1 if SCALE > 0 else -1, 4) * p1 * Matrix(matrix.tolist()) * p2
             matrix[0][3] *= abs(SCALE)
             matrix[1][3] *= abs(SCALE)
             matrix[2][3] *= abs(SCALE)
-            pose.matrix = matrix
+            bone.matrix = matrix
 
             bpy.context.scene.update()
 
-            pose.keyframe_insert('location', frame=frame)
-            pose.keyframe_insert('rotation_quaternion', frame=frame)
-            pose.keyframe_insert('scale', frame=frame)
+            bone.keyframe_insert('location', frame=frame)
+            bone.keyframe_insert('rotation_quaternion', frame=frame)
+            bone.keyframe_insert('scale', frame=frame)
 
     bpy.ops.object.mode_set(mode='OBJECT')
 
@@ -102,14 +105,15 @@ def add_mesh(self, obj):
     # Texture coordinates, ignoring a possible second channel
     if getattr(self, 'material', False):
         uv_layer = bm.loops.layers.uv.verify()
+        uv0 = self.uv0
 
         for i, f in enumerate(bm.faces):
             for j, l in enumerate(f.loops):
                 v_index = self.faces[i][j]
 
                 uv = l[uv_layer].uv
-                uv[0] = +self.verts[v_index]['t0'][0]
-                uv[1] = -self.verts[v_index]['t0'][1]
+                uv[0] = +uv0[v_index][0]
+                uv[1] = -uv0[v_index][1]
 
     # Converts DirectX/OpenGL coordinate system difference
     bm.transform(
@@ -284,28 +288,19 @@ def add_material_animation(self, obj, keyframe_frames):
 
 @property
 def matrix(self):
-    mat_rot = Quaternion(self.rotation).to_matrix().to_4x4()
-
-    mat_sca = Matrix([
-        [self.scale[0], 0, 0],
-        [0, self.scale[1], 0],
-        [0, 0, self.scale[2]],
-    ]).to_4x4()
-
-    return Matrix.Translation(self.position) * mat_rot * mat_sca
+    return Matrix(pose.compose_matrices(
+            self.position, self.rotation, self.scale).tolist())
 
 
 def read_image(path, name):
     # Search in the object-relative and common texture directory
-    for path in [path, utility.get_common_path(path)]:
-        try:
-            return bpy.data.images.load(
-                    os.path.join(path, 'tex', name), True)
+    path = utility.find_texture(path, name)
 
-        except RuntimeError:
-            pass  # Ignore, since Blender will print an error message
+    if path is None:
+        print('Warning: Texture %s not found.' % name)
+        return None
 
-    return None
+    return bpy.data.images.load(path, True)
 
 
 def setup():
@@ -331,6 +326,9 @@ def auto_import(context, filepath, parent, scale, **args):
 
     SCALE = scale
 
+    # Textures may have been added or converted since the last import
+    utility.clear_textures()
+
     # The cycles renderer is needed for material nodes
     bpy.context.scene.render.engine = 'CYCLES'
 
@@ -406,7 +404,7 @@ def auto_import(context, filepath, parent, scale, **args):
 
     # Add animations
     if gb.animations:
-        pose_matrices = [t.matrix for t in gb.transformations]
+        pose_matrices = pose.transformation_matrices(gb.transformations)
 
         for animation in gb.animations:
             if armature is None:
@@ -0,0 +1,127 @@
+#!/usr/bin/python3.5
+
+"""Measures path queries on a stitched world of KSM tiles.
+
+Usage: pathfinding.py [-h] [--tiles TILES] [--queries QUERIES] [source]
+
+Without a source directory, a world of TILES x TILES synthetic tiles with
+blocked blobs is generated. Start and goal cells are drawn at random from
+the walkable cells, so most pairs of a real map are within one region.
+"""
+
+import argparse
+import os
+import struct
+import sys
+import tempfile
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+        '..', 'modules'))
+
+import navigation
+
+
+def write_tiles(directory, count, seed=0):
+    """Write count x count KSM tiles with smooth random obstacles"""
+    random = np.random.RandomState(seed)
+    size = navigation.TILE_SIZE
+
+    # Coarse noise, upsampled to blobs of 16 cells
+    noise = random.rand(count * size // 16 + 1, count * size // 16 + 1)
+    noise = np.kron(noise, np.ones((16, 16)))[:count * size, :count * size]
+    walkable = noise < 0.7
+
+    for y in range(count):
+        for x in range(count):
+            area = np.zeros((size, size), [('move', '<u2'), ('zone', '<u2')])
+            area['move'] = walkable[y * size:(y + 1) * size,
+                    x * size:(x + 1) * size]
+
+            path = os.path.join(directory, 'n_%03d_%03d.ksm' % (x, y))
+            with open(path, 'wb') as stream:
+                stream.write(struct.pack('<I', 1))
+                stream.write(area.tobytes())
+
+def measure(source, queries, seed=0):
+    start = time.perf_counter()
+    zones = navigation.ZoneIndex().load(source)
+    loaded = time.perf_counter()
+    finder = navigation.PathFinder(zones)
+    prepared = time.perf_counter()
+
+    rows, cols = finder.walkable.shape
+    print('world:            %d x %d cells, %d regions' % (
+        cols, rows, finder.labels.max()))
+    print('load tiles:       %8.3f s' % (loaded - start))
+    print('prepare search:   %8.3f s' % (prepared - loaded))
+
+    random = np.random.RandomState(seed)
+    cells = np.flatnonzero(finder.walkable)
+    cells = cells[random.randint(len(cells), size=(2, queries))]
+
+    starts = np.stack([cells[0] % cols + finder.x,
+            cells[0] // cols + finder.y], axis=1)
+    goals = np.stack([cells[1] % cols + finder.x,
+            cells[1] // cols + finder.y], axis=1)
+
+    start = time.perf_counter()
+    reachable = finder.reachable(starts, goals)
+    elapsed = time.perf_counter() - start
+
+    print('reachable:        %8.0f queries/s' % (queries / elapsed))
+
+    # Unreachable pairs are answered from the labels
+    start = time.perf_counter()
+    for i in np.flatnonzero(~reachable):
+        finder.find_path(starts[i], goals[i])
+    elapsed = time.perf_counter() - start
+
+    if not reachable.all():
+        print('unreachable path: %8.0f queries/s' % (
+            (~reachable).sum() / elapsed))
+
+    # Pairs within a region need a search, unless they are cached
+    found = np.flatnonzero(reachable)
+    length = 0
+
+    start = time.perf_counter()
+    for i in found:
+        length += len(finder.find_path(starts[i], goals[i]))
+    elapsed = time.perf_counter() - start
+
+    print('path search:      %8.1f queries/s, %.0f cells per path' % (
+        len(found) / elapsed, length / max(len(found), 1)))
+
+    start = time.perf_counter()
+    for i in found:
+        finder.find_path(goals[i], starts[i])
+    elapsed = time.perf_counter() - start
+
+    print('cached path:      %8.0f queries/s' % (len(found) / elapsed))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+            description='Measure path queries on KSM tiles.')
+
+    parser.add_argument('source', nargs='?', help='map directory with KSM files')
+    parser.add_argument('--tiles', type=int, default=8,
+            help='synthetic world size in tiles per side (default: 8)')
+    parser.add_argument('--queries', type=int, default=200,
+            help='number of random start and goal pairs (default: 200)')
+
+    args = parser.parse_args(argv)
+
+    if args.source:
+        measure(args.source, args.queries)
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        write_tiles(directory, args.tiles)
+        measure(directory, args.queries)
+
+
+if __name__ == '__main__':
+    main()
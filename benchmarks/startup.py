@@ -0,0 +1,68 @@
+#!/usr/bin/python3.5
+
+"""Measures the startup cost of the crypt tables.
+
+Each sample runs in a fresh interpreter, since the tables are cached per
+process. The text column is the former import-time parse of the four hex
+tables, the binary column maps all four binary tables on first use.
+"""
+
+import os
+import subprocess
+import sys
+
+MODULES = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'modules')
+
+TEXT = '''
+for name in utility._TABLE_ENCRYPT + utility._TABLE_DECRYPT:
+    path = os.path.join(os.path.dirname(utility.__file__), 'resources', name)
+    with open(path) as data:
+        [[int(v, 16) for v in line.split()] for line in data]
+'''
+
+BINARY = '''
+for name in utility._TABLE_ENCRYPT + utility._TABLE_DECRYPT:
+    utility._get_translation(name, 0)
+'''
+
+IMPORT = '''
+import utility
+'''
+
+SCRIPT = '''
+import os, sys, time
+sys.path.insert(0, %r)
+%s
+t = time.perf_counter()
+%s
+print(time.perf_counter() - t)
+'''
+
+
+def measure(code, repeat, setup='import utility'):
+    script = SCRIPT % (MODULES, setup, code)
+
+    samples = []
+    for _ in range(repeat):
+        output = subprocess.check_output([sys.executable, '-c', script])
+        samples.append(float(output))
+
+    return min(samples)
+
+
+def main(repeat=20):
+    # Creates the binary tables, if they are not shipped
+    measure(BINARY, 1)
+
+    startup = measure(IMPORT, repeat, setup='import numpy')
+    text = measure(TEXT, repeat)
+    binary = measure(BINARY, repeat)
+
+    print('import utility (numpy preloaded): %8.3f ms' % (startup * 1000))
+    print('text tables (before):             %8.3f ms' % (text * 1000))
+    print('binary tables (after):            %8.3f ms' % (binary * 1000))
+    print('speedup:                          %8.1fx' % (text / binary))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,418 @@
+#!/usr/bin/python3.5
+
+"""Packs the parsed KCM, KSM, OPL and ENV files of a map into one bundle.
+
+Usage: bundle.py [-h] {pack,list} ...
+
+Loading a map from a bundle needs a single mapping instead of thousands of
+opened files, where all arrays are read-only views into the mapping.
+
+Layout, little endian:
+    header   magic, version, entry count, alignment, index offset (u64)
+    entries  per entry a u32 length and a JSON record of the scalar fields
+             and arrays, followed by the arrays, each aligned to ALIGNMENT
+    index    per entry the type, x, y, offset (u64) and length (u64),
+             sorted by type, x and y
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+import utility
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor
+from struct import Struct
+from structs.env import ENVFile
+from structs.env import ENVLayer
+from structs.env import ENVLight
+from structs.kcm import KCMFile
+from structs.ksm import KSMFile
+from structs.opl import OPLFile
+from utility import ValidationError
+from utility import VersionError
+
+
+MAGIC = b'KALB'
+VERSION = 1
+
+# Alignment of entries and arrays
+ALIGNMENT = 64
+
+_HEADER = Struct('<4s3IQ')
+_LENGTH = Struct('<I')
+
+INDEX_DTYPE = np.dtype([
+    ('type',   'S4'),
+    ('x',      '<u4'),
+    ('y',      '<u4'),
+    ('offset', '<u8'),
+    ('length', '<u8'),
+])
+
+_NAME = re.compile(r'(\d+)_(\d+)\.[^.]+$', re.IGNORECASE)
+
+
+def _encode_kcm(kcm):
+    arrays = {
+        'height_map' : kcm.height_map,
+        'color_map'  : kcm.color_map,
+        'decal_map'  : kcm.decal_map,
+    }
+
+    if len(kcm.alpha_maps) > 1:
+        arrays['alpha_maps'] = np.stack(kcm.alpha_maps[1:])
+
+    return {
+        'alpha_ids' : kcm.alpha_ids,
+        'decal_ids' : kcm.decal_ids,
+    }, arrays
+
+def _decode_kcm(x, y, scalars, arrays):
+    kcm = KCMFile()
+    kcm.x = x
+    kcm.y = y
+    kcm.alpha_ids = scalars['alpha_ids']
+    kcm.decal_ids = scalars['decal_ids']
+    kcm.alpha_maps = [None] + list(arrays.get('alpha_maps', []))
+    kcm.height_map = arrays['height_map']
+    kcm.color_map = arrays['color_map']
+    kcm.decal_map = arrays['decal_map']
+    return kcm
+
+def _encode_ksm(ksm):
+    return {}, {'area' : ksm.area}
+
+def _decode_ksm(x, y, scalars, arrays):
+    ksm = KSMFile()
+    ksm.area = arrays['area']
+    return ksm
+
+def _encode_opl(opl):
+    return {'paths' : opl.paths}, {
+        'path_ids'  : opl.path_ids,
+        'positions' : opl.positions,
+        'rotations' : opl.rotations,
+        'scales'    : opl.scales,
+    }
+
+def _decode_opl(x, y, scalars, arrays):
+    opl = OPLFile()
+    opl.x = x
+    opl.y = y
+    opl.paths = scalars['paths']
+    opl.path_ids = arrays['path_ids']
+    opl.positions = arrays['positions']
+    opl.rotations = arrays['rotations']
+    opl.scales = arrays['scales']
+    opl._nodes = None
+    return opl
+
+def _encode_env(env):
+    return {
+        'decals' : env.decals,
+        'layers' : [[l.scale_u, l.scale_v, l.path] for l in env.layers],
+    }, {
+        'lights' : np.array([[l.r, l.g, l.b, l.a] for l in env.lights],
+            np.float32).reshape(-1, 4),
+    }
+
+def _decode_env(x, y, scalars, arrays):
+    env = ENVFile()
+    env.decals = [tuple(decal) for decal in scalars['decals']]
+    env.lights = []
+    env.layers = []
+
+    for values in arrays['lights']:
+        light = ENVLight()
+        light.r, light.g, light.b, light.a = values
+        env.lights.append(light)
+
+    for values in scalars['layers']:
+        layer = ENVLayer()
+        layer.scale_u, layer.scale_v, layer.path = values
+        env.layers.append(layer)
+
+    return env
+
+# Type: (extension, struct, encoder, decoder)
+TYPES = {
+    'ENV' : ('.env', ENVFile, _encode_env, _decode_env),
+    'KCM' : ('.kcm', KCMFile, _encode_kcm, _decode_kcm),
+    'KSM' : ('.ksm', KSMFile, _encode_ksm, _decode_ksm),
+    'OPL' : ('.opl', OPLFile, _encode_opl, _decode_opl),
+}
+
+_EXTENSIONS = {value[0]: key for key, value in TYPES.items()}
+
+
+def _align(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+def _parse_file(path):
+    """Parse a file, returning its type, tile, scalars and arrays"""
+    name = os.path.basename(path)
+    kind = _EXTENSIONS[os.path.splitext(name)[1].lower()]
+    _, struct, encode, _ = TYPES[kind]
+
+    with open(path, 'rb') as stream:
+        value = struct().parse(stream)
+
+    if hasattr(value, 'x'):
+        x, y = value.x, value.y
+    elif kind == 'ENV':
+        # A map has a single ENV file
+        x, y = 0, 0
+    else:
+        match = _NAME.search(name)
+        if match is None:
+            raise ValidationError('Tile of %s is unknown' % path)
+
+        x, y = int(match.group(1)), int(match.group(2))
+
+    scalars, arrays = encode(value)
+    return kind, x, y, scalars, {k: np.ascontiguousarray(v)
+            for k, v in arrays.items()}
+
+def find_files(source):
+    """Return the paths of all bundled file types below source"""
+    paths = []
+
+    for root, _, files in os.walk(source):
+        for name in files:
+            if os.path.splitext(name)[1].lower() in _EXTENSIONS:
+                paths.append(os.path.join(root, name))
+
+    return sorted(paths)
+
+def write_entry(stream, scalars, arrays):
+    """Write an aligned entry to stream, returning its offset and length"""
+    start = _align(stream.tell())
+    stream.write(bytes(start - stream.tell()))
+
+    # The record holds the array offsets, which depend on the record size,
+    # so the offsets are updated until they are stable
+    names = sorted(arrays)
+    offsets = None
+
+    while True:
+        record = json.dumps({
+            'scalars' : scalars,
+            'arrays'  : [[name, np.lib.format.dtype_to_descr(
+                arrays[name].dtype), arrays[name].shape, offset]
+                for name, offset in zip(names, offsets or [0] * len(names))],
+        }).encode('utf-8')
+
+        offset = _LENGTH.size + len(record)
+        previous, offsets = offsets, []
+
+        for name in names:
+            offset = _align(offset)
+            offsets.append(offset)
+            offset += arrays[name].nbytes
+
+        if offsets == previous:
+            break
+
+    stream.write(_LENGTH.pack(len(record)))
+    stream.write(record)
+
+    for name, offset in zip(names, offsets):
+        stream.write(bytes(start + offset - stream.tell()))
+        stream.write(arrays[name].tobytes())
+
+    return start, stream.tell() - start
+
+def _as_descr(descr):
+    """Restore the field tuples of a structured descr read from JSON"""
+    if not isinstance(descr, list):
+        return descr
+
+    return [(field[0], _as_descr(field[1])) +
+            tuple(tuple(shape) for shape in field[2:]) for field in descr]
+
+def read_entry(buffer, offset, length):
+    """Return the scalars and arrays of an entry, arrays are views"""
+    if offset + _LENGTH.size > len(buffer):
+        raise ValidationError('Invalid bundle entry')
+
+    size = _LENGTH.unpack_from(buffer, offset)[0]
+    record = json.loads(bytes(buffer[offset + _LENGTH.size:
+        offset + _LENGTH.size + size]).decode('utf-8'))
+
+    arrays = {}
+    dtypes = {}
+
+    for name, descr, shape, start in record['arrays']:
+        # Entries often hold many small arrays of few types
+        key = descr if isinstance(descr, str) else repr(descr)
+        dtype = dtypes.get(key)
+        if dtype is None:
+            dtype = dtypes[key] = np.lib.format.descr_to_dtype(
+                    _as_descr(descr))
+
+        count = 1
+        for extent in shape:
+            count *= extent
+
+        if start + count * dtype.itemsize > length:
+            raise ValidationError('Invalid bundle entry')
+
+        arrays[name] = np.frombuffer(buffer, dtype, count,
+                offset + start).reshape(tuple(shape))
+
+    return record['scalars'], arrays
+
+def pack(source, output, jobs=None):
+    """Bundle all files below source, replacing output atomically"""
+    paths = find_files(source)
+    index = []
+    keys = set()
+
+    directory = os.path.dirname(output) or '.'
+    handle, temp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+
+    try:
+        with os.fdopen(handle, 'wb') as stream, \
+                ProcessPoolExecutor(jobs) as executor:
+            stream.write(bytes(_HEADER.size))
+
+            results = executor.map(_parse_file, paths, chunksize=16)
+
+            for path, (kind, x, y, scalars, arrays) in zip(paths, results):
+                if (kind, x, y) in keys:
+                    raise ValidationError('Duplicate %s tile %d, %d: %s' % (
+                        kind, x, y, path))
+
+                keys.add((kind, x, y))
+                index.append((kind.encode('ascii'), x, y) +
+                        write_entry(stream, scalars, arrays))
+
+            index = np.array(sorted(index), INDEX_DTYPE)
+
+            index_offset = _align(stream.tell())
+            stream.write(bytes(index_offset - stream.tell()))
+            stream.write(index.tobytes())
+
+            stream.seek(0)
+            stream.write(_HEADER.pack(MAGIC, VERSION, len(index), ALIGNMENT,
+                index_offset))
+
+        # mkstemp creates files only readable by the owner
+        os.chmod(temp, utility.file_mode())
+        os.replace(temp, output)
+
+    except BaseException:
+        os.unlink(temp)
+        raise
+
+    return Bundle().open(output)
+
+
+class Bundle(object):
+    """Read-only view of a bundle file.
+
+    Entries are found by their (type, x, y) key, where ENV files have the
+    tile 0, 0. Loaded objects are views into the mapped file.
+    """
+    __slots__ = [
+        'buffer',
+        'index',
+        '_entries',
+    ]
+
+    def open(self, path):
+        return self.parse(utility.map_file(path))
+
+    def parse(self, buffer):
+        header = bytes(buffer[:_HEADER.size])
+        if len(header) != _HEADER.size:
+            raise ValidationError('Invalid bundle structure')
+
+        magic, version, count, alignment, offset = _HEADER.unpack(header)
+
+        if magic != MAGIC:
+            raise ValidationError('Not a bundle')
+        if version != VERSION:
+            raise VersionError('Bundle version %d is unsupported' % version)
+        if offset + count * INDEX_DTYPE.itemsize > len(buffer):
+            raise ValidationError('Too few bytes in bundle structure')
+
+        self.buffer = buffer
+        self.index = np.frombuffer(buffer, INDEX_DTYPE, count, offset)
+
+        self._entries = {(kind.decode('ascii'), x, y): i for i, (kind, x, y)
+                in enumerate(self.index[['type', 'x', 'y']].tolist())}
+
+        return self
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def keys(self):
+        """Return the (type, x, y) keys of all entries in index order"""
+        return list(self._entries)
+
+    def tiles(self, kind):
+        """Return the (x, y) tiles of all entries of a type"""
+        return [(x, y) for k, x, y in self._entries if k == kind]
+
+    def entry(self, kind, x, y):
+        """Return the scalars and arrays of an entry"""
+        try:
+            offset, length = self.index[self._entries[kind, x, y]][
+                    ['offset', 'length']].tolist()
+        except KeyError:
+            raise KeyError('No %s tile %d, %d in bundle' % (kind, x, y))
+
+        return read_entry(self.buffer, offset, length)
+
+    def load(self, kind, x=0, y=0):
+        """Return the struct object of an entry"""
+        return TYPES[kind][3](x, y, *self.entry(kind, x, y))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+            description='Bundle the tiles of a map into one file.')
+
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    pack_parser = commands.add_parser('pack', help='bundle a map directory')
+    pack_parser.add_argument('source',
+            help='map directory with KCM, KSM, OPL and ENV files')
+    pack_parser.add_argument('bundle', help='bundle file')
+    pack_parser.add_argument('-j', '--jobs', type=int, default=None,
+            help='number of worker processes (default: CPU count)')
+
+    list_parser = commands.add_parser('list', help='list bundle entries')
+    list_parser.add_argument('bundle', help='bundle file')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'pack':
+        start = time.perf_counter()
+        bundle = pack(args.source, args.bundle, args.jobs)
+
+        print('%d entries, %.1f MB in %.2f s' % (len(bundle),
+            len(bundle.buffer) / 1e6, time.perf_counter() - start))
+    else:
+        bundle = Bundle().open(args.bundle)
+
+        for kind, x, y, offset, length in bundle.index.tolist():
+            print('%s %03d %03d %12d %10d' % (kind.decode('ascii'), x, y,
+                offset, length))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,351 @@
+#!/usr/bin/python3.5
+
+"""Persistent cache of parsed structs.
+
+Usage: cache.py [-h] [--max-size MAX_SIZE] {info,clear} directory
+
+A ParseCache stores every parsed GB, KCM, KSM, OPL or ENV file as a bundle
+entry below its directory: a JSON record of the object graph followed by
+the aligned arrays, which are loaded as read-only views into the mapped
+entry. Entries are keyed by the path, size and modification time of a file
+or by its content, together with the source of its parser, so a changed
+parser never loads stale entries. The least recently used entries are
+removed once the cache exceeds its size.
+"""
+
+import argparse
+import functools
+import hashlib
+import importlib
+import os
+import sys
+import tempfile
+import bundle
+import utility
+import numpy as np
+
+from utility import ValidationError
+
+
+# Changes to the encoding of entries invalidate all entries
+VERSION = 1
+
+_SUFFIX = '.entry'
+
+
+@functools.lru_cache(maxsize=None)
+def parser_version(struct):
+    """Return the hash of the source of a parser and its utilities"""
+    digest = hashlib.sha1()
+
+    for module in (sys.modules[struct.__module__], utility):
+        with open(module.__file__, 'rb') as stream:
+            digest.update(stream.read())
+
+    return digest.hexdigest()
+
+def _hash_file(path):
+    digest = hashlib.sha1()
+
+    with open(path, 'rb') as stream:
+        for data in iter(lambda: stream.read(1024 * 1024), b''):
+            digest.update(data)
+
+    return digest.hexdigest()
+
+def _add_array(arrays, array):
+    name = 'a%d' % len(arrays)
+    arrays[name] = array
+    return name
+
+def encode(value, arrays, memo):
+    """Return the JSON value of an object graph, collecting its arrays.
+
+    Struct objects are encoded by their slots, where objects referenced
+    more than once, such as the materials of meshes, are kept shared.
+    """
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+
+    if isinstance(value, np.ndarray):
+        return {'@array' : _add_array(arrays, value)}
+
+    if isinstance(value, np.generic):
+        return {'@generic' : _add_array(arrays, np.asarray(value))}
+
+    if isinstance(value, (bytes, bytearray)):
+        return {'@bytes' : _add_array(arrays,
+            np.frombuffer(value, np.uint8))}
+
+    if isinstance(value, list):
+        return [encode(v, arrays, memo) for v in value]
+
+    if isinstance(value, tuple):
+        return {'@tuple' : [encode(v, arrays, memo) for v in value]}
+
+    if isinstance(value, (set, frozenset)):
+        return {'@set' : [encode(v, arrays, memo) for v in value]}
+
+    if isinstance(value, dict):
+        return {'@dict' : [[encode(k, arrays, memo), encode(v, arrays, memo)]
+            for k, v in value.items()]}
+
+    reference = memo.get(id(value))
+    if reference is not None:
+        return {'@ref' : reference[0]}
+
+    # Objects are numbered in the order the decoder creates them
+    memo[id(value)] = (len(memo), value)
+
+    if isinstance(value, utility.BufferReader):
+        return {'@reader' : _add_array(arrays,
+            np.frombuffer(value.buffer, np.uint8)), 'offset' : value.offset}
+
+    cls = type(value)
+    if not cls.__module__.startswith('structs.'):
+        raise TypeError('Cannot cache %s objects' % cls.__name__)
+
+    return {'@object' : '%s.%s' % (cls.__module__, cls.__name__), 'slots' : {
+        name : encode(getattr(value, name), arrays, memo)
+        for name in cls.__slots__ if hasattr(value, name)}}
+
+@functools.lru_cache(maxsize=None)
+def _struct_class(name):
+    module, name = name.rsplit('.', 1)
+    if not module.startswith('structs.'):
+        raise ValidationError('Invalid cache entry')
+
+    return getattr(importlib.import_module(module), name)
+
+def decode(value, arrays, objects, copy=False):
+    """Return the object graph of a JSON value created by encode"""
+    if isinstance(value, list):
+        return [decode(v, arrays, objects, copy) for v in value]
+
+    if not isinstance(value, dict):
+        return value
+
+    # Encoded values are tagged by their first key
+    tag = next(iter(value))
+
+    if tag == '@object':
+        cls = _struct_class(value[tag])
+
+        result = cls.__new__(cls)
+        objects.append(result)
+
+        for slot, v in value['slots'].items():
+            setattr(result, slot, decode(v, arrays, objects, copy))
+
+        return result
+
+    if tag == '@array':
+        array = arrays[value[tag]]
+        return array.copy() if copy else array
+
+    if tag == '@ref':
+        return objects[value[tag]]
+
+    if tag == '@tuple':
+        return tuple(decode(v, arrays, objects, copy) for v in value[tag])
+
+    if tag == '@generic':
+        return arrays[value[tag]][()]
+
+    if tag == '@bytes':
+        return arrays[value[tag]].tobytes()
+
+    if tag == '@set':
+        return set(decode(v, arrays, objects, copy) for v in value[tag])
+
+    if tag == '@dict':
+        return {decode(k, arrays, objects, copy): decode(v, arrays, objects,
+            copy) for k, v in value[tag]}
+
+    if tag == '@reader':
+        reader = utility.BufferReader(arrays[value[tag]], value['offset'])
+        objects.append(reader)
+        return reader
+
+    raise ValidationError('Invalid cache entry')
+
+class ParseCache(object):
+    """Directory of parsed files, limited to max_size bytes.
+
+    With content set, files are keyed by the hash of their content instead
+    of their path, size and modification time, which also finds copies of
+    files but reads every file.
+    """
+    __slots__ = [
+        'directory',
+        'max_size',
+        'content',
+        '_size',
+    ]
+
+    def __init__(self, directory, max_size=1024 ** 3, content=False):
+        os.makedirs(directory, exist_ok=True)
+
+        self.directory = directory
+        self.max_size = max_size
+        self.content = content
+        self._size = None
+
+    def key(self, struct, path, options):
+        """Return the key of a file parsed with the options by struct"""
+        digest = hashlib.sha1(('%d %s.%s %s %r' % (VERSION, struct.__module__,
+            struct.__name__, parser_version(struct),
+            sorted(options.items()))).encode('utf-8'))
+
+        if self.content:
+            digest.update(_hash_file(path).encode('ascii'))
+        else:
+            stat = os.stat(path)
+            digest.update(('%s %d %d' % (os.path.abspath(path), stat.st_size,
+                stat.st_mtime_ns)).encode('utf-8'))
+
+        return digest.hexdigest()
+
+    def parse(self, struct, path, **options):
+        """Return the struct of a file, which is only parsed on a miss.
+
+        Options are passed to the parse method. Lazy parsing is pointless
+        for cached files, so models are always parsed completely. Arrays
+        of cached structs are read-only, unless the copy option is set.
+        """
+        options.pop('lazy', None)
+        copy = options.get('copy', False)
+
+        entry = os.path.join(self.directory,
+                self.key(struct, path, options) + _SUFFIX)
+
+        try:
+            value = self._load(entry, copy)
+
+            # The modification time orders entries by their last use
+            os.utime(entry)
+            return value
+
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, TypeError, ValidationError):
+            # Truncated or otherwise damaged entries are parsed again
+            self._remove(entry)
+
+        with open(path, 'rb') as stream:
+            value = struct().parse(stream, **options)
+
+        self._store(entry, value)
+        return value
+
+    def _load(self, entry, copy):
+        buffer = utility.map_file(entry)
+        scalars, arrays = bundle.read_entry(buffer, 0, len(buffer))
+        return decode(scalars, arrays, [], copy)
+
+    def _store(self, entry, value):
+        arrays = {}
+        record = encode(value, arrays, {})
+
+        handle, temp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'wb') as stream:
+                _, size = bundle.write_entry(stream, record, arrays)
+
+            # mkstemp creates files only readable by the owner
+            os.chmod(temp, utility.file_mode())
+            os.replace(temp, entry)
+
+        except BaseException:
+            os.unlink(temp)
+            raise
+
+        # Other processes may add entries, so the size is only an estimate
+        # between full scans
+        if self._size is None:
+            self.evict()
+        else:
+            self._size += size
+
+            if self._size > self.max_size:
+                self.evict()
+
+    def _remove(self, path):
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+    def _entries(self):
+        entries = []
+
+        # The scandir context manager needs Python 3.6
+        for name in os.listdir(self.directory):
+            if not name.endswith(_SUFFIX):
+                continue
+
+            path = os.path.join(self.directory, name)
+
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+
+            entries.append((stat.st_mtime_ns, stat.st_size, path))
+
+        return entries
+
+    def size(self):
+        """Return the number of entries and their total size"""
+        entries = self._entries()
+        return len(entries), sum(size for _, size, _ in entries)
+
+    def evict(self):
+        """Remove the least recently used entries exceeding max_size"""
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+
+        for _, size, path in entries:
+            if total <= self.max_size:
+                break
+
+            self._remove(path)
+            total -= size
+
+        self._size = total
+
+    def clear(self):
+        """Remove all entries"""
+        for _, _, path in self._entries():
+            self._remove(path)
+
+        self._size = 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+            description='Inspect or clear a parse cache.')
+
+    parser.add_argument('command', choices=['info', 'clear'],
+            help='info prints the cache size, clear removes all entries')
+    parser.add_argument('directory', help='cache directory')
+    parser.add_argument('--max-size', type=int, default=1024 ** 3,
+            help='maximum size in bytes (default: 1 GiB)')
+
+    args = parser.parse_args(argv)
+
+    cache = ParseCache(args.directory, args.max_size)
+
+    if args.command == 'clear':
+        cache.clear()
+    else:
+        cache.evict()
+
+    count, size = cache.size()
+    print('%d entries, %.1f MB' % (count, size / 1e6))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,256 @@
+#!/usr/bin/python3.5
+
+"""Incremental SQLite catalogue of GB model metadata.
+
+Usage:
+    catalogue.py update [-j JOBS] catalogue root
+    catalogue.py texture catalogue name
+    catalogue.py find [--version VERSION] [--collision | --no-collision] catalogue
+
+The update command walks root, e.g. a client data directory, and parses the
+header and descriptor of every new or modified GB file in a process pool.
+Unchanged files, by size and modification time, are not parsed again.
+"""
+
+import argparse
+import os
+import sqlite3
+import struct
+import sys
+import time
+import utility
+
+from concurrent.futures import ProcessPoolExecutor
+from structs.gb import GBFile
+from utility import ValidationError
+from utility import VersionError
+
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS models (
+    path                 TEXT PRIMARY KEY,
+    size                 INTEGER NOT NULL,
+    mtime                INTEGER NOT NULL,
+    version              INTEGER,
+    bone_count           INTEGER,
+    mesh_count           INTEGER,
+    material_count       INTEGER,
+    animation_count      INTEGER,
+    transformation_count INTEGER,
+    collision            INTEGER,
+    min_x REAL, min_y REAL, min_z REAL,
+    max_x REAL, max_y REAL, max_z REAL,
+    error                TEXT
+);
+
+CREATE TABLE IF NOT EXISTS textures (
+    path    TEXT NOT NULL REFERENCES models (path) ON DELETE CASCADE,
+    texture TEXT NOT NULL,
+    name    TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS textures_texture ON textures (texture);
+CREATE INDEX IF NOT EXISTS textures_name ON textures (name);
+CREATE INDEX IF NOT EXISTS textures_path ON textures (path);
+CREATE INDEX IF NOT EXISTS models_version ON models (version, collision);
+'''
+
+# Parsed models per transaction
+BATCH_SIZE = 1024
+
+_COLUMNS = [
+    'path', 'size', 'mtime', 'version', 'bone_count', 'mesh_count',
+    'material_count', 'animation_count', 'transformation_count',
+    'collision', 'min_x', 'min_y', 'min_z', 'max_x', 'max_y', 'max_z',
+    'error',
+]
+
+
+def connect(path):
+    connection = sqlite3.connect(path)
+    connection.execute('PRAGMA foreign_keys = ON')
+    connection.executescript(_SCHEMA)
+    return connection
+
+def find_models(root):
+    """Yield (relative path, size, mtime) of all GB files below root"""
+    for directory, _, files in os.walk(root):
+        for name in files:
+            if os.path.splitext(name)[1].lower() != '.gb':
+                continue
+
+            path = os.path.join(directory, name)
+
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue  # E.g. a broken link or a file removed meanwhile
+
+            yield (os.path.relpath(path, root).replace(os.sep, '/'),
+                    stat.st_size, stat.st_mtime_ns)
+
+def read_metadata(root, path, size, mtime):
+    """Return a models row and the texture names of a GB file"""
+    row = dict.fromkeys(_COLUMNS)
+    row.update(path=path, size=size, mtime=mtime)
+
+    textures = []
+
+    try:
+        gb = GBFile().parse(utility.map_file(
+                os.path.join(root, path)), lazy=True)
+
+        header = gb.header
+
+        row.update(
+            version=header.version,
+            bone_count=header.bone_count,
+            mesh_count=header.mesh_count,
+            material_count=header.material_count,
+            animation_count=header.animation_count,
+            transformation_count=header.transformation_count,
+            collision=int(bool(header.cls_size)),
+        )
+
+        if header.bounding_box_min is not None:
+            row['min_x'], row['min_y'], row['min_z'] = \
+                    header.bounding_box_min.tolist()
+            row['max_x'], row['max_y'], row['max_z'] = \
+                    header.bounding_box_max.tolist()
+
+        textures = sorted(set(m.texture.lower() for m in gb.materials))
+
+    except (OSError, ValueError, struct.error,
+            ValidationError, VersionError) as e:
+        row['error'] = str(e) or type(e).__name__
+
+    return row, textures
+
+def _read_job(job):
+    return read_metadata(*job)
+
+def update(connection, root, jobs=None):
+    """Synchronize the catalogue with root, returning the statistics"""
+    known = dict(((path, (size, mtime)) for path, size, mtime in
+            connection.execute('SELECT path, size, mtime FROM models')))
+
+    current = list(find_models(root))
+    changed = [(root, path, size, mtime) for path, size, mtime in current
+            if known.get(path) != (size, mtime)]
+
+    removed = set(known) - set(path for path, _, _ in current)
+
+    with connection:
+        connection.executemany('DELETE FROM models WHERE path = ?',
+                [(path,) for path in removed])
+
+    # Rows are committed in batches, so an interrupted run keeps its
+    # progress and the next run only parses the remaining models
+    with ProcessPoolExecutor(jobs) as executor:
+        results = executor.map(_read_job, changed, chunksize=64)
+
+        for i, (row, textures) in enumerate(results, 1):
+            connection.execute('DELETE FROM models WHERE path = ?',
+                    (row['path'],))
+            connection.execute('INSERT INTO models VALUES (%s)' % ', '.join(
+                    '?' * len(_COLUMNS)), [row[c] for c in _COLUMNS])
+            connection.executemany('INSERT INTO textures VALUES (?, ?, ?)',
+                    [(row['path'], texture, _texture_name(texture))
+                        for texture in textures])
+
+            if i % BATCH_SIZE == 0:
+                connection.commit()
+
+    connection.commit()
+
+    return {
+        'total'   : len(current),
+        'parsed'  : len(changed),
+        'removed' : len(removed),
+    }
+
+def _texture_name(texture):
+    """Texture file name without directory and extension"""
+    return os.path.splitext(texture.replace('\\', '/').rsplit('/', 1)[-1])[0]
+
+def find_texture(connection, name):
+    """Return the paths of all models referencing a texture.
+
+    The name matches either the full texture path or the texture file name
+    without directory and extension, ignoring case.
+    """
+    name = name.lower()
+
+    return [path for path, in connection.execute(
+            'SELECT DISTINCT path FROM textures '
+            'WHERE texture = ? OR name = ? ORDER BY path', (name, name))]
+
+def find(connection, version=None, collision=None):
+    """Return the paths of all models matching the given properties"""
+    query = 'SELECT path FROM models WHERE error IS NULL'
+    params = []
+
+    if version is not None:
+        query += ' AND version = ?'
+        params.append(version)
+
+    if collision is not None:
+        query += ' AND collision = ?'
+        params.append(int(collision))
+
+    return [path for path, in connection.execute(query + ' ORDER BY path',
+            params)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+            description='Catalogue GB model metadata.')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    command = commands.add_parser('update', help='update the catalogue')
+    command.add_argument('catalogue')
+    command.add_argument('root', help='asset directory, e.g. data')
+    command.add_argument('-j', '--jobs', type=int, default=None,
+            help='number of worker processes (default: CPU count)')
+
+    command = commands.add_parser('texture',
+            help='list models referencing a texture')
+    command.add_argument('catalogue')
+    command.add_argument('name')
+
+    command = commands.add_parser('find', help='list matching models')
+    command.add_argument('catalogue')
+    command.add_argument('--version', type=int)
+    command.add_argument('--collision', action='store_true', default=None)
+    command.add_argument('--no-collision', dest='collision',
+            action='store_false')
+
+    args = parser.parse_args(argv)
+    connection = connect(args.catalogue)
+
+    if args.command == 'update':
+        start = time.perf_counter()
+        stats = update(connection, args.root, args.jobs)
+
+        print('%d models, %d parsed, %d removed in %.2f s' % (
+            stats['total'], stats['parsed'], stats['removed'],
+            time.perf_counter() - start))
+
+        for path, error in connection.execute(
+                'SELECT path, error FROM models WHERE error IS NOT NULL'):
+            print('Error: %s: %s' % (path, error), file=sys.stderr)
+
+    elif args.command == 'texture':
+        for path in find_texture(connection, args.name):
+            print(path)
+
+    else:
+        for path in find(connection, args.version, args.collision):
+            print(path)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,315 @@
+#!/usr/bin/python3.5
+
+"""Batched ray and box queries on GB collision trees.
+
+The node tree of a GBCollision is a tree without leaf nodes, where each
+child is either another node or a face, as indicated by the L_LEAF and
+R_LEAF flags. The quantized node bounds are too coarse for exact queries,
+so the bounds are recomputed from the faces when the tree is built.
+
+All queries take arrays of points or rays and traverse the tree for all of
+them at once, one tree level per iteration.
+"""
+
+import numpy as np
+
+from structs.gb import GBCollisionNode
+from utility import ValidationError
+
+
+# Face flags, derived from the L_* and R_* flags of the parent node
+HIDDEN = 0x1
+CAMERA = 0x2
+NOPICK = 0x4
+FLOOR  = 0x8
+
+_FACE_FLAGS = [
+    (GBCollisionNode.L_HIDDEN, GBCollisionNode.R_HIDDEN, HIDDEN),
+    (GBCollisionNode.L_CAMERA, GBCollisionNode.R_CAMERA, CAMERA),
+    (GBCollisionNode.L_NOPICK, GBCollisionNode.R_NOPICK, NOPICK),
+    (GBCollisionNode.L_FLOOR,  GBCollisionNode.R_FLOOR,  FLOOR),
+]
+
+# Vertical axis of the model coordinate system
+UP = np.array([0, 1, 0], np.float64)
+
+_EPSILON = 1e-9
+
+
+class CollisionTree(object):
+    """Flat bounding volume hierarchy of a GBCollision.
+
+    Tree indexes below node_count refer to nodes, all other indexes refer
+    to the face at index - node_count.
+    """
+    __slots__ = [
+        'positions',
+        'triangles',
+        'face_flags',
+        'node_count',
+        'children',
+        'box_min',
+        'box_max',
+    ]
+
+    def __init__(self, collision):
+        table = collision.node_table
+
+        self.positions = collision.positions.astype(np.float64)
+        self.triangles = collision.triangles.astype(np.intp)
+        self.node_count = len(table)
+
+        face_count = len(self.triangles)
+
+        if face_count and self.triangles.max() >= len(self.positions):
+            raise ValidationError('Invalid GB collision face')
+
+        # Children as tree indexes
+        leaf_l = (table['flags'] & GBCollisionNode.L_LEAF) != 0
+        leaf_r = (table['flags'] & GBCollisionNode.R_LEAF) != 0
+
+        child_l = table['child_l'].astype(np.intp)
+        child_r = table['child_r'].astype(np.intp)
+
+        if (np.any(child_l[leaf_l] >= face_count)
+                or np.any(child_r[leaf_r] >= face_count)
+                or np.any(child_l[~leaf_l] >= self.node_count)
+                or np.any(child_r[~leaf_r] >= self.node_count)):
+            raise ValidationError('Invalid GB collision node')
+
+        self.children = np.stack([
+            child_l + leaf_l * self.node_count,
+            child_r + leaf_r * self.node_count,
+        ], axis=1)
+
+        # Face flags
+        self.face_flags = np.zeros(face_count, np.uint8)
+        for flag_l, flag_r, flag in _FACE_FLAGS:
+            self.face_flags[child_l[leaf_l & (table['flags'] & flag_l != 0)]] |= flag
+            self.face_flags[child_r[leaf_r & (table['flags'] & flag_r != 0)]] |= flag
+
+        # Bounds of faces followed by the bounds of nodes
+        corners = self.positions[self.triangles]
+
+        self.box_min = np.empty((self.node_count + face_count, 3))
+        self.box_max = np.empty((self.node_count + face_count, 3))
+
+        self.box_min[self.node_count:] = corners.min(axis=1)
+        self.box_max[self.node_count:] = corners.max(axis=1)
+
+        for level in reversed(self._levels()):
+            children = self.children[level]
+            self.box_min[level] = self.box_min[children].min(axis=1)
+            self.box_max[level] = self.box_max[children].max(axis=1)
+
+    def _levels(self):
+        """Node indexes of each tree level, starting with the root"""
+        levels = []
+
+        level = np.arange(min(self.node_count, 1))
+        visited = np.zeros(self.node_count, bool)
+
+        while len(level):
+            if visited[level].any():
+                raise ValidationError('Cyclic GB collision tree')
+
+            visited[level] = True
+            levels.append(level)
+
+            level = self.children[level].ravel()
+            level = np.unique(level[level < self.node_count])
+
+        return levels
+
+    @property
+    def root(self):
+        # The first node, or the only face of a tree without nodes
+        return 0
+
+    @property
+    def bounding_box_min(self):
+        return self.box_min[self.root] if len(self.box_min) else None
+
+    @property
+    def bounding_box_max(self):
+        return self.box_max[self.root] if len(self.box_max) else None
+
+    def _face_mask(self, include, exclude):
+        flags = self.face_flags
+        return ((flags & include) == include) & ((flags & exclude) == 0)
+
+    def ray_cast(self, origins, directions, max_distance=np.inf,
+            include=0, exclude=0):
+        """Return the distance and face of the first hit of each ray.
+
+        Rays without a hit return a distance of inf and a face of -1.
+        Only faces with all include flags and no exclude flag are hit.
+        """
+        origins = np.atleast_2d(np.asarray(origins, np.float64))
+        directions = np.atleast_2d(np.asarray(directions, np.float64))
+        origins, directions = np.broadcast_arrays(origins, directions)
+
+        length = np.linalg.norm(directions, axis=1)
+        valid = length > 0
+        directions = directions / np.where(valid, length, 1)[:, None]
+
+        count = len(origins)
+        distance = np.full(count, np.inf)
+        faces = np.full(count, -1, np.intp)
+
+        if not len(self.triangles):
+            return distance, faces
+
+        limit = np.broadcast_to(np.asarray(max_distance, np.float64),
+                (count,)).copy()
+        limit[~valid] = -1
+
+        # Avoids divisions by zero in the slab test
+        safe = np.where(np.abs(directions) < 1e-30,
+                np.copysign(1e-30, directions), directions)
+        inverse = 1 / safe
+
+        face_mask = self._face_mask(include, exclude)
+
+        rays = np.flatnonzero(valid)
+        nodes = np.full(len(rays), self.root)
+
+        while len(rays):
+            # Slab test against the current bounds
+            t0 = (self.box_min[nodes] - origins[rays]) * inverse[rays]
+            t1 = (self.box_max[nodes] - origins[rays]) * inverse[rays]
+
+            near = np.minimum(t0, t1).max(axis=1)
+            far = np.maximum(t0, t1).min(axis=1)
+
+            bound = np.minimum(distance[rays], limit[rays])
+            hit = (near <= far) & (far >= 0) & (near <= bound)
+
+            rays = rays[hit]
+            nodes = nodes[hit]
+
+            # Face tests
+            leaf = nodes >= self.node_count
+            leaf_rays = rays[leaf]
+            leaf_faces = nodes[leaf] - self.node_count
+
+            enabled = face_mask[leaf_faces]
+            leaf_rays = leaf_rays[enabled]
+            leaf_faces = leaf_faces[enabled]
+
+            t = self._intersect(origins[leaf_rays], directions[leaf_rays],
+                    leaf_faces)
+
+            hit = (t >= 0) & (t <= limit[leaf_rays])
+            self._update_closest(distance, faces,
+                    leaf_rays[hit], t[hit], leaf_faces[hit])
+
+            # Descend into both children
+            rays = np.repeat(rays[~leaf], 2)
+            nodes = self.children[nodes[~leaf]].ravel()
+
+        return distance, faces
+
+    def _update_closest(self, distance, faces, rays, t, candidates):
+        if not len(rays):
+            return
+
+        # Sort by distance, so the first entry per ray is the closest
+        order = np.lexsort((t, rays))
+        rays, t, candidates = rays[order], t[order], candidates[order]
+
+        first = np.ones(len(rays), bool)
+        first[1:] = rays[1:] != rays[:-1]
+
+        rays, t, candidates = rays[first], t[first], candidates[first]
+
+        closer = t < distance[rays]
+        distance[rays[closer]] = t[closer]
+        faces[rays[closer]] = candidates[closer]
+
+    def _intersect(self, origins, directions, faces):
+        """Moeller-Trumbore test, returning the ray distance or -1"""
+        a, b, c = np.moveaxis(self.positions[self.triangles[faces]], 1, 0)
+
+        edge_1 = b - a
+        edge_2 = c - a
+
+        p = np.cross(directions, edge_2)
+        det = np.einsum('ij,ij->i', edge_1, p)
+
+        # Both face sides are hit
+        valid = np.abs(det) > _EPSILON
+        inverse = 1 / np.where(valid, det, 1)
+
+        s = origins - a
+        u = np.einsum('ij,ij->i', s, p) * inverse
+
+        q = np.cross(s, edge_1)
+        v = np.einsum('ij,ij->i', directions, q) * inverse
+        t = np.einsum('ij,ij->i', edge_2, q) * inverse
+
+        valid &= (u >= 0) & (v >= 0) & (u + v <= 1)
+        return np.where(valid, t, -1)
+
+    def segment_test(self, starts, ends, include=0, exclude=0):
+        """Return whether each segment hits a face, e.g. for line of sight"""
+        starts = np.atleast_2d(np.asarray(starts, np.float64))
+        ends = np.atleast_2d(np.asarray(ends, np.float64))
+
+        directions = ends - starts
+        distance, _ = self.ray_cast(starts, directions,
+                np.linalg.norm(directions, axis=1), include, exclude)
+
+        return np.isfinite(distance)
+
+    def contains(self, points):
+        """Return whether each point is inside the collision bounds"""
+        points = np.atleast_2d(np.asarray(points, np.float64))
+
+        if not len(self.triangles):
+            return np.zeros(len(points), bool)
+
+        return np.all((points >= self.bounding_box_min)
+                & (points <= self.bounding_box_max), axis=1)
+
+    def query_aabb(self, box_min, box_max, include=0, exclude=0):
+        """Return the faces, whose bounds overlap the given box"""
+        box_min = np.asarray(box_min, np.float64)
+        box_max = np.asarray(box_max, np.float64)
+
+        if not len(self.triangles):
+            return np.empty(0, np.intp)
+
+        face_mask = self._face_mask(include, exclude)
+
+        result = []
+        nodes = np.array([self.root])
+
+        while len(nodes):
+            overlap = np.all((self.box_min[nodes] <= box_max)
+                    & (self.box_max[nodes] >= box_min), axis=1)
+            nodes = nodes[overlap]
+
+            leaf = nodes >= self.node_count
+            leaf_faces = nodes[leaf] - self.node_count
+            result.append(leaf_faces[face_mask[leaf_faces]])
+
+            nodes = self.children[nodes[~leaf]].ravel()
+
+        return np.unique(np.concatenate(result))
+
+    def nearest_floor(self, points, max_distance=np.inf, exclude=0):
+        """Return the floor height and face below each point.
+
+        Only faces with a FLOOR flag are considered. Points without a
+        floor return a height of nan and a face of -1.
+        """
+        points = np.atleast_2d(np.asarray(points, np.float64))
+
+        distance, faces = self.ray_cast(points, -UP, max_distance,
+                include=FLOOR, exclude=exclude)
+
+        height = points @ UP - distance
+        height[faces < 0] = np.nan
+
+        return height, faces
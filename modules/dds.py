@@ -0,0 +1,227 @@
+#!/usr/bin/python3.5
+
+"""Vectorized reading and writing of DDS images.
+
+Reading supports DXT1, DXT3 and DXT5 compressed images and uncompressed
+images with bit masks. Writing stores uncompressed 32 bit BGRA images with
+all mip levels. Images are (height, width, 4) RGBA uint8 arrays.
+"""
+
+import io
+import numpy as np
+
+from struct import pack
+from utility import ValidationError
+
+import utility
+
+
+_MAGIC = b'DDS '
+
+# Header flags
+_DDSD_CAPS        = 0x1
+_DDSD_HEIGHT      = 0x2
+_DDSD_WIDTH       = 0x4
+_DDSD_PITCH       = 0x8
+_DDSD_PIXELFORMAT = 0x1000
+_DDSD_MIPMAPCOUNT = 0x20000
+
+# Pixel format flags
+_DDPF_ALPHAPIXELS = 0x1
+_DDPF_FOURCC      = 0x4
+_DDPF_RGB         = 0x40
+
+# Caps
+_DDSCAPS_COMPLEX = 0x8
+_DDSCAPS_TEXTURE = 0x1000
+_DDSCAPS_MIPMAP  = 0x400000
+
+
+def _expand_565(colors):
+    """Convert 565 colors to an (..., 3) uint8 array"""
+    colors = colors.astype(np.uint32)
+
+    r = (colors >> 11) & 0x1F
+    g = (colors >> 5) & 0x3F
+    b = colors & 0x1F
+
+    return np.stack([(r << 3) | (r >> 2), (g << 2) | (g >> 4),
+            (b << 3) | (b >> 2)], axis=-1)
+
+def _decode_colors(blocks, transparent):
+    """Decode 8 byte color blocks to (blocks, 16, 4) texels"""
+    c0 = blocks[:, 0:2].copy().view('<u2')[:, 0]
+    c1 = blocks[:, 2:4].copy().view('<u2')[:, 0]
+    indices = blocks[:, 4:8].copy().view('<u4')[:, 0]
+
+    p0 = _expand_565(c0)
+    p1 = _expand_565(c1)
+
+    palette = np.empty((len(blocks), 4, 4), np.uint32)
+    palette[:, :, 3] = 255
+    palette[:, 0, :3] = p0
+    palette[:, 1, :3] = p1
+
+    # DXT1 blocks with c0 <= c1 have three colors and transparent black
+    three = (c0 <= c1) if transparent else np.zeros(len(blocks), bool)
+
+    palette[:, 2, :3] = np.where(three[:, None], (p0 + p1) // 2,
+            (2 * p0 + p1) // 3)
+    palette[:, 3, :3] = np.where(three[:, None], 0, (p0 + 2 * p1) // 3)
+    palette[three, 3, 3] = 0
+
+    shifts = np.arange(16, dtype=np.uint32) * 2
+    selected = (indices[:, None] >> shifts) & 3
+
+    return np.take_along_axis(palette, selected[..., None].astype(np.intp),
+            axis=1).astype(np.uint8)
+
+def _decode_explicit_alpha(blocks):
+    """Decode 8 byte DXT3 alpha blocks to (blocks, 16) values"""
+    values = blocks[:, :8]
+    nibbles = np.stack([values & 0xF, values >> 4], axis=-1).reshape(-1, 16)
+    return (nibbles * 17).astype(np.uint8)
+
+def _decode_interpolated_alpha(blocks):
+    """Decode 8 byte DXT5 alpha blocks to (blocks, 16) values"""
+    a0 = blocks[:, 0].astype(np.uint32)
+    a1 = blocks[:, 1].astype(np.uint32)
+
+    palette = np.empty((len(blocks), 8), np.uint32)
+    palette[:, 0] = a0
+    palette[:, 1] = a1
+
+    eight = a0 > a1
+    for i in range(1, 7):
+        palette[:, i + 1] = np.where(eight, ((7 - i) * a0 + i * a1) // 7, 0)
+    for i in range(1, 5):
+        palette[~eight, i + 1] = (((5 - i) * a0 + i * a1) // 5)[~eight]
+
+    palette[~eight, 6] = 0
+    palette[~eight, 7] = 255
+
+    bits = np.zeros(len(blocks), np.uint64)
+    for i in range(6):
+        bits |= blocks[:, 2 + i].astype(np.uint64) << np.uint64(8 * i)
+
+    shifts = np.arange(16, dtype=np.uint64) * np.uint64(3)
+    selected = ((bits[:, None] >> shifts) & np.uint64(7)).astype(np.intp)
+
+    return np.take_along_axis(palette, selected, axis=1).astype(np.uint8)
+
+def _decode_blocks(data, width, height, fourcc):
+    columns = (width + 3) // 4
+    rows = (height + 3) // 4
+    block_size = 8 if fourcc == b'DXT1' else 16
+
+    if len(data) < columns * rows * block_size:
+        raise ValidationError('Too few bytes in DDS image')
+
+    blocks = np.frombuffer(data, np.uint8, columns * rows * block_size)
+    blocks = blocks.reshape(-1, block_size)
+
+    if fourcc == b'DXT1':
+        texels = _decode_colors(blocks, True)
+    else:
+        texels = _decode_colors(blocks[:, 8:], False)
+
+        if fourcc == b'DXT3':
+            texels[..., 3] = _decode_explicit_alpha(blocks)
+        else:
+            texels[..., 3] = _decode_interpolated_alpha(blocks)
+
+    image = texels.reshape(rows, columns, 4, 4, 4).transpose(0, 2, 1, 3, 4)
+    return image.reshape(rows * 4, columns * 4, 4)[:height, :width]
+
+def _decode_masks(data, width, height, bits, masks, pitch):
+    size = bits // 8
+    pitch = pitch or width * size
+
+    if len(data) < pitch * height:
+        raise ValidationError('Too few bytes in DDS image')
+
+    raw = np.frombuffer(data, np.uint8, pitch * height).reshape(height, pitch)
+    raw = raw[:, :width * size].reshape(height, width, size).astype(np.uint32)
+
+    values = np.zeros((height, width), np.uint32)
+    for i in range(size):
+        values |= raw[..., i] << np.uint32(8 * i)
+
+    image = np.empty((height, width, 4), np.uint8)
+
+    for channel, mask in enumerate(masks):
+        if not mask:
+            image[..., channel] = 255
+            continue
+
+        shift = (mask & -mask).bit_length() - 1
+        maximum = mask >> shift
+
+        image[..., channel] = (((values & np.uint32(mask)) >> np.uint32(shift))
+                * 255 // maximum)
+
+    return image
+
+def read_dds(stream):
+    """Read the first mip level of a DDS image"""
+    stream = utility.as_reader(stream)
+
+    if stream.read(4) != _MAGIC:
+        raise ValidationError('Not a valid DDS image')
+
+    size, flags, height, width, pitch = stream.unpack('<5I')
+    if size != 124:
+        raise ValidationError('Invalid DDS header')
+
+    stream.seek(4 + 72)
+
+    _, pf_flags, fourcc, bits, r, g, b, a = stream.unpack('<2I4s5I')
+
+    stream.seek(4 + 124)
+    data = stream.view(len(stream) - stream.tell())
+
+    if pf_flags & _DDPF_FOURCC:
+        if fourcc not in (b'DXT1', b'DXT3', b'DXT5'):
+            raise ValidationError('DDS format %s is unsupported' %
+                    fourcc.decode('ascii', 'replace'))
+
+        return _decode_blocks(data, width, height, fourcc)
+
+    if not pf_flags & _DDPF_ALPHAPIXELS:
+        a = 0
+
+    if bits not in (16, 24, 32):
+        raise ValidationError('DDS bit count %d is unsupported' % bits)
+
+    return _decode_masks(data, width, height, bits, (r, g, b, a),
+            pitch if flags & _DDSD_PITCH else 0)
+
+def read_gtx(stream):
+    """Read the first mip level of a GTX image"""
+    target = io.BytesIO()
+    utility.decrypt_gtx(stream, target)
+    return read_dds(target.getbuffer())
+
+def write_dds(stream, levels):
+    """Write RGBA images of decreasing size as an uncompressed DDS image"""
+    height, width = levels[0].shape[:2]
+
+    flags = (_DDSD_CAPS | _DDSD_HEIGHT | _DDSD_WIDTH | _DDSD_PITCH |
+            _DDSD_PIXELFORMAT)
+    caps = _DDSCAPS_TEXTURE
+
+    if len(levels) > 1:
+        flags |= _DDSD_MIPMAPCOUNT
+        caps |= _DDSCAPS_COMPLEX | _DDSCAPS_MIPMAP
+
+    stream.write(_MAGIC)
+    stream.write(pack('<7I', 124, flags, height, width, width * 4, 0,
+        len(levels)))
+    stream.write(bytes(44))
+    stream.write(pack('<2I4s5I', 32, _DDPF_RGB | _DDPF_ALPHAPIXELS, bytes(4),
+        32, 0xFF0000, 0xFF00, 0xFF, 0xFF000000))
+    stream.write(pack('<5I', caps, 0, 0, 0, 0))
+
+    for level in levels:
+        # RGBA to BGRA
+        stream.write(np.ascontiguousarray(level[..., [2, 1, 0, 3]]).tobytes())
@@ -0,0 +1,184 @@
+#!/usr/bin/python3.5
+
+"""Converts directories of GTX images to DDS images and vice versa.
+
+Usage: gtx.py [-h] [-j JOBS] [--content] {decrypt,encrypt} source target
+
+Every image below source is written to the same relative path below target,
+where source and target may be the same directory. Images whose output is
+already up to date are skipped, which allows an interrupted run to resume.
+"""
+
+import argparse
+import hashlib
+import os
+import sys
+import tempfile
+import time
+import utility
+
+from concurrent.futures import ProcessPoolExecutor
+from utility import ValidationError
+
+
+# Mode: (source extension, target extension, conversion)
+MODES = {
+    'decrypt' : ('.gtx', '.dds', utility.decrypt_gtx),
+    'encrypt' : ('.dds', '.gtx', utility.encrypt_dds),
+}
+
+# Both formats share a 72 byte header, the remaining bytes are identical
+_HEADER_SIZE = 72
+
+# Result states
+CONVERTED = 0
+SKIPPED   = 1
+FAILED    = 2
+
+
+def _hash_tail(path):
+    digest = hashlib.sha1()
+
+    with open(path, 'rb') as stream:
+        stream.seek(_HEADER_SIZE)
+        for data in iter(lambda: stream.read(1024 * 1024), b''):
+            digest.update(data)
+
+    return digest.digest()
+
+def is_up_to_date(source, target, content=False):
+    """Compare by size and modification time, or by the image content"""
+    try:
+        source_stat = os.stat(source)
+        target_stat = os.stat(target)
+    except FileNotFoundError:
+        return False
+
+    if source_stat.st_size != target_stat.st_size:
+        return False
+
+    if not content:
+        return source_stat.st_mtime_ns == target_stat.st_mtime_ns
+
+    return _hash_tail(source) == _hash_tail(target)
+
+def convert_file(source, target, mode, content=False):
+    """Convert a single image, writing the target atomically"""
+    convert = MODES[mode][2]
+
+    if is_up_to_date(source, target, content):
+        return SKIPPED
+
+    directory = os.path.dirname(target) or '.'
+    os.makedirs(directory, exist_ok=True)
+
+    handle, temp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with open(source, 'rb') as src, os.fdopen(handle, 'wb') as dst:
+            convert(src, dst)
+
+        # The source time marks the target as up to date, mkstemp creates
+        # the file only readable by the owner
+        stat = os.stat(source)
+        os.chmod(temp, stat.st_mode & 0o777)
+        os.utime(temp, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        os.replace(temp, target)
+
+    except BaseException:
+        os.unlink(temp)
+        raise
+
+    return CONVERTED
+
+def _convert_job(job):
+    source, target, mode, content = job
+
+    try:
+        return convert_file(source, target, mode, content), source, None
+    except (OSError, ValidationError) as e:
+        return FAILED, source, str(e)
+
+def find_images(source, target, mode):
+    """Yield (source, target) paths of all images below source"""
+    source_ext, target_ext, _ = MODES[mode]
+
+    for root, _, files in os.walk(source):
+        for name in files:
+            base, ext = os.path.splitext(name)
+            if ext.lower() != source_ext:
+                continue
+
+            # Keep the case of the extension
+            ext = target_ext.upper() if ext.isupper() else target_ext
+
+            yield (os.path.join(root, name), os.path.join(target,
+                    os.path.relpath(root, source), base + ext))
+
+def convert_directory(source, target, mode, content=False, jobs=None):
+    """Convert all images below source, returning the result statistics"""
+    images = [(s, t, mode, content) for s, t in
+            find_images(source, target, mode)]
+
+    counts = [0, 0, 0]
+    size = 0
+    errors = []
+
+    start = time.perf_counter()
+
+    with ProcessPoolExecutor(jobs) as executor:
+        results = executor.map(_convert_job, images, chunksize=64)
+
+        for state, path, error in results:
+            counts[state] += 1
+
+            if state == CONVERTED:
+                size += os.path.getsize(path)
+            elif state == FAILED:
+                errors.append((path, error))
+
+    elapsed = time.perf_counter() - start
+
+    return {
+        'converted' : counts[CONVERTED],
+        'skipped'   : counts[SKIPPED],
+        'failed'    : counts[FAILED],
+        'errors'    : errors,
+        'bytes'     : size,
+        'seconds'   : elapsed,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+            description='Convert GTX images to DDS images and vice versa.')
+
+    parser.add_argument('mode', choices=sorted(MODES),
+            help='decrypt converts GTX to DDS, encrypt DDS to GTX')
+    parser.add_argument('source', help='source directory')
+    parser.add_argument('target', help='target directory')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+            help='number of worker processes (default: CPU count)')
+    parser.add_argument('--content', action='store_true',
+            help='detect up to date images by content instead of mtime')
+
+    args = parser.parse_args(argv)
+
+    stats = convert_directory(args.source, args.target, args.mode,
+            content=args.content, jobs=args.jobs)
+
+    for path, error in stats['errors']:
+        print('Error: %s: %s' % (path, error), file=sys.stderr)
+
+    seconds = max(stats['seconds'], 1e-9)
+    total = stats['converted'] + stats['skipped'] + stats['failed']
+
+    print('%d converted, %d skipped, %d failed' % (
+        stats['converted'], stats['skipped'], stats['failed']))
+    print('%.1f files/s, %.1f MB/s' % (
+        total / seconds, stats['bytes'] / seconds / 1e6))
+
+    return 1 if stats['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,527 @@
+#!/usr/bin/python3.5
+
+"""World-wide movement and zone queries on KSM tiles.
+
+KSM files do not store their tile coordinates, so they are taken from the
+file name, e.g. n_031_035.ksm is the tile x = 31, y = 35. Every tile holds
+256x256 cells, where the cell at row r and column c of tile (x, y) is the
+world cell (x * TILE_SIZE + c, y * TILE_SIZE + r).
+
+Cells with a move value are walkable. Paths move to any of the 8 adjacent
+cells, but do not cut corners, so diagonal moves need both orthogonal
+neighbours to be walkable as well.
+"""
+
+import heapq
+import math
+import os
+import re
+import numpy as np
+
+from collections import OrderedDict
+
+from structs.ksm import KSMFile
+from utility import ValidationError
+
+
+TILE_SIZE = KSMFile.SIZE
+
+# Flag of the boolean move value, next to the KSM zone flags
+MOVE = 0x20
+
+# Flag of each bit plane
+PLANES = [
+    KSMFile.PORTAL,
+    KSMFile.TOWN,
+    KSMFile.SAFE,
+    KSMFile.CASTLE_ATK,
+    KSMFile.CASTLE_DEF,
+    MOVE,
+]
+
+_SQRT2 = math.sqrt(2)
+
+_NAME = re.compile(r'(\d+)_(\d+)\.ksm$', re.IGNORECASE)
+
+
+def find_tiles(source):
+    """Return the tile coordinates and paths of all KSM files below source"""
+    tiles = {}
+
+    for root, _, files in os.walk(source):
+        for name in files:
+            match = _NAME.search(name)
+            if match is None:
+                continue
+
+            x, y = int(match.group(1)), int(match.group(2))
+            path = os.path.join(root, name)
+
+            if (x, y) in tiles:
+                raise ValidationError('Duplicate KSM tile %d, %d: %s' % (
+                    x, y, path))
+
+            tiles[x, y] = path
+
+    return tiles
+
+
+class ZoneIndex(object):
+    """Bit-packed move and zone flags of all KSM tiles of a map.
+
+    Each flag is stored as a bit plane of one bit per world cell, so an
+    index needs 6 bits per cell instead of the 32 bits of a KSM area. Cells
+    outside of any tile have no flags.
+    """
+    __slots__ = [
+        'x',
+        'y',
+        'tiles',
+        'planes',
+    ]
+
+    def build(self, tiles):
+        """Build the index of {(x, y): KSMFile or path} tiles"""
+        if not tiles:
+            raise ValidationError('No KSM tiles found')
+
+        xs = [x for x, _ in tiles]
+        ys = [y for _, y in tiles]
+
+        self.x, self.y = min(xs), min(ys)
+
+        self.tiles = np.zeros((max(ys) - self.y + 1, max(xs) - self.x + 1),
+                bool)
+
+        self.planes = np.zeros((len(PLANES),
+            self.tiles.shape[0] * TILE_SIZE,
+            self.tiles.shape[1] * TILE_SIZE // 8), np.uint8)
+
+        for (x, y), ksm in tiles.items():
+            if not isinstance(ksm, KSMFile):
+                with open(ksm, 'rb') as stream:
+                    ksm = KSMFile().parse(stream)
+
+            self.tiles[y - self.y, x - self.x] = True
+
+            row = (y - self.y) * TILE_SIZE
+            col = (x - self.x) * TILE_SIZE // 8
+
+            target = self.planes[:, row:row + TILE_SIZE, col:col + TILE_SIZE // 8]
+
+            for i, flag in enumerate(PLANES):
+                if flag == MOVE:
+                    cells = ksm.area['move'] != 0
+                else:
+                    cells = (ksm.area['zone'] & flag) != 0
+
+                target[i] = np.packbits(cells, axis=1)
+
+        return self
+
+    def load(self, source):
+        """Build the index of all KSM files below source"""
+        return self.build(find_tiles(source))
+
+    @property
+    def shape(self):
+        """Number of (rows, columns) of world cells"""
+        return self.planes.shape[1], self.planes.shape[2] * 8
+
+    def _cells(self, positions):
+        """Return the index cells of world positions and their validity"""
+        positions = np.atleast_2d(np.asarray(positions))
+
+        if positions.dtype.kind == 'f':
+            positions = np.floor(positions)
+
+        col = positions[:, 0].astype(np.intp) - self.x * TILE_SIZE
+        row = positions[:, 1].astype(np.intp) - self.y * TILE_SIZE
+
+        rows, cols = self.shape
+        valid = (row >= 0) & (row < rows) & (col >= 0) & (col < cols)
+
+        return np.where(valid, row, 0), np.where(valid, col, 0), valid
+
+    def flags(self, positions, mask=0xFF):
+        """Return the flags of world positions of shape (n, 2) as [x, y].
+
+        Only the planes of flags in mask are looked up.
+        """
+        row, col, valid = self._cells(positions)
+
+        result = np.zeros(len(row), np.uint8)
+        shift = (7 - (col & 7)).astype(np.uint8)
+
+        for i, flag in enumerate(PLANES):
+            if flag & mask:
+                bits = (self.planes[i, row, col >> 3] >> shift) & 1
+                result |= bits * np.uint8(flag)
+
+        result[~valid] = 0
+        return result
+
+    def test(self, positions, flags):
+        """Return whether any of the flags is set at each world position"""
+        return self.flags(positions, flags) != 0
+
+    def plane(self, flag):
+        """Return the unpacked boolean cells of a single flag"""
+        return np.unpackbits(self.planes[PLANES.index(flag)], axis=1).view(bool)
+
+
+def label_regions(walkable):
+    """Label the 4-connected regions of a boolean grid.
+
+    Returns an int32 grid, where blocked cells are 0 and the regions are
+    numbered from 1. Regions are merged by hooking the larger root onto
+    the smaller one along all edges at once, followed by pointer jumping,
+    which needs a logarithmic number of iterations for most grids.
+    """
+    walkable = np.asarray(walkable, bool)
+    rows, cols = walkable.shape
+
+    cells = np.flatnonzero(walkable)
+    index = np.full(walkable.size, -1, np.int64)
+    index[cells] = np.arange(len(cells))
+
+    # Edges between walkable neighbours, as indexes into cells
+    pairs = []
+
+    horizontal = walkable[:, :-1] & walkable[:, 1:]
+    a = np.flatnonzero(horizontal)
+    a = a // (cols - 1) * cols + a % (cols - 1)
+    pairs.append((a, a + 1))
+
+    vertical = walkable[:-1] & walkable[1:]
+    a = np.flatnonzero(vertical)
+    pairs.append((a, a + cols))
+
+    a = index[np.concatenate([p[0] for p in pairs])]
+    b = index[np.concatenate([p[1] for p in pairs])]
+
+    parent = np.arange(len(cells), dtype=np.int64)
+
+    while len(a):
+        root_a = parent[a]
+        root_b = parent[b]
+
+        merge = root_a != root_b
+        a, b = a[merge], b[merge]
+
+        if not len(a):
+            break
+
+        root_a, root_b = root_a[merge], root_b[merge]
+        np.minimum.at(parent, np.maximum(root_a, root_b),
+                np.minimum(root_a, root_b))
+
+        while True:
+            jumped = parent[parent]
+            if np.array_equal(jumped, parent):
+                break
+            parent = jumped
+
+    labels = np.zeros(walkable.size, np.int32)
+    labels[cells] = np.unique(parent, return_inverse=True)[1].reshape(-1) + 1
+
+    return labels.reshape(walkable.shape)
+
+
+def _jump_tables(walkable):
+    """Return the next straight jump point of each cell and direction.
+
+    The tables map each step of a flat index to an int32 grid, which holds
+    the flat index of the first cell in that direction, that is blocked or
+    has a forced neighbour, i.e. a side opening behind an obstacle. The grid
+    must have a blocked border.
+    """
+    rows, cols = walkable.shape
+    flat = np.arange(rows * cols, dtype=np.int32).reshape(rows, cols)
+
+    def shifted(row, col):
+        # Value of the cell at (r + row, c + col), wrapping only on the border
+        return np.roll(walkable, (-row, -col), axis=(0, 1))
+
+    tables = {}
+
+    for row, col in [(0, 1), (0, -1), (1, 0), (-1, 0)]:
+        stop = ~walkable
+        for side in [(col, row), (-col, -row)]:
+            stop |= shifted(*side) & ~shifted(side[0] - row, side[1] - col)
+
+        # Scan along the second axis in positive direction
+        if row:
+            stop = stop.T
+        if row + col < 0:
+            stop = stop[:, ::-1]
+
+        count = stop.shape[1]
+        marked = np.where(stop, np.arange(count, dtype=np.int32), count)
+
+        # Nearest stop after each cell
+        following = np.minimum.accumulate(marked[:, ::-1], axis=1)[:, ::-1]
+        distance = np.empty_like(following)
+        distance[:, :-1] = following[:, 1:]
+        distance[:, -1] = count
+        distance -= np.arange(count, dtype=np.int32)
+
+        if row + col < 0:
+            distance = distance[:, ::-1]
+        if row:
+            distance = distance.T
+
+        step = row * cols + col
+        tables[step] = np.clip(flat + distance * step, 0, rows * cols - 1
+                ).astype(np.int32)
+
+    return tables
+
+
+class PathFinder(object):
+    """Jump point search on the walkable cells of a ZoneIndex.
+
+    Jump point search is an A* search, which only expands cells where the
+    direction of an optimal path can change, so straight and diagonal runs
+    of open cells are skipped without touching the queue. Connected regions
+    are labelled once, so paths between different regions are rejected
+    without a search. Found paths are kept in a cache of the most recently
+    used routes.
+    """
+    __slots__ = [
+        'x',
+        'y',
+        'walkable',
+        'labels',
+        'cache_size',
+        '_stride',
+        '_cells',
+        '_jumps',
+        '_routes',
+    ]
+
+    def __init__(self, zones, cache_size=1024):
+        self.x = zones.x * TILE_SIZE
+        self.y = zones.y * TILE_SIZE
+
+        self.walkable = zones.plane(MOVE)
+        self.labels = label_regions(self.walkable)
+
+        self.cache_size = cache_size
+
+        # A blocked border removes all bounds checks from the search, and
+        # indexing a memoryview is much faster than indexing an array
+        padded = np.pad(self.walkable, 1)
+
+        self._stride = padded.shape[1]
+        self._cells = memoryview(padded.view(np.uint8).reshape(-1))
+        self._jumps = dict((step, memoryview(table.reshape(-1)))
+                for step, table in _jump_tables(padded).items())
+        self._routes = OrderedDict()
+
+    def _local(self, positions):
+        """Return the grid rows and columns of world positions"""
+        positions = np.atleast_2d(np.asarray(positions))
+
+        if positions.dtype.kind == 'f':
+            positions = np.floor(positions)
+
+        positions = positions.astype(np.intp)
+        return positions[:, 1] - self.y, positions[:, 0] - self.x
+
+    def region(self, positions):
+        """Return the region label of world positions, 0 if blocked"""
+        row, col = self._local(positions)
+        rows, cols = self.labels.shape
+
+        valid = (row >= 0) & (row < rows) & (col >= 0) & (col < cols)
+        result = np.zeros(len(row), np.int32)
+        result[valid] = self.labels[row[valid], col[valid]]
+
+        return result
+
+    def reachable(self, starts, goals):
+        """Return whether a path exists between each start and goal"""
+        start = self.region(starts)
+        return (start != 0) & (start == self.region(goals))
+
+    def find_path(self, start, goal):
+        """Return the world cells of a shortest path or None.
+
+        The path is an (n, 2) array of [x, y] cells, including start and
+        goal. Diagonal moves cost sqrt(2), all other moves cost 1.
+        """
+        if not self.reachable(start, goal)[0]:
+            return None
+
+        rows, cols = self._local([start, goal])
+        start = (int(rows[0]) + 1) * self._stride + int(cols[0]) + 1
+        goal = (int(rows[1]) + 1) * self._stride + int(cols[1]) + 1
+
+        # Paths are cached in one direction only, since costs are symmetric
+        reverse = goal < start
+        key = (goal, start) if reverse else (start, goal)
+
+        path = self._routes.get(key)
+
+        if path is None:
+            path = self._search(*key)
+            self._routes[key] = path
+
+            if len(self._routes) > self.cache_size:
+                self._routes.popitem(last=False)
+        else:
+            self._routes.move_to_end(key)
+
+        if reverse:
+            path = path[::-1]
+
+        return np.stack([path % self._stride - 1 + self.x,
+                path // self._stride - 1 + self.y], axis=1)
+
+    def _jump_straight(self, node, step, goal):
+        """Follow a straight run, returning the next jump point or -1"""
+        point = self._jumps[step][node]
+
+        # The goal ends the run early
+        offset = goal - node
+        if offset % step == 0 and 0 < offset // step < (point - node) // step:
+            return goal
+
+        return point if self._cells[point] else -1
+
+    def _jump_diagonal(self, node, step_x, step_y, goal):
+        """Follow a diagonal run, returning the next jump point or -1"""
+        cells = self._cells
+
+        while True:
+            node += step_x + step_y
+
+            if not cells[node]:
+                return -1
+
+            if node == goal:
+                return node
+
+            if (self._jump_straight(node, step_x, goal) >= 0 or
+                    self._jump_straight(node, step_y, goal) >= 0):
+                return node
+
+            # Corners are not cut
+            if not (cells[node + step_x] and cells[node + step_y]):
+                return -1
+
+    def _directions(self, node, parent):
+        """Return the pruned (step x, step y) directions to search from node"""
+        cells = self._cells
+        stride = self._stride
+
+        if parent < 0:
+            x = [step for step in (-1, 1) if cells[node + step]]
+            y = [step for step in (-stride, stride) if cells[node + step]]
+
+            return ([(step, 0) for step in x] + [(0, step) for step in y] +
+                    [(sx, sy) for sx in x for sy in y
+                        if cells[node + sx + sy]])
+
+        row, col = divmod(node, stride)
+        parent_row, parent_col = divmod(parent, stride)
+
+        step_x = (col > parent_col) - (col < parent_col)
+        step_y = ((row > parent_row) - (row < parent_row)) * stride
+
+        result = []
+
+        if step_x and step_y:
+            open_x = cells[node + step_x]
+            open_y = cells[node + step_y]
+
+            if open_x:
+                result.append((step_x, 0))
+            if open_y:
+                result.append((0, step_y))
+            if open_x and open_y:
+                result.append((step_x, step_y))
+
+            return result
+
+        # Straight moves continue, and turn towards open sides
+        step = step_x or step_y
+        side = stride if step_x else 1
+
+        ahead = cells[node + step]
+
+        for offset in (-side, side):
+            if cells[node + offset]:
+                if ahead and cells[node + step + offset]:
+                    result.append((step, offset) if step_x else
+                            (offset, step))
+                result.append((0, offset) if step_x else (offset, 0))
+
+        if ahead:
+            result.append((step_x, step_y))
+
+        return result
+
+    def _search(self, start, goal):
+        """A* over jump points, returning the padded indexes of the path"""
+        stride = self._stride
+        diagonal = _SQRT2 - 2
+
+        goal_row, goal_col = divmod(goal, stride)
+
+        def distance(node, row, col):
+            dy = abs(node // stride - row)
+            dx = abs(node % stride - col)
+            return dx + dy + diagonal * min(dx, dy)
+
+        cost = {start: 0}
+        previous = {start: -1}
+        queue = [(distance(start, goal_row, goal_col), 0, start)]
+
+        while queue:
+            _, g, node = heapq.heappop(queue)
+
+            if node == goal:
+                break
+
+            if g > cost[node]:
+                continue  # Outdated entry
+
+            row, col = divmod(node, stride)
+
+            for step_x, step_y in self._directions(node, previous[node]):
+                if step_x and step_y:
+                    point = self._jump_diagonal(node, step_x, step_y, goal)
+                else:
+                    point = self._jump_straight(node, step_x or step_y, goal)
+
+                if point < 0:
+                    continue
+
+                point_cost = g + distance(point, row, col)
+
+                if point_cost < cost.get(point, math.inf):
+                    cost[point] = point_cost
+                    previous[point] = node
+                    heapq.heappush(queue, (point_cost +
+                        distance(point, goal_row, goal_col), point_cost, point))
+
+        # Fill in the cells between jump points
+        path = [goal]
+        node = goal
+
+        while node != start:
+            parent = previous[node]
+
+            row, col = divmod(node, stride)
+            parent_row, parent_col = divmod(parent, stride)
+
+            step = (((parent_row > row) - (parent_row < row)) * stride +
+                    (parent_col > col) - (parent_col < col))
+
+            while node != parent:
+                node += step
+                path.append(node)
+
+        return np.array(path[::-1], np.intp)
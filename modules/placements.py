@@ -0,0 +1,259 @@
+#!/usr/bin/python3.5
+
+"""Spatial index over the object placements of all OPL tiles of a map.
+
+Placements are sorted into a uniform grid of cubic cells, where only
+occupied cells are stored. All queries take batches of spheres, boxes or
+frustums and return (query, placement) index pairs sorted by query, so a
+single call answers e.g. which objects are near 10k positions. Positions
+are indexed as stored in the OPL files.
+"""
+
+import os
+import numpy as np
+
+from structs.opl import OPLFile
+from utility import ValidationError
+
+
+def find_tiles(source):
+    """Return the paths of all OPL files below source"""
+    paths = []
+
+    for root, _, files in os.walk(source):
+        for name in files:
+            if os.path.splitext(name)[1].lower() == '.opl':
+                paths.append(os.path.join(root, name))
+
+    return sorted(paths)
+
+
+class PlacementIndex(object):
+    """Uniform grid of the placements of many OPL files.
+
+    positions, rotations and scales hold one row per placement, paths is
+    the table of distinct model paths referenced by path_ids, and tiles
+    holds the (x, y) tile of each placement.
+    """
+    __slots__ = [
+        'positions',
+        'rotations',
+        'scales',
+        'path_ids',
+        'paths',
+        'tiles',
+        'cell_size',
+        '_origin',
+        '_shape',
+        '_order',
+        '_cells',
+        '_starts',
+    ]
+
+    def build(self, opls, cell_size=None):
+        """Build the index of OPLFile objects.
+
+        Without a cell size, cells are sized to hold about two placements
+        on average.
+        """
+        opls = list(opls)
+        paths = {}
+
+        # Maps the path ids of each file to ids into the combined table
+        path_ids = []
+        for opl in opls:
+            table = np.array([paths.setdefault(path, len(paths))
+                    for path in opl.paths], np.uint32)
+            path_ids.append(table[opl.path_ids])
+
+        def combine(arrays, shape, dtype):
+            return np.concatenate([np.zeros(shape, dtype)] + arrays)
+
+        self.positions = combine([o.positions for o in opls], (0, 3), np.float32)
+        self.rotations = combine([o.rotations for o in opls], (0, 4), np.float32)
+        self.scales = combine([o.scales for o in opls], (0, 3), np.float32)
+        self.path_ids = combine(path_ids, 0, np.uint32)
+        self.paths = sorted(paths, key=paths.get)
+        self.tiles = combine([np.tile(np.array([[o.x, o.y]], np.uint32),
+            (len(o.path_ids), 1)) for o in opls], (0, 2), np.uint32)
+
+        self._build_grid(cell_size)
+        return self
+
+    def load(self, source, cell_size=None):
+        """Build the index of all OPL files below source"""
+        opls = []
+
+        for path in find_tiles(source):
+            with open(path, 'rb') as stream:
+                opls.append(OPLFile().parse(stream))
+
+        return self.build(opls, cell_size)
+
+    def _build_grid(self, cell_size):
+        positions = self.positions.astype(np.float64)
+        count = len(positions)
+
+        if count:
+            low = positions.min(axis=0)
+            extent = positions.max(axis=0) - low
+        else:
+            low = extent = np.zeros(3)
+
+        if cell_size is None:
+            # Degenerate axes, e.g. a flat map, do not count
+            axes = extent[extent > 0]
+            if len(axes):
+                cell_size = float((np.prod(axes) * 2 / count) ** (1 / len(axes)))
+            else:
+                cell_size = 1.0
+
+        if cell_size <= 0:
+            raise ValidationError('Invalid cell size')
+
+        self.cell_size = cell_size
+
+        self._origin = low
+        self._shape = (extent // cell_size).astype(np.int64) + 1
+
+        keys = self._keys(self._cell(positions))
+
+        self._order = np.argsort(keys, kind='stable')
+        self._cells, starts = np.unique(keys[self._order], return_index=True)
+        self._starts = np.append(starts, count)
+
+    def __len__(self):
+        return len(self.positions)
+
+    def _cell(self, points):
+        return np.floor((points - self._origin) / self.cell_size).astype(np.int64)
+
+    def _keys(self, cells):
+        return (cells[:, 0] * self._shape[1] + cells[:, 1]) * self._shape[2] + cells[:, 2]
+
+    def _candidates(self, box_min, box_max):
+        """Return the (query, placement) pairs of all cells overlapping boxes"""
+        low = self._cell(box_min)
+        high = self._cell(box_max)
+
+        valid = np.all((high >= 0) & (low < self._shape) & (low <= high), axis=1)
+
+        low = np.clip(low, 0, self._shape - 1)
+        high = np.clip(high, 0, self._shape - 1)
+
+        size = np.where(valid[:, None], high - low + 1, 0)
+        counts = size.prod(axis=1)
+
+        # Enumerate the cells of all boxes at once
+        query = np.repeat(np.arange(len(counts)), counts)
+        local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts,
+                counts)
+
+        size = size[query]
+        cells = low[query] + np.stack([
+            local // (size[:, 1] * size[:, 2]),
+            local // size[:, 2] % size[:, 1],
+            local % size[:, 2],
+        ], axis=1)
+
+        keys = self._keys(cells)
+
+        index = np.searchsorted(self._cells, keys)
+        index = np.minimum(index, len(self._cells) - 1)
+        occupied = self._cells[index] == keys if len(self._cells) else keys < 0
+
+        query = query[occupied]
+        index = index[occupied]
+
+        # Enumerate the placements of all occupied cells
+        starts = self._starts[index]
+        counts = self._starts[index + 1] - starts
+
+        query = np.repeat(query, counts)
+        local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts,
+                counts)
+
+        return query, self._order[np.repeat(starts, counts) + local]
+
+    def query_radius(self, points, radius):
+        """Return the pairs of points and placements within radius of them"""
+        points = np.atleast_2d(np.asarray(points, np.float64))
+        radius = np.broadcast_to(np.asarray(radius, np.float64), len(points))
+
+        query, nodes = self._candidates(points - radius[:, None],
+                points + radius[:, None])
+
+        distance = self.positions[nodes] - points[query]
+        inside = np.einsum('ij,ij->i', distance, distance) <= radius[query] ** 2
+
+        return query[inside], nodes[inside]
+
+    def query_aabb(self, box_min, box_max):
+        """Return the pairs of boxes and placements inside of them"""
+        box_min = np.atleast_2d(np.asarray(box_min, np.float64))
+        box_max = np.atleast_2d(np.asarray(box_max, np.float64))
+
+        query, nodes = self._candidates(box_min, box_max)
+
+        positions = self.positions[nodes]
+        inside = np.all((positions >= box_min[query]) &
+                (positions <= box_max[query]), axis=1)
+
+        return query[inside], nodes[inside]
+
+    def query_frustum(self, planes, radius=0):
+        """Return the pairs of frustums and placements inside of them.
+
+        planes has the shape (frustums, planes, 4), where each plane [a, b,
+        c, d] faces inwards, i.e. a * x + b * y + c * z + d >= 0 inside.
+        Placements are spheres of radius, so partially visible objects are
+        included.
+        """
+        planes = np.asarray(planes, np.float64)
+        if planes.ndim == 2:
+            planes = planes[None]
+
+        normals = planes[..., :3]
+        distances = planes[..., 3]
+
+        # Occupied cell bounds
+        shape = self._shape
+        cells = np.stack([
+            self._cells // (shape[1] * shape[2]),
+            self._cells // shape[2] % shape[1],
+            self._cells % shape[2],
+        ], axis=1)
+
+        cell_min = self._origin + cells * self.cell_size
+        cell_max = cell_min + self.cell_size
+
+        result_query = []
+        result_nodes = []
+
+        for i in range(len(planes)):
+            # Corner of each cell furthest along each plane normal
+            positive = normals[i] >= 0
+            corners = np.where(positive[:, None], cell_max[None], cell_min[None])
+
+            visible = np.all(np.einsum('pj,pcj->pc', normals[i], corners) +
+                    distances[i][:, None] >= -radius, axis=0)
+
+            index = np.flatnonzero(visible)
+            starts = self._starts[index]
+            counts = self._starts[index + 1] - starts
+
+            local = np.arange(counts.sum()) - np.repeat(
+                    np.cumsum(counts) - counts, counts)
+            nodes = self._order[np.repeat(starts, counts) + local]
+
+            inside = np.all(self.positions[nodes] @ normals[i].T +
+                    distances[i] >= -radius, axis=1)
+
+            nodes = np.sort(nodes[inside])
+            result_query.append(np.full(len(nodes), i, np.intp))
+            result_nodes.append(nodes)
+
+        if not result_query:
+            return np.empty(0, np.intp), np.empty(0, np.intp)
+
+        return np.concatenate(result_query), np.concatenate(result_nodes)
@@ -0,0 +1,229 @@
+#!/usr/bin/python3.5
+
+"""Vectorized skeletal pose evaluation for GB animations.
+
+All matrices transform column vectors, i.e. the translation is stored in
+the last column, which matches GBBone.matrix and the Blender importer.
+"""
+
+import numpy as np
+
+from utility import ValidationError
+
+
+NO_PARENT = 0xFF
+
+
+def quaternion_matrices(rotations):
+    """Convert [w, x, y, z] quaternions of shape (..., 4) to 3x3 matrices"""
+    w, x, y, z = np.moveaxis(np.asarray(rotations, np.float64), -1, 0)
+
+    result = np.empty(w.shape + (3, 3))
+
+    result[..., 0, 0] = 1 - 2 * (y * y + z * z)
+    result[..., 0, 1] = 2 * (x * y - w * z)
+    result[..., 0, 2] = 2 * (x * z + w * y)
+    result[..., 1, 0] = 2 * (x * y + w * z)
+    result[..., 1, 1] = 1 - 2 * (x * x + z * z)
+    result[..., 1, 2] = 2 * (y * z - w * x)
+    result[..., 2, 0] = 2 * (x * z - w * y)
+    result[..., 2, 1] = 2 * (y * z + w * x)
+    result[..., 2, 2] = 1 - 2 * (x * x + y * y)
+
+    return result
+
+def compose_matrices(positions, rotations, scales):
+    """Build translation * rotation * scale matrices of shape (..., 4, 4)"""
+    positions = np.asarray(positions, np.float64)
+    scales = np.asarray(scales, np.float64)
+
+    result = np.zeros(positions.shape[:-1] + (4, 4))
+
+    result[..., :3, :3] = quaternion_matrices(rotations) * scales[..., None, :]
+    result[..., :3, 3] = positions
+    result[..., 3, 3] = 1
+
+    return result
+
+def transformation_matrices(transformations):
+    """Build the matrices of a list of GBTransformation objects"""
+    if not transformations:
+        return np.zeros((0, 4, 4))
+
+    return compose_matrices(
+        [t.position for t in transformations],
+        [t.rotation for t in transformations],
+        [t.scale for t in transformations],
+    )
+
+
+def armature_parents(armature):
+    """Parent bone indexes of a GBArmature, NO_PARENT marks root bones"""
+    return np.array([bone.parent for bone in armature.bones], np.intp)
+
+def bone_levels(parents):
+    """Group bone indexes by depth, so parents precede their children"""
+    parents = np.asarray(parents, np.intp)
+    count = len(parents)
+
+    root = (parents == NO_PARENT) | (parents < 0)
+    if np.any(~root & (parents >= count)):
+        raise ValidationError('Invalid GB bone parent')
+
+    levels = []
+    level = np.flatnonzero(root)
+    done = np.zeros(count, bool)
+
+    while len(level):
+        done[level] = True
+        levels.append(level)
+        level = np.flatnonzero(~done & ~root & done[np.where(root, 0, parents)])
+
+    if not done.all():
+        raise ValidationError('Cyclic GB bone hierarchy')
+
+    return levels
+
+def world_matrices(keyframes, matrices, parents):
+    """Compute the world matrices of all bones for all keyframes.
+
+    keyframes is a (frames, bones) matrix of indexes into matrices, which
+    holds the (transformations, 4, 4) local matrices. The result has the
+    shape (frames, bones, 4, 4).
+    """
+    keyframes = np.asarray(keyframes, np.intp)
+    matrices = np.asarray(matrices, np.float64)
+    parents = np.asarray(parents, np.intp)
+
+    if keyframes.ndim != 2 or keyframes.shape[1] != len(parents):
+        raise ValidationError('Keyframes do not match the bone count')
+
+    if keyframes.size and keyframes.max() >= len(matrices):
+        raise ValidationError('Invalid GB transformation index')
+
+    result = matrices[keyframes]
+
+    for level in bone_levels(parents)[1:]:
+        result[:, level] = result[:, parents[level]] @ result[:, level]
+
+    return result
+
+def animation_matrices(animation, transformations, armature):
+    """World matrices of a GBAnimation, shaped (frames, bones, 4, 4)"""
+    return world_matrices(animation.keyframes,
+            transformation_matrices(transformations),
+            armature_parents(armature))
+
+
+def vertex_influences(mesh):
+    """Return the armature bone indexes and weights of all mesh vertices.
+
+    Both arrays have the shape (vertices, influences). Blended vertices
+    store all but the last weight, which is rebuilt as 1 - sum(weights).
+    Rigid vertices follow all bones of the mesh in equal shares, like the
+    vertex groups of the Blender importer.
+    """
+    count = len(mesh.vertices)
+    palette = np.asarray(mesh.bones, np.intp)
+
+    indexes = mesh.bone_indexes
+    weights = mesh.weights
+
+    if indexes is None:
+        if not len(palette):
+            return None, None
+
+        return (np.tile(palette, (count, 1)),
+                np.full((count, len(palette)), 1 / len(palette)))
+
+    if indexes.size and indexes.max() >= len(palette):
+        raise ValidationError('Invalid GB mesh bone index')
+
+    if weights is None:
+        # A single influence with an implicit weight of one
+        return palette[indexes[:, :1]], np.ones((count, 1))
+
+    influences = weights.shape[1] + 1
+
+    result = np.empty((count, influences))
+    result[:, :-1] = weights
+    result[:, -1] = 1 - weights.sum(axis=1)
+
+    return palette[indexes[:, :influences]], result
+
+def skin(mesh, armature, matrices, chunk=1 << 18):
+    """Skin the vertices of a GBMesh with linear blend skinning.
+
+    matrices are bone world matrices of shape (bones, 4, 4) or (frames,
+    bones, 4, 4), e.g. from animation_matrices. Returns the skinned
+    positions and normals with the leading frame dimension of matrices.
+    """
+    matrices = np.asarray(matrices, np.float64)
+
+    single = matrices.ndim == 3
+    if single:
+        matrices = matrices[None]
+
+    positions = mesh.positions.astype(np.float64)
+    normals = mesh.normals.astype(np.float64)
+
+    bones, weights = vertex_influences(mesh)
+
+    frames = len(matrices)
+
+    if bones is None:
+        # Static mesh without bones
+        result_p = np.broadcast_to(positions, (frames,) + positions.shape).copy()
+        result_n = np.broadcast_to(normals, (frames,) + normals.shape).copy()
+    else:
+        if bones.size and bones.max() >= matrices.shape[1]:
+            raise ValidationError('Mesh bones do not match the armature')
+
+        # Bone matrices hold the inverse bind pose
+        offsets = np.array([bone.matrix for bone in armature.bones], np.float64)
+        matrices = matrices @ offsets[:matrices.shape[1]]
+
+        result_p = np.empty((frames,) + positions.shape)
+        result_n = np.empty((frames,) + normals.shape)
+
+        # Limits the size of the gathered per-vertex matrices
+        step = max(1, chunk // max(len(positions), 1))
+
+        for start in range(0, frames, step):
+            block = matrices[start:start + step]
+
+            # Blend the 3x4 skinning matrices of all influences
+            blended = weights[:, 0, None, None] * block[:, bones[:, 0], :3]
+            for i in range(1, bones.shape[1]):
+                blended += weights[:, i, None, None] * block[:, bones[:, i], :3]
+
+            linear = blended[..., :3]
+
+            p = (linear @ positions[..., None])[..., 0] + blended[..., 3]
+            n = (linear @ normals[..., None])[..., 0]
+
+            result_p[start:start + step] = p
+            result_n[start:start + step] = n
+
+    length = np.linalg.norm(result_n, axis=-1, keepdims=True)
+    result_n /= np.where(length > 0, length, 1)
+
+    if single:
+        return result_p[0], result_n[0]
+
+    return result_p, result_n
+
+def skin_animation(mesh, armature, animation, transformations,
+        keyframes=slice(None)):
+    """Skin a GBMesh for a keyframe index, slice or index array"""
+    selected = animation.keyframes[keyframes]
+
+    world = world_matrices(np.atleast_2d(selected),
+            transformation_matrices(transformations),
+            armature_parents(armature))
+
+    # A single keyframe index has no frame dimension
+    if selected.ndim == 1:
+        world = world[0]
+
+    return skin(mesh, armature, world)
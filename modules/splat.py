@@ -0,0 +1,338 @@
+#!/usr/bin/python3.5
+
+"""Bakes the texture layers of KCM tiles into one diffuse image per tile.
+
+Usage: splat.py [-h] [-j JOBS] [--size SIZE] [--root ROOT] source env output
+
+Every KCM tile blends up to 8 of the tiling layers of the ENV file of its
+map: the first layer covers the tile, each following layer is blended over
+it by its alpha map. The result is written with all mip levels as an
+uncompressed DDS image n_XXX_YYY.dds below output.
+
+Layer textures repeat scale_u by scale_v times per tile. The hash of all
+inputs of a tile is kept in bake.json below output, so unchanged tiles are
+skipped by later runs.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import struct
+import sys
+import tempfile
+import time
+import dds
+import terrain
+import utility
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor
+from structs.env import ENVFile
+from structs.kcm import KCMFile
+from utility import ValidationError
+from utility import VersionError
+
+
+# Changes to the blending invalidate all cached tiles
+VERSION = 1
+
+# Result states
+BAKED   = 0
+SKIPPED = 1
+FAILED  = 2
+
+_INDEX_NAME = 'bake.json'
+
+# Textures decoded by this process
+_TEXTURES = {}
+
+
+def read_texture(path):
+    """Return the RGBA image of a GTX or DDS texture"""
+    image = _TEXTURES.get(path)
+
+    if image is None:
+        with open(path, 'rb') as stream:
+            if os.path.splitext(path)[1].lower() == '.gtx':
+                image = dds.read_gtx(stream)
+            else:
+                image = dds.read_dds(stream)
+
+        _TEXTURES[path] = image
+
+    return image
+
+def _axis(count, length, repeat, wrap):
+    """Texel indices and weights of count pixels spanning repeat periods"""
+    position = (np.arange(count) + 0.5) * (length * repeat / count) - 0.5
+
+    low = np.floor(position)
+    weight = (position - low).astype(np.float32)
+
+    low = low.astype(np.intp)
+    high = low + 1
+
+    if wrap:
+        return low % length, high % length, weight
+
+    return np.clip(low, 0, length - 1), np.clip(high, 0, length - 1), weight
+
+def resample(image, size, repeat_u=1, repeat_v=1, wrap=True):
+    """Bilinearly resample an image to size x size float32 pixels.
+
+    The image repeats repeat_u times along the columns and repeat_v times
+    along the rows, wrapping around its edges or clamped to them.
+    """
+    image = np.asarray(image, np.float32)
+
+    # Both axes are independent, so each is interpolated on its own
+    low, high, weight = _axis(size, image.shape[0], repeat_v, wrap)
+    image = image[low] + (image[high] - image[low]) * weight[:, None, None]
+
+    low, high, weight = _axis(size, image.shape[1], repeat_u, wrap)
+    return image[:, low] + (image[:, high] - image[:, low]) * weight[:, None]
+
+def build_mips(image):
+    """Return the image and all lower mip levels down to 1x1 as uint8"""
+    levels = []
+    image = np.asarray(image, np.float32)
+
+    while True:
+        levels.append(np.clip(np.rint(image), 0, 255).astype(np.uint8))
+
+        rows, cols = image.shape[:2]
+        if rows == 1 and cols == 1:
+            return levels
+
+        # Box filter, where an axis of a single pixel is kept
+        image = image.reshape(max(rows // 2, 1), 2 if rows > 1 else 1,
+                max(cols // 2, 1), 2 if cols > 1 else 1, -1).mean(axis=(1, 3))
+
+def bake(kcm, layers, size=512):
+    """Blend the layers of a tile into a (size, size, 4) float32 image.
+
+    layers maps the layer ids of the KCM file to (image, scale_u, scale_v)
+    tuples, where missing layers are left out.
+    """
+    result = np.zeros((size, size, 4), np.float32)
+    result[..., 3] = 255
+
+    first = True
+
+    for layer_id, alpha in zip(kcm.alpha_ids, kcm.alpha_maps):
+        if layer_id not in layers:
+            continue
+
+        image, scale_u, scale_v = layers[layer_id]
+        color = resample(image[..., :3], size, scale_u or 1, scale_v or 1)
+
+        if first or alpha is None:
+            result[..., :3] = color
+        else:
+            weight = resample(alpha, size, wrap=False) * np.float32(1 / 255)
+            result[..., :3] += (color - result[..., :3]) * weight
+
+        first = False
+
+    return result
+
+def _hash_file(path):
+    digest = hashlib.sha1()
+
+    with open(path, 'rb') as stream:
+        for data in iter(lambda: stream.read(1024 * 1024), b''):
+            digest.update(data)
+
+    return digest.hexdigest()
+
+def input_hash(kcm, layers, size):
+    """Return the hash of everything a baked tile depends on.
+
+    layers maps layer ids to (texture hash, scale_u, scale_v) tuples.
+    """
+    digest = hashlib.sha1(('%d %d' % (VERSION, size)).encode('ascii'))
+
+    for layer_id, alpha in zip(kcm.alpha_ids, kcm.alpha_maps):
+        digest.update(('%d %r;' % (layer_id, layers.get(layer_id))).encode())
+
+        if alpha is not None:
+            digest.update(np.ascontiguousarray(alpha))
+
+    return digest.hexdigest()
+
+def write_image(path, levels):
+    """Write mip levels as a DDS image, replacing path atomically"""
+    directory = os.path.dirname(path) or '.'
+    handle, temp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+
+    try:
+        with os.fdopen(handle, 'wb') as stream:
+            dds.write_dds(stream, levels)
+
+        # mkstemp creates files only readable by the owner
+        os.chmod(temp, utility.file_mode())
+        os.replace(temp, path)
+
+    except BaseException:
+        os.unlink(temp)
+        raise
+
+def write_index(path, index):
+    """Write the input hashes of baked tiles, replacing path atomically"""
+    directory = os.path.dirname(path) or '.'
+    handle, temp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+
+    try:
+        with os.fdopen(handle, 'w') as stream:
+            json.dump(index, stream, indent=1, sort_keys=True)
+
+        os.chmod(temp, utility.file_mode())
+        os.replace(temp, path)
+
+    except BaseException:
+        os.unlink(temp)
+        raise
+
+def _bake_tile(job):
+    source, target, layers, size, previous = job
+
+    try:
+        kcm = KCMFile().parse(utility.map_file(source))
+
+        key = input_hash(kcm, {i: layer[1:] for i, layer in layers.items()},
+                size)
+
+        if key == previous and os.path.exists(target):
+            return SKIPPED, source, key
+
+        textures = {i: (read_texture(path), scale_u, scale_v)
+                for i, (path, _, scale_u, scale_v) in layers.items()
+                if i in kcm.alpha_ids}
+
+        write_image(target, build_mips(bake(kcm, textures, size)))
+        return BAKED, source, key
+
+    except (OSError, ValueError, struct.error, ValidationError,
+            VersionError) as e:
+        # Damaged tiles or layers only fail the tiles using them
+        return FAILED, source, str(e)
+
+def find_layers(env, root, directory=''):
+    """Return the texture paths of the ENV layers by layer id.
+
+    Layer paths are relative to the asset root, otherwise the name is
+    searched in directory. Layers without a texture are missing.
+    """
+    layers = {}
+
+    for i, layer in enumerate(env.layers):
+        path = (utility.find_relative(root, layer.path) or
+                utility.find_relative(directory,
+                        os.path.basename(layer.path.replace('\\', '/'))))
+
+        if path is not None:
+            layers[i] = path
+
+    return layers
+
+def bake_directory(source, env_path, output, size=512, root=None, jobs=None):
+    """Bake all KCM tiles below source, returning the result statistics"""
+    if size < 1 or size & (size - 1):
+        raise ValidationError('Image size %d is not a power of two' % size)
+
+    with open(env_path, 'rb') as stream:
+        env = ENVFile().parse(stream)
+
+    if root is None:
+        root = utility.get_root_path(os.path.abspath(env_path))
+
+    utility.clear_textures()
+    paths = find_layers(env, root, os.path.dirname(env_path))
+    missing = [layer.path for i, layer in enumerate(env.layers)
+            if i not in paths]
+
+    # Textures are hashed once instead of by every tile
+    layers = {i: (path, _hash_file(path), env.layers[i].scale_u,
+        env.layers[i].scale_v) for i, path in paths.items()}
+
+    os.makedirs(output, exist_ok=True)
+    index_path = os.path.join(output, _INDEX_NAME)
+
+    try:
+        with open(index_path) as stream:
+            index = json.load(stream)
+    except (OSError, ValueError):
+        index = {}
+
+    tasks = []
+    for (x, y), path in sorted(terrain.find_tiles(source).items()):
+        name = 'n_%03d_%03d.dds' % (x, y)
+        tasks.append((path, os.path.join(output, name), layers, size,
+            index.get(name)))
+
+    counts = [0, 0, 0]
+    errors = []
+
+    start = time.perf_counter()
+
+    # The hashes of finished tiles are kept even if the pool breaks
+    try:
+        with ProcessPoolExecutor(jobs) as executor:
+            results = executor.map(_bake_tile, tasks, chunksize=4)
+
+            for task, (state, path, result) in zip(tasks, results):
+                counts[state] += 1
+                name = os.path.basename(task[1])
+
+                if state == FAILED:
+                    errors.append((path, result))
+                    index.pop(name, None)
+                else:
+                    index[name] = result
+    finally:
+        write_index(index_path, index)
+
+    return {
+        'baked'   : counts[BAKED],
+        'skipped' : counts[SKIPPED],
+        'failed'  : counts[FAILED],
+        'errors'  : errors,
+        'missing' : missing,
+        'seconds' : time.perf_counter() - start,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+            description='Bake the texture layers of KCM tiles.')
+
+    parser.add_argument('source', help='map directory with KCM files')
+    parser.add_argument('env', help='ENV file of the map')
+    parser.add_argument('output', help='output directory')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+            help='number of worker processes (default: CPU count)')
+    parser.add_argument('--size', type=int, default=512,
+            help='image size in pixels, a power of two (default: 512)')
+    parser.add_argument('--root', default=None,
+            help='asset root directory (default: derived from env)')
+
+    args = parser.parse_args(argv)
+
+    stats = bake_directory(args.source, args.env, args.output, args.size,
+            args.root, args.jobs)
+
+    for path in stats['missing']:
+        print('Warning: Texture %s not found.' % path, file=sys.stderr)
+
+    for path, error in stats['errors']:
+        print('Error: %s: %s' % (path, error), file=sys.stderr)
+
+    print('%d baked, %d skipped, %d failed in %.2f s' % (stats['baked'],
+        stats['skipped'], stats['failed'], stats['seconds']))
+
+    return 1 if stats['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -53,10 +53,16 @@ class ENVFile(object):
         'layers',
     ]
 
-    def parse(self, stream):
+    def parse(self, stream, verify=False):
+        if verify:
+            stream = utility.read_verified(stream, 0,
+                    utility.CRC_SEED_ENV, 'ENV')
+        else:
+            stream = utility.as_reader(stream)
+
         _, _, _, _, \
         _, _, _, _, \
-        version = unpack('<9I', stream.read(9 * 4))
+        version = stream.unpack('<9I')
 
         if version != 7:
             raise VersionError('ENV version %d is unsupported' % version)
@@ -65,7 +71,7 @@ class ENVFile(object):
         self.lights = []
         self.layers = []
 
-        for _ in range(unpack('<I', stream.read(4))[0]):
+        for _ in range(stream.unpack('<I')[0]):
             self.decals.append(
                 (unpack('<I', stream.read(4))[0], utility.read_string_pre(stream))
             )
@@ -73,7 +79,7 @@ class ENVFile(object):
         for _ in range(24):
             self.lights.append(ENVLight().parse(stream))
 
-        for _ in range(unpack('<I', stream.read(4))[0]):
+        for _ in range(stream.unpack('<I')[0]):
             self.layers.append(ENVLayer().parse(stream))
 
         # Verify
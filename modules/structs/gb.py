@@ -5,7 +5,6 @@ import sys
 import utility
 import numpy as np
 
-from struct import unpack
 from utility import ValidationError
 from utility import VersionError
 
@@ -32,9 +31,11 @@ class GBBone(object):
         'parent',  #  no parent: 0xFF
     ]
 
+    _SIZE = 16 * 4 + 1
+
     def parse(self, stream):
         self.matrix = utility.read_d3dx_matrix4(stream)
-        self.parent = unpack('<B', stream.read(1))[0]
+        self.parent = stream.unpack('<B')[0]
         return self
 
     def write(self, stream):
@@ -44,41 +45,67 @@ class GBBone(object):
 class GBAnimation(object):
     __slots__ = [
         'option',
-        'keyframes',
-        'keyframe_frames',
-        'keyframe_events'
+        'keyframes',  # keyframe x bone matrix of transformation indexes
+        'keyframe_table',
+        '_descriptor',
+        '_events',
     ]
 
+    _KEYFRAME_DTYPE = np.dtype([
+        ('frame', '<u2'),
+        ('event', '<u4'),
+    ])
+
     def parse_descriptor(self, descriptor):
         self.option = utility.read_string_zero(descriptor, self.option)
 
-        for i, index in enumerate(self.keyframe_events):
-            self.keyframe_events[i] = (
-                    utility.read_string_zero(descriptor, index))
+        # Events are decoded on first access
+        self._descriptor = descriptor
+        self._events = None
 
     def write_descriptor(self, descriptor):
         raise NotImplementedError
 
     def parse(self, stream, b_count):
-        self.option, k_count = unpack('<IH', stream.read(6))
+        self.option, k_count = stream.unpack('<IH')
 
-        self.keyframes = []
-        self.keyframe_frames = []
-        self.keyframe_events = []
+        self.keyframe_table = utility.read_array(stream,
+                GBAnimation._KEYFRAME_DTYPE, k_count)
 
-        for _ in range(k_count):
-            self.keyframe_frames.append(unpack('<H', stream.read(2))[0])
-            self.keyframe_events.append(unpack('<I', stream.read(4))[0])
+        self.keyframes = utility.read_array(stream,
+                np.uint16, (k_count, b_count))
 
-        for _ in range(k_count):
-            self.keyframes.append(
-                    np.frombuffer(stream.read(2 * b_count), np.uint16))
+        self._descriptor = None
+        self._events = None
 
         return self
 
     def write(self, stream):
         raise NotImplementedError
 
+    def skip(stream, b_count):
+        """Advances the stream past an animation without parsing it."""
+        _, k_count = stream.unpack('<IH')
+        stream.seek(k_count * (GBAnimation._KEYFRAME_DTYPE.itemsize
+                + 2 * b_count), 1)
+
+    @property
+    def keyframe_frames(self):
+        # Python ints, uint16 arithmetic on milliseconds overflows
+        return self.keyframe_table['frame'].tolist()
+
+    @property
+    def keyframe_events(self):
+        # Descriptor offsets until the descriptor is parsed
+        if self._descriptor is None:
+            return self.keyframe_table['event'].tolist()
+
+        if self._events is None:
+            self._events = [utility.read_string_zero(self._descriptor, offset)
+                    for offset in self.keyframe_table['event'].tolist()]
+
+        return self._events
+
 
 class GBTransformation(object):
     __slots__ = [
@@ -87,6 +114,8 @@ class GBTransformation(object):
         'scale',
     ]
 
+    _SIZE = 10 * 4
+
     def parse(self, stream):
         self.position = utility.read_d3dx_vector3(stream)
         self.rotation = utility.read_d3dx_quaternion(stream)
@@ -114,6 +143,8 @@ class GBMaterial(object):
         0x200 : 'FX',
     }
 
+    _SIZE = 18
+
     def parse_descriptor(self, descriptor, frame_count):
         descriptor.seek(self.frames)
 
@@ -131,7 +162,7 @@ class GBMaterial(object):
         self.options, \
         _,            \
         _,            \
-        self.frames = unpack('<IHIfI', stream.read(18))
+        self.frames = stream.unpack('<IHIfI')
 
         # Create option set
         options = set()
@@ -169,7 +200,7 @@ class GBMaterialFrame(object):
         self.light_a = utility.read_d3d_color(stream)
         self.light_d = utility.read_d3d_color(stream)
         self.light_s = utility.read_d3d_color(stream)
-        self.opacity = unpack('<f', stream.read(4))[0]
+        self.opacity = stream.unpack('<f')[0]
 
         self.texture_off = utility.read_d3dx_vector2(stream)
         self.texture_rot = utility.read_d3dx_vector3(stream)
@@ -180,13 +211,39 @@ class GBMaterialFrame(object):
         raise NotImplementedError
 
 
+class GBVertices(object):
+    """Per-vertex dictionary view of a structured vertex array.
+
+    Provides the former verts[i]['v'] access, where each dictionary
+    contains views of the fields present in the vertex type.
+    """
+    __slots__ = [
+        'array',
+    ]
+
+    def __init__(self, array):
+        self.array = array
+
+    def __len__(self):
+        return len(self.array)
+
+    def __getitem__(self, index):
+        vertex = self.array[index]
+        return {name : vertex[name] for name in self.array.dtype.names}
+
+    def __iter__(self):
+        for i in range(len(self.array)):
+            yield self[i]
+
+
 class GBMesh(object):
     __slots__ = [
         'name',
         'material',
-        'verts',
+        'vertices',
         'faces',
         'bones',
+        '_attributes',
     ]
 
     # Face types
@@ -203,62 +260,77 @@ class GBMesh(object):
     _VT_RIGID_DOUBLE = 5
     _VT_END          = 6
 
+    # Structured vertex layouts by vertex type, where blended vertices
+    # store all but the last weight and the influencing bone indexes
+    _VERTEX_DTYPES = [
+        np.dtype([
+            ('v',  '<f4', 3), ('vn', '<f4', 3), ('t0', '<f4', 2),
+        ]),
+        np.dtype([
+            ('v',  '<f4', 3), ('indexes', 'u1', 4),
+            ('vn', '<f4', 3), ('t0', '<f4', 2),
+        ]),
+        np.dtype([
+            ('v',  '<f4', 3), ('weights', '<f4', (1,)), ('indexes', 'u1', 4),
+            ('vn', '<f4', 3), ('t0', '<f4', 2),
+        ]),
+        np.dtype([
+            ('v',  '<f4', 3), ('weights', '<f4', 2), ('indexes', 'u1', 4),
+            ('vn', '<f4', 3), ('t0', '<f4', 2),
+        ]),
+        np.dtype([
+            ('v',  '<f4', 3), ('weights', '<f4', 3), ('indexes', 'u1', 4),
+            ('vn', '<f4', 3), ('t0', '<f4', 2),
+        ]),
+        np.dtype([
+            ('v',  '<f4', 3), ('vn', '<f4', 3), ('t0', '<f4', 2),
+            ('t1', '<f4', 2),
+        ]),
+    ]
+
     def mkfaces(indexes):
-        result = []
+        """Converts an index list to faces, skipping degenerate triangles."""
         # Example: [0,1,2,3,4,5] -> [(0,1,2),(3,4,5)]
-        for a, b, c in zip(*[iter(indexes)] * 3):
-            if a == b or a == c or b == c:
-                continue
+        indexes = np.asarray(indexes)
+        faces = indexes[:len(indexes) // 3 * 3].reshape((-1, 3))
 
-            result.append((a, b, c))
-
-        return result
+        a, b, c = faces.T
+        return faces[(a != b) & (a != c) & (b != c)]
 
     def unstrip(indexes):
         """Converts an index strip to an index list."""
-        result = []
-        for i in range(len(indexes) - 2):
-            if i & 1:
-                result.extend([indexes[i], indexes[i + 2], indexes[i + 1]])
-            else:
-                result.extend([indexes[i], indexes[i + 1], indexes[i + 2]])
-
-        return result
-
-    def rmdupes(faces):
-        """Removes duplicates ignoring order, e.g. (0, 1, 2) == (2, 1, 0)."""
-        mask = []
-        seen = set()
-        for s in map(frozenset, faces):
-            if s in seen:
-                mask.append(False)
-            else:
-                mask.append(True)
+        indexes = np.asarray(indexes)
+        count = max(len(indexes) - 2, 0)
 
-            seen.add(s)
+        # Every odd triangle swaps its last two indexes to keep the winding
+        odd = np.arange(count) & 1 == 1
 
-        return np.array(faces)[np.array(mask)]
+        result = np.empty((count, 3), indexes.dtype)
+        result[:, 0] = indexes[:count]
+        result[:, 1] = np.where(odd, indexes[2:], indexes[1:count + 1])
+        result[:, 2] = np.where(odd, indexes[1:count + 1], indexes[2:])
 
-    def _parse_vertex(self, stream, v_type):
-        vertex = {'v' : utility.read_d3dx_vector3(stream)}
+        return result.ravel()
 
-        # Bone weights
-        if 2 <= v_type <= 4:
-            vertex['weights'] = np.frombuffer(
-                    stream.read(4 * v_type - 4), np.float32)
+    def rmdupes(faces):
+        """Removes duplicates ignoring order, e.g. (0, 1, 2) == (2, 1, 0)."""
+        faces = np.asarray(faces).reshape((-1, 3))
 
-        # Bone indexes which influence this vertex
-        if 1 <= v_type <= 4:
-            vertex['indexes'] = np.frombuffer(stream.read(4), np.uint8)
+        # Canonical index set per face, where (0, 0, 1) and (0, 1, 1) are
+        # equal as well, since both describe the set {0, 1}
+        keys = np.sort(faces, axis=1).astype(np.int64)
+        keys[:, 1] = np.where(keys[:, 1] == keys[:, 0], keys[:, 2], keys[:, 1])
 
-        # Texture coordinate(s) and vertex normal
-        vertex['vn'] = utility.read_d3dx_vector3(stream)
-        vertex['t0'] = utility.read_d3dx_vector2(stream)
+        if not len(keys) or keys.min() >= 0 and keys.max() < 1 << 21:
+            keys = keys[:, 0] << 42 | keys[:, 1] << 21 | keys[:, 2]
+            _, first = np.unique(keys, return_index=True)
+        else:
+            _, first = np.unique(keys, axis=0, return_index=True)
 
-        if v_type >= 5:
-            vertex['t1'] = utility.read_d3dx_vector2(stream)
+        mask = np.zeros(len(faces), bool)
+        mask[first] = True
 
-        return vertex
+        return faces[mask]
 
     def _write_vertex(self, stream, v_type):
         raise NotImplementedError
@@ -273,30 +345,28 @@ class GBMesh(object):
         # The sources define material as a signed integer.
         # However, it can safely be read as an unsigned one.
 
-        self.name, self.material = unpack('<II', stream.read(8))
+        self.name, self.material = stream.unpack('<II')
 
         v_type,  \
         f_type,  \
         v_count, \
         f_count, \
-        b_count = unpack('<BBHHB', stream.read(7))
+        b_count = stream.unpack('<BBHHB')
 
         # Type definition changed in version 12
         if gb_version < 11 and v_type > 0:
             v_type = v_type - 1
 
-        self.verts = []
-        self.faces = []
-        self.bones = []
+        if v_type >= GBMesh._VT_END:
+            raise ValidationError('GB vertex type %d is invalid' % v_type)
 
-        for _ in range(b_count):
-            self.bones.append(unpack('<B', stream.read(1))[0])
+        self.bones = list(stream.read(b_count))
 
-        for _ in range(v_count):
-            self.verts.append(self._parse_vertex(stream, v_type))
+        self.vertices = utility.read_array(stream,
+                GBMesh._VERTEX_DTYPES[v_type], v_count)
+        self._attributes = {}
 
-        for _ in range(f_count):
-            self.faces.append(unpack('<H', stream.read(2))[0])
+        self.faces = utility.read_array(stream, '<u2', f_count).astype(np.int64)
 
         if f_type != GBMesh._FT_LIST:
             self.faces = GBMesh.unstrip(self.faces)
@@ -309,20 +379,79 @@ class GBMesh(object):
     def write(self, stream, gb_version):
         raise NotImplementedError
 
+    def skip(stream, gb_version):
+        """Advances the stream past a mesh without parsing it."""
+        stream.seek(8, 1)
+
+        v_type,  \
+        _,       \
+        v_count, \
+        f_count, \
+        b_count = stream.unpack('<BBHHB')
+
+        if gb_version < 11 and v_type > 0:
+            v_type = v_type - 1
+
+        if v_type >= GBMesh._VT_END:
+            raise ValidationError('GB vertex type %d is invalid' % v_type)
+
+        stream.seek(b_count + 2 * f_count
+                + GBMesh._VERTEX_DTYPES[v_type].itemsize * v_count, 1)
+
+    def _field(self, name):
+        """Contiguous copy of a vertex field, None if the type lacks it"""
+        array = self._attributes.get(name)
+
+        if array is None and name in self.vertices.dtype.names:
+            # Fields of the packed vertices are strided views
+            array = np.ascontiguousarray(self.vertices[name])
+            self._attributes[name] = array
+
+        return array
+
+    @property
+    def verts(self):
+        return GBVertices(self.vertices)
+
+    @property
+    def positions(self):
+        return self._field('v')
+
+    @property
+    def normals(self):
+        return self._field('vn')
+
+    @property
+    def uv0(self):
+        return self._field('t0')
+
+    @property
+    def uv1(self):
+        return self._field('t1')
+
+    @property
+    def weights(self):
+        return self._field('weights')
+
+    @property
+    def bone_indexes(self):
+        return self._field('indexes')
+
 
 class GBCollision(object):
     __slots__ = [
         'bounding_box_min',
         'bounding_box_max',
-        'verts',
+        'vertices',
+        'triangles',  # unfiltered faces, as referenced by the nodes
         'faces',
-        'nodes',
+        'node_table',
     ]
 
     def parse(self, stream, gb_version,
             bounding_box_min=None,
             bounding_box_max=None):
-        v_count, f_count = unpack('<HH', stream.read(4))
+        v_count, f_count = stream.unpack('<HH')
 
         if gb_version < 11:
             self.bounding_box_min = utility.read_d3dx_vector3(stream)
@@ -332,28 +461,48 @@ class GBCollision(object):
             self.bounding_box_max = bounding_box_max
             stream.read(24)
 
-        self.verts = np.frombuffer(stream.read(6 * v_count), (np.uint16, 3))
-        self.faces = np.frombuffer(stream.read(6 * f_count), (np.uint16, 3))
+        verts = utility.read_array(stream, np.uint16, (v_count, 3))
+        faces = utility.read_array(stream, np.uint16, (f_count, 3))
 
-        self.nodes = []
-        for _ in range(f_count - 1):
-            self.nodes.append(GBCollisionNode().parse(stream))
+        self.node_table = utility.read_array(stream,
+                GBCollisionNode._DTYPE, max(f_count - 1, 0))
 
         # Create vertices
-        self.verts = [{'v' : v} for v in
-                self.scale * self.verts + self.bounding_box_min]
+        self.vertices = np.empty(v_count, [('v', np.float32, 3)])
+        self.vertices['v'] = self.scale * verts + self.bounding_box_min
 
-        self.faces = GBMesh.rmdupes(self.faces // 3)
+        self.triangles = faces // 3
+        self.faces = GBMesh.rmdupes(self.triangles)
 
         return self
 
     def write(self, stream, gb_version):
         raise NotImplementedError
 
+    def skip(stream, gb_version):
+        """Advances the stream past the collision without parsing it."""
+        v_count, f_count = stream.unpack('<HH')
+        stream.seek(24 + 6 * v_count + 6 * f_count
+                + GBCollisionNode._SIZE * max(f_count - 1, 0), 1)
+
     @property
     def scale(self):
         return (self.bounding_box_max - self.bounding_box_min) / 0xFFFF
 
+    @property
+    def verts(self):
+        return GBVertices(self.vertices)
+
+    @property
+    def positions(self):
+        # A view without copying, since positions are the only field
+        return np.ascontiguousarray(self.vertices['v'])
+
+    @property
+    def nodes(self):
+        stream = utility.BufferReader(self.node_table.tobytes())
+        return [GBCollisionNode().parse(stream) for _ in self.node_table]
+
 
 class GBCollisionNode(object):
     __slots__ = [
@@ -381,14 +530,24 @@ class GBCollisionNode(object):
     L_FLOOR  = 0x4000
     R_FLOOR  = 0x8000
 
+    _DTYPE = np.dtype([
+        ('flags', '<u2'),
+        ('min', 'u1', 3),
+        ('max', 'u1', 3),
+        ('child_l', '<u2'),
+        ('child_r', '<u2'),
+    ])
+
+    _SIZE = _DTYPE.itemsize
+
     def parse(self, stream):
-        self.flags = unpack('<H', stream.read(2))
+        self.flags = stream.unpack('<H')
 
-        self.min = list(unpack('<3B', stream.read(3)))
-        self.max = list(unpack('<3B', stream.read(3)))
+        self.min = list(stream.unpack('<3B'))
+        self.max = list(stream.unpack('<3B'))
 
         self.child_l, \
-        self.child_r = unpack('<HH', stream.read(4))
+        self.child_r = stream.unpack('<HH')
 
         return self
 
@@ -396,63 +555,72 @@ class GBCollisionNode(object):
         raise NotImplementedError
 
 
-class GBFile(object):
+class GBHeader(object):
     __slots__ = [
+        'version',
+        'bone_count',
+        'bone',
+        'mesh_count',
+        'checksum',
+        'option',
+        'descriptor_size',
+        'cls_size',
+        'transformation_count',
+        'animation_count',
+        'material_count',
+        'material_frame_count',
         'bounding_box_min',
         'bounding_box_max',
-        'armature',
-        'meshes',
-        'animations',
-        'transformations',
-        'collision',
     ]
 
-    _MODEL_BONE = 1
-
     def parse(self, stream):
-        version,    \
-        bone_count, \
-        bone,       \
-        mesh_count = unpack('<4B', stream.read(4))
+        self.version,    \
+        self.bone_count, \
+        self.bone,       \
+        self.mesh_count = stream.unpack('<4B')
+
+        version = self.version
 
         if version < 8 or version > 12:
             raise VersionError('GB version %d is unsupported' % version)
 
         if version >= 10:
-            checksum = unpack('<I', stream.read(4))
+            self.checksum = stream.unpack('<I')[0]
+        else:
+            self.checksum = None
 
         if version >= 12:
             name = stream.read(64) # encrypted, key 4
 
-        option = unpack('<I', stream.read(4))[0]
+        self.option = stream.unpack('<I')[0]
 
         # The vertex, face, bone and keyframe counts are unused
 
         if version >= 9:
-            vertex_count = list(unpack('<12H', stream.read(24)))
+            vertex_count = list(stream.unpack('<12H'))
         else:
-            vertex_count = list(unpack('<6H', stream.read(12)))
+            vertex_count = list(stream.unpack('<6H'))
 
         face_index_count, \
         bone_index_count, \
-        keyframe_count = unpack('<3H', stream.read(6))
+        keyframe_count = stream.unpack('<3H')
 
         if version >= 9:
-            _, descriptor_size, cls_size = unpack('<HII', stream.read(10))
+            _, self.descriptor_size, self.cls_size = stream.unpack('<HII')
         else:
-            _, descriptor_size, cls_size = unpack('<HHH', stream.read(6))
+            _, self.descriptor_size, self.cls_size = stream.unpack('<HHH')
 
-        transformation_count, \
-        animation_count = unpack('<HB', stream.read(3))
+        self.transformation_count, \
+        self.animation_count = stream.unpack('<HB')
 
         if version >= 9:
             stream.read(1)
 
-        material_count, \
-        material_frame_count = unpack('<HH', stream.read(4))
+        self.material_count, \
+        self.material_frame_count = stream.unpack('<HH')
 
-        if not material_count:
-            material_frame_count = 0
+        if not self.material_count:
+            self.material_frame_count = 0
 
         if version >= 11:
             self.bounding_box_min = utility.read_d3dx_vector3(stream)
@@ -464,57 +632,229 @@ class GBFile(object):
         if version >= 9:
             stream.read(16)
 
-        # Data
+        return self
 
-        if bone & GBFile._MODEL_BONE:
-            self.armature = GBArmature().parse(stream, bone_count)
-        else:
-            self.armature = None
+    def write(self, stream):
+        raise NotImplementedError
 
-        materials = []
-        for _ in range(material_count):
-            materials.append(GBMaterial().parse(stream))
 
-        self.meshes = []
-        for _ in range(mesh_count):
-            self.meshes.append(GBMesh().parse(stream, version))
+# Marks a section, which is parsed on first access
+_LAZY = object()
 
-        self.animations = []
-        for i in range(animation_count):
-            self.animations.append(GBAnimation().parse(stream, bone_count))
+class GBFile(object):
+    """GB model, whose sections are parsed on first access in lazy mode.
 
-        self.transformations = []
-        for i in range(transformation_count):
-            self.transformations.append(GBTransformation().parse(stream))
+    The header is always parsed. In lazy mode, the byte offset of each
+    section is computed from the section headers when a section is first
+    accessed, which keeps listing and filtering models cheap.
+    """
+    __slots__ = [
+        'header',
+        '_stream',
+        '_offsets',
+        '_descriptor',
+        '_armature',
+        '_materials',
+        '_meshes',
+        '_animations',
+        '_transformations',
+        '_collision',
+    ]
 
-        if cls_size:
-            self.collision = GBCollision().parse(stream, version,
-                    self.bounding_box_min,
-                    self.bounding_box_max)
-        else:
-            self.collision = None
+    _MODEL_BONE = 1
+
+    _SECTIONS = [
+        'armature',
+        'materials',
+        'meshes',
+        'animations',
+        'transformations',
+        'collision',
+    ]
 
-        # Parse descriptor
-        descriptor = io.BytesIO(stream.read(descriptor_size))
+    def parse(self, stream, verify=False, lazy=False):
+        stream = utility.as_reader(stream)
+        start = stream.tell()
 
-        for anim in self.animations:
-            anim.parse_descriptor(descriptor)
+        self.header = GBHeader().parse(stream)
 
-        for mesh in self.meshes:
-            mesh.parse_descriptor(descriptor)
+        # Only version 10 and later provide a checksum
+        if verify and self.header.version >= 10:
+            utility.verify_crc32(stream.buffer[start:], 4,
+                    utility.CRC_SEED_GB, 'GB')
 
-        for mtrl in materials:
-            mtrl.parse_descriptor(descriptor, material_frame_count)
+        self._stream = stream
+        self._offsets = None
+        self._descriptor = None
 
-        # Replace material indexes with materials
-        for mesh in self.meshes:
-            mesh.material = materials[mesh.material]
+        for name in GBFile._SECTIONS:
+            setattr(self, '_' + name, _LAZY)
 
-        # Verify
-        if stream.read(1):
-            raise ValidationError('Too many bytes in GB structure')
+        if not lazy:
+            for name in GBFile._SECTIONS:
+                getattr(self, name)
+
+            # Release the buffer, since everything is parsed
+            self._stream = None
+            self._descriptor = None
 
         return self
 
     def write(self, stream):
         raise NotImplementedError
+
+    def _reader(self, offset):
+        return utility.BufferReader(self._stream.data, offset)
+
+    def _get_descriptor(self):
+        if self._descriptor is None:
+            stream = self._reader(self.offsets['descriptor'])
+            self._descriptor = utility.BufferReader(
+                    stream.read(self.header.descriptor_size))
+
+        return self._descriptor
+
+    @property
+    def offsets(self):
+        """Byte offsets of all sections, where lists hold one per item"""
+        if self._offsets is not None:
+            return self._offsets
+
+        header = self.header
+        stream = self._reader(self._stream.tell())
+
+        offsets = {}
+
+        offsets['armature'] = stream.tell()
+        if header.bone & GBFile._MODEL_BONE:
+            stream.seek(GBBone._SIZE * header.bone_count, 1)
+
+        offsets['materials'] = stream.tell()
+        stream.seek(GBMaterial._SIZE * header.material_count, 1)
+
+        offsets['meshes'] = []
+        for _ in range(header.mesh_count):
+            offsets['meshes'].append(stream.tell())
+            GBMesh.skip(stream, header.version)
+
+        offsets['animations'] = []
+        for _ in range(header.animation_count):
+            offsets['animations'].append(stream.tell())
+            GBAnimation.skip(stream, header.bone_count)
+
+        offsets['transformations'] = stream.tell()
+        stream.seek(GBTransformation._SIZE * header.transformation_count, 1)
+
+        if header.cls_size:
+            offsets['collision'] = stream.tell()
+            GBCollision.skip(stream, header.version)
+        else:
+            offsets['collision'] = None
+
+        offsets['descriptor'] = stream.tell()
+        stream.seek(header.descriptor_size, 1)
+
+        # Verify
+        if stream.tell() < len(stream):
+            raise ValidationError('Too many bytes in GB structure')
+
+        if stream.tell() > len(stream):
+            raise ValidationError('Too few bytes in GB structure')
+
+        self._offsets = offsets
+        return offsets
+
+    @property
+    def bounding_box_min(self):
+        return self.header.bounding_box_min
+
+    @property
+    def bounding_box_max(self):
+        return self.header.bounding_box_max
+
+    @property
+    def armature(self):
+        if self._armature is _LAZY:
+            if self.header.bone & GBFile._MODEL_BONE:
+                self._armature = GBArmature().parse(
+                        self._reader(self.offsets['armature']),
+                        self.header.bone_count)
+            else:
+                self._armature = None
+
+        return self._armature
+
+    @property
+    def materials(self):
+        if self._materials is _LAZY:
+            stream = self._reader(self.offsets['materials'])
+            descriptor = self._get_descriptor()
+
+            self._materials = []
+            for _ in range(self.header.material_count):
+                material = GBMaterial().parse(stream)
+                material.parse_descriptor(descriptor,
+                        self.header.material_frame_count)
+
+                self._materials.append(material)
+
+        return self._materials
+
+    @property
+    def meshes(self):
+        if self._meshes is _LAZY:
+            materials = self.materials
+            descriptor = self._get_descriptor()
+
+            self._meshes = []
+            for offset in self.offsets['meshes']:
+                mesh = GBMesh().parse(self._reader(offset),
+                        self.header.version)
+                mesh.parse_descriptor(descriptor)
+
+                # Replace material indexes with materials
+                mesh.material = materials[mesh.material]
+
+                self._meshes.append(mesh)
+
+        return self._meshes
+
+    @property
+    def animations(self):
+        if self._animations is _LAZY:
+            descriptor = self._get_descriptor()
+
+            self._animations = []
+            for offset in self.offsets['animations']:
+                animation = GBAnimation().parse(self._reader(offset),
+                        self.header.bone_count)
+                animation.parse_descriptor(descriptor)
+
+                self._animations.append(animation)
+
+        return self._animations
+
+    @property
+    def transformations(self):
+        if self._transformations is _LAZY:
+            stream = self._reader(self.offsets['transformations'])
+
+            self._transformations = []
+            for _ in range(self.header.transformation_count):
+                self._transformations.append(GBTransformation().parse(stream))
+
+        return self._transformations
+
+    @property
+    def collision(self):
+        if self._collision is _LAZY:
+            if self.header.cls_size:
+                self._collision = GBCollision().parse(
+                        self._reader(self.offsets['collision']),
+                        self.header.version,
+                        self.bounding_box_min,
+                        self.bounding_box_max)
+            else:
+                self._collision = None
+
+        return self._collision
@@ -25,19 +25,30 @@ class KCMFile(object):
     _SIZE_1 = 256
     _SIZE_2 = 257
 
-    def parse(self, stream):
+    def parse(self, stream, verify=False, copy=False):
+        """Parse a KCM tile from a stream or buffer.
+
+        Mapped files and buffers are not copied, all maps are read-only
+        views into them, unless copy is set.
+        """
+        if verify:
+            stream = utility.read_verified(stream, 0,
+                    utility.CRC_SEED_KCM, 'KCM')
+        else:
+            stream = utility.as_reader(stream)
+
         _, _,       \
         self.x,     \
         self.y,     \
         _, _, _, _, \
-        version = unpack('<9I', stream.read(36))
+        version = stream.unpack('<9I')
 
         if version != 7:
             raise VersionError('KCM version %d is unsupported' % version)
 
         # Read ids, slice empty (0xFF) positions
-        self.alpha_ids = list(unpack('<8B', stream.read(8)))
-        self.decal_ids = list(unpack('<8B', stream.read(8)))
+        self.alpha_ids = list(stream.unpack('<8B'))
+        self.decal_ids = list(stream.unpack('<8B'))
 
         self.alpha_ids.sort()
         self.decal_ids.sort()
@@ -49,8 +60,8 @@ class KCMFile(object):
         self.decal_ids = self.decal_ids[:decal_count]
 
         def next_array(shape, dtype, stream):
-            return np.ndarray(shape, dtype,
-                    stream.read(np.prod(shape) * np.dtype(dtype).itemsize))
+            array = utility.read_array(stream, dtype, shape)
+            return array.copy() if copy else array
 
         # NumPy array parameters: alpha, height, color, decal
         param_a = ((KCMFile._SIZE_1, KCMFile._SIZE_1), (np.uint8,  1), stream)
@@ -24,22 +24,28 @@ class KSMFile(object):
     SIZE = 256
 
     def parse(self, stream):
-        version = unpack('<I', stream.read(4))[0]
+        stream = utility.as_reader(stream)
+
+        version = stream.unpack('<I')[0]
 
         if version != 1:
             raise VersionError('KSM version %d is unsupported' % version)
 
         try:
-            self.area = np.fromstring(stream.read(),
-                    [('move', np.uint16), ('zone', np.uint16)])
+            self.area = stream.array(
+                    [('move', np.uint16), ('zone', np.uint16)],
+                    (KSMFile.SIZE, KSMFile.SIZE))
 
-            self.area.shape = (KSMFile.SIZE, KSMFile.SIZE)
+        except ValidationError:
+            raise ValidationError('Invalid KSM structure')
 
-        except (AttributeError, ValueError):
+        # Verify
+        if stream.read(1):
             raise ValidationError('Invalid KSM structure')
 
-        # The move value is interpreted as a boolean
-        self.area[self.area['move'] > 0]['move'] = 0xFFFF
+        # The move value is interpreted as a boolean, the view is read-only
+        self.area = self.area.copy()
+        self.area['move'][self.area['move'] > 0] = 0xFFFF
 
         return self
 
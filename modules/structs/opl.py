@@ -2,7 +2,9 @@
 
 import sys
 import utility
+import numpy as np
 
+from struct import Struct
 from struct import unpack
 from utility import ValidationError
 from utility import VersionError
@@ -28,25 +30,87 @@ class OPLNode(object):
 
 
 class OPLFile(object):
+    """OPL tile, whose placements are stored as arrays.
+
+    positions, rotations and scales hold one row per placement, where the
+    rotations are [w, x, y, z] quaternions. path_ids index the table of
+    distinct model paths. The nodes property provides OPLNode views.
+    """
     __slots__ = [
-        'nodes',
         'x',
         'y',
+        'paths',
+        'path_ids',
+        'positions',
+        'rotations',
+        'scales',
+        '_nodes',
     ]
 
-    def parse(self, stream):
+    # Position, rotation and scale following each path
+    _RECORD_SIZE = 40
+
+    _LENGTH = Struct('<I')
+
+    def parse(self, stream, verify=False):
+        if verify:
+            stream = utility.read_verified(stream, 0,
+                    utility.CRC_SEED_OPL, 'OPL')
+        else:
+            stream = utility.as_reader(stream)
+
         _, _,       \
         self.x,     \
         self.y,     \
         _, _, _, _, \
-        version = unpack('<9I', stream.read(36))
+        version = stream.unpack('<9I')
 
         if version != 7:
             raise VersionError('OPL version %d is unsupported' % version)
 
-        self.nodes = []
-        for _ in range(unpack('<I', stream.read(4))[0]):
-            self.nodes.append(OPLNode().parse(stream))
+        count = stream.unpack('<I')[0]
+
+        # Paths have a variable length, so only the record offsets and path
+        # ids are collected per placement
+        buffer = stream.buffer
+        offset = stream.tell()
+        end = len(buffer)
+
+        paths = {}
+        path_ids = []
+        records = []
+
+        for _ in range(count):
+            if offset + 4 > end:
+                raise ValidationError('Too few bytes in OPL structure')
+
+            size = OPLFile._LENGTH.unpack_from(buffer, offset)[0]
+            path = bytes(buffer[offset + 4:offset + 4 + size])
+
+            path_ids.append(paths.setdefault(path, len(paths)))
+            records.append(offset + 4 + size)
+
+            offset += 4 + size + OPLFile._RECORD_SIZE
+
+        if offset > end:
+            raise ValidationError('Too few bytes in OPL structure')
+
+        stream.seek(offset)
+
+        self.paths = [str(path, 'cp949') for path in paths]
+        self.path_ids = np.array(path_ids, np.uint32)
+
+        # Gathers all records at once
+        data = np.frombuffer(buffer, np.uint8)
+        records = np.array(records, np.intp).reshape(count, 1)
+
+        values = data[records + np.arange(OPLFile._RECORD_SIZE)].view('<f4')
+
+        self.positions = values[:, 0:3]
+        self.rotations = values[:, [6, 3, 4, 5]]
+        self.scales = values[:, 7:10]
+
+        self._nodes = None
 
         # Verify
         if stream.read(1):
@@ -54,5 +118,21 @@ class OPLFile(object):
 
         return self
 
+    @property
+    def nodes(self):
+        """OPLNode views of all placements, created on first access"""
+        if self._nodes is None:
+            self._nodes = []
+
+            for i, path_id in enumerate(self.path_ids.tolist()):
+                node = OPLNode()
+                node.path = self.paths[path_id]
+                node.position = self.positions[i]
+                node.rotation = self.rotations[i]
+                node.scale = self.scales[i]
+                self._nodes.append(node)
+
+        return self._nodes
+
     def write(self, stream):
         raise NotImplementedError
@@ -0,0 +1,720 @@
+#!/usr/bin/python3.5
+
+"""World height field assembled from the KCM tiles of a map.
+
+Usage: terrain.py [-h] [-j JOBS] source output
+
+Every KCM tile holds 257x257 height samples, where the last row and column
+are shared with the following tiles. The world height field places all
+tiles into one grid of 256 samples per tile plus a final row and column,
+which is stored as a memory-mapped .npy file next to a .json file with the
+tile origin and coverage. Rows follow the tile y and columns the tile x.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import utility
+import numpy as np
+
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from struct import unpack
+from structs.kcm import KCMFile
+from utility import ValidationError
+from utility import VersionError
+
+
+# Samples per tile without the shared row and column
+TILE_SIZE = 256
+
+
+class HeightField(object):
+    """Memory-mapped world height field.
+
+    Sample coordinates are world coordinates, i.e. the sample at row r and
+    column c of tile (x, y) is at (y * TILE_SIZE + r, x * TILE_SIZE + c).
+    """
+    __slots__ = [
+        'x',
+        'y',
+        'tiles',
+        'heights',
+    ]
+
+    def open(self, path, mode='r'):
+        with open(_metadata_path(path), 'r') as stream:
+            metadata = json.load(stream)
+
+        self.x = metadata['x']
+        self.y = metadata['y']
+        self.tiles = np.array(metadata['tiles'], bool).reshape(
+                metadata['shape'])
+
+        self.heights = np.load(path, mmap_mode=mode)
+
+        if self.heights.shape != _grid_shape(self.tiles.shape):
+            raise ValidationError('Height field does not match its tiles')
+
+        return self
+
+    @property
+    def origin(self):
+        """World sample coordinates of the first sample"""
+        return self.y * TILE_SIZE, self.x * TILE_SIZE
+
+    def has_tile(self, x, y):
+        x -= self.x
+        y -= self.y
+
+        return (0 <= y < self.tiles.shape[0] and
+                0 <= x < self.tiles.shape[1] and bool(self.tiles[y, x]))
+
+    def tile(self, x, y):
+        """Return a 257x257 view of a tile, including the shared samples"""
+        if not self.has_tile(x, y):
+            return None
+
+        row = (y - self.y) * TILE_SIZE
+        col = (x - self.x) * TILE_SIZE
+
+        return self.heights[row:row + TILE_SIZE + 1, col:col + TILE_SIZE + 1]
+
+    def region(self, row_min, col_min, row_max, col_max):
+        """Return a view of the samples of a world sample range.
+
+        The range includes the min and excludes the max coordinates, and is
+        clipped to the height field.
+        """
+        row, col = self.origin
+
+        row_min = max(row_min - row, 0)
+        col_min = max(col_min - col, 0)
+        row_max = max(row_max - row, row_min)
+        col_max = max(col_max - col, col_min)
+
+        return self.heights[row_min:row_max, col_min:col_max]
+
+
+class HeightSampler(object):
+    """Bilinear height sampling of world positions over KCM tiles.
+
+    World x follows the sample columns and world z the sample rows, where
+    samples are cell_size apart and heights are scaled by height_scale.
+    Height maps are loaded on demand into a fixed number of slots, which
+    are reused for the least recently used tiles.
+    """
+    __slots__ = [
+        'tiles',
+        'cell_size',
+        'height_scale',
+        '_slots',
+        '_heights',
+    ]
+
+    def __init__(self, tiles, cache_size=64, cell_size=1.0, height_scale=1.0):
+        """tiles maps (x, y) to KCMFile objects or paths, e.g. find_tiles"""
+        self.tiles = tiles
+        self.cell_size = cell_size
+        self.height_scale = height_scale
+
+        # Tile: slot, ordered from least to most recently used
+        self._slots = OrderedDict()
+        self._heights = np.empty((cache_size, TILE_SIZE + 1, TILE_SIZE + 1),
+                np.float32)
+
+    def _slot(self, tile):
+        """Return the slot of a tile, loading it if needed"""
+        slot = self._slots.get(tile)
+
+        if slot is not None:
+            self._slots.move_to_end(tile)
+            return slot
+
+        if len(self._slots) < len(self._heights):
+            slot = len(self._slots)
+        else:
+            _, slot = self._slots.popitem(last=False)
+
+        kcm = self.tiles[tile]
+        if not isinstance(kcm, KCMFile):
+            kcm = KCMFile().parse(utility.map_file(kcm))
+
+        self._heights[slot] = kcm.height_map[..., 0]
+        self._slots[tile] = slot
+
+        return slot
+
+    def sample(self, positions, normals=False):
+        """Return the heights of world positions of shape (n, 2) as [x, z].
+
+        Positions outside of any tile have a height of nan. With normals,
+        the unit surface normals of shape (n, 3) are returned as well, where
+        y is up.
+        """
+        positions = np.atleast_2d(np.asarray(positions, np.float64))
+        count = len(positions)
+
+        u = positions[:, 0] / self.cell_size
+        v = positions[:, 1] / self.cell_size
+
+        heights = np.full(count, np.nan)
+        gradient = np.full((count, 2), np.nan) if normals else None
+
+        tile_x = np.floor(u / TILE_SIZE)
+        tile_y = np.floor(v / TILE_SIZE)
+
+        # Positions beyond the tiles, including nan, are never grouped
+        if self.tiles:
+            (x_min, y_min), (x_max, y_max) = (np.min(list(self.tiles), 0),
+                    np.max(list(self.tiles), 0))
+
+            inside = np.flatnonzero((tile_x >= x_min) & (tile_y >= y_min) &
+                    (tile_x <= x_max + 1) & (tile_y <= y_max + 1))
+        else:
+            inside = np.empty(0, np.intp)
+
+        tile_x = tile_x[inside].astype(np.int64)
+        tile_y = tile_y[inside].astype(np.int64)
+
+        u = u[inside] - tile_x * TILE_SIZE
+        v = v[inside] - tile_y * TILE_SIZE
+
+        # Positions on the far edge of a tile without a following tile
+        # use the last samples of that tile
+        for i in np.flatnonzero((u == 0) | (v == 0)).tolist():
+            x, y = int(tile_x[i]), int(tile_y[i])
+
+            if (x, y) in self.tiles:
+                continue
+
+            left, up = int(u[i] == 0), int(v[i] == 0)
+
+            for dx, dy in ((left, 0), (0, up), (left, up)):
+                if (dx or dy) and (x - dx, y - dy) in self.tiles:
+                    tile_x[i] -= dx
+                    tile_y[i] -= dy
+                    u[i] += dx * TILE_SIZE
+                    v[i] += dy * TILE_SIZE
+                    break
+
+        # The last sample of a tile is only used as the right neighbour
+        col = np.minimum(u.astype(np.intp), TILE_SIZE - 1)
+        row = np.minimum(v.astype(np.intp), TILE_SIZE - 1)
+
+        fu = u - col
+        fv = v - row
+
+        keys, inverse = _group_tiles(tile_x, tile_y)
+
+        known = np.array([tuple(key) in self.tiles for key in keys.tolist()],
+                bool)
+
+        # Load at most one cache worth of tiles per step
+        order = np.flatnonzero(known)
+        step = len(self._heights)
+
+        for start in range(0, len(order), step):
+            chunk = order[start:start + step]
+
+            slots = np.full(len(keys), -1, np.intp)
+            for i in chunk.tolist():
+                slots[i] = self._slot(tuple(keys[i].tolist()))
+
+            slot = slots[inverse]
+            selected = np.flatnonzero(slot >= 0)
+
+            s = slot[selected]
+            r = row[selected]
+            c = col[selected]
+
+            h00 = self._heights[s, r, c]
+            h01 = self._heights[s, r, c + 1]
+            h10 = self._heights[s, r + 1, c]
+            h11 = self._heights[s, r + 1, c + 1]
+
+            a = fu[selected]
+            b = fv[selected]
+
+            top = h00 + (h01 - h00) * a
+            bottom = h10 + (h11 - h10) * a
+
+            target = inside[selected]
+            heights[target] = (top + (bottom - top) * b) * self.height_scale
+
+            if normals:
+                gradient[target, 0] = (h01 - h00) + (h11 - h10 - h01 + h00) * b
+                gradient[target, 1] = bottom - top
+
+        if not normals:
+            return heights
+
+        gradient *= self.height_scale / self.cell_size
+
+        result = np.empty((count, 3))
+        result[:, 0] = -gradient[:, 0]
+        result[:, 1] = 1
+        result[:, 2] = -gradient[:, 1]
+        result /= np.linalg.norm(result, axis=1, keepdims=True)
+
+        return heights, result
+
+
+def _group_tiles(tile_x, tile_y):
+    """Return the distinct (x, y) tiles and the tile index of each sample"""
+    if not len(tile_x):
+        return np.empty((0, 2), np.int64), np.empty(0, np.intp)
+
+    x_min, y_min = tile_x.min(), tile_y.min()
+    width = int(tile_x.max() - x_min) + 1
+    height = int(tile_y.max() - y_min) + 1
+
+    if width * height > len(tile_x):
+        # Sparse tiles, e.g. outliers far away
+        keys, inverse = np.unique(np.stack([tile_x, tile_y], axis=1), axis=0,
+                return_inverse=True)
+        return keys, inverse.reshape(-1)
+
+    # Dense tiles are grouped without sorting
+    key = (tile_y - y_min) * width + (tile_x - x_min)
+
+    used = np.zeros(width * height, bool)
+    used[key] = True
+    used = np.flatnonzero(used)
+
+    index = np.empty(width * height, np.intp)
+    index[used] = np.arange(len(used))
+
+    keys = np.stack([used % width + x_min, used // width + y_min], axis=1)
+    return keys, index[key]
+
+class TerrainMesh(object):
+    """Vertex and index buffers of a KCM tile.
+
+    Vertices hold world positions, where y is up, unit normals, the colors
+    of the color map and uvs over the whole tile, which map the alpha maps
+    and decal map of the tile. Triangles are counter-clockwise seen from
+    above.
+    """
+    __slots__ = [
+        'x',
+        'y',
+        'positions',
+        'normals',
+        'colors',
+        'uvs',
+        'indices',
+        'alpha_ids',
+        'alpha_maps',
+        'decal_ids',
+        'decal_map',
+    ]
+
+
+def _fan_errors(heights):
+    """Return the error grid of the quadtree nodes of each size.
+
+    A node is approximated by a fan of four triangles between its corners
+    and its center, its error is the largest height difference of all
+    samples it covers.
+    """
+    heights = np.asarray(heights, np.float64)
+    samples = np.arange(TILE_SIZE + 1)
+
+    errors = {}
+    size = TILE_SIZE
+
+    while size > 1:
+        count = TILE_SIZE // size
+
+        # Node and local coordinates in [0, 1] of every sample, where the
+        # last samples belong to the last nodes
+        node = np.minimum(samples // size, count - 1)
+        local = (samples - node * size) / size
+
+        start = node * size
+        row, col = np.ix_(start, start)
+
+        a = heights[row, col]
+        b = heights[row, col + size]
+        c = heights[row + size, col]
+        d = heights[row + size, col + size]
+        e = heights[row + size // 2, col + size // 2]
+
+        v, u = np.ix_(local, local)
+        u, v = np.broadcast_arrays(u, v)
+
+        top = (v <= u) & (v <= 1 - u)
+        bottom = (v >= u) & (v >= 1 - u)
+        left = ~top & ~bottom & (u <= 0.5)
+
+        fan = np.where(top, a * (1 - u - v) + b * (u - v) + e * 2 * v,
+              np.where(bottom, c * (v - u) + d * (u + v - 1) + e * 2 * (1 - v),
+              np.where(left, a * (1 - v - u) + c * (v - u) + e * 2 * u,
+                  b * (u - v) + d * (u + v - 1) + e * 2 * (1 - u))))
+
+        error = np.abs(fan - heights)
+
+        # Maximum of each node including its last row and column, which are
+        # shared with the following nodes
+        blocks = error[:-1, :-1].reshape(count, size, count, size).max(axis=(1, 3))
+        blocks = np.maximum(blocks,
+                error[size::size, :-1].reshape(count, count, size).max(axis=2))
+        blocks = np.maximum(blocks,
+                error[:-1, size::size].reshape(count, size, count).max(axis=1))
+
+        errors[size] = blocks
+        size //= 2
+
+    return errors
+
+def quadtree_leaves(heights, max_error):
+    """Return the rows, columns and sizes of the quadtree leaves of a tile.
+
+    Nodes are split until their error is at most max_error, or they cover a
+    single cell.
+    """
+    errors = _fan_errors(heights)
+
+    rows = []
+    cols = []
+    sizes = []
+
+    nodes = np.ones((1, 1), bool)
+    size = TILE_SIZE
+
+    while True:
+        if size == 1:
+            split = np.zeros_like(nodes)
+        else:
+            split = nodes & (errors[size] > max_error)
+
+        row, col = np.nonzero(nodes & ~split)
+        rows.append(row * size)
+        cols.append(col * size)
+        sizes.append(np.full(len(row), size))
+
+        if not split.any():
+            break
+
+        nodes = np.kron(split, np.ones((2, 2), bool)).astype(bool)
+        size //= 2
+
+    return np.concatenate(rows), np.concatenate(cols), np.concatenate(sizes)
+
+def _corners(rows, cols, sizes):
+    """Return a grid of all leaf corners"""
+    corners = np.zeros((TILE_SIZE + 1, TILE_SIZE + 1), bool)
+
+    for row_offset in (0, 1):
+        for col_offset in (0, 1):
+            corners[rows + sizes * row_offset, cols + sizes * col_offset] = True
+
+    return corners
+
+def _leaves(heights, max_error):
+    heights = np.asarray(heights)
+    if heights.ndim == 3:
+        heights = heights[..., 0]
+
+    leaves = quadtree_leaves(heights, max_error)
+    return leaves, _corners(*leaves)
+
+# Offset of an adjacent tile: (vertices of this tile, vertices of that tile)
+_EDGES = {
+    (-1, 0) : ((slice(None), 0), (slice(None), -1)),
+    (1, 0)  : ((slice(None), -1), (slice(None), 0)),
+    (0, -1) : ((0, slice(None)), (-1, slice(None))),
+    (0, 1)  : ((-1, slice(None)), (0, slice(None))),
+}
+
+def _fans(index, boundary, rows, cols, sizes):
+    """Return the triangles of fans around the centers of nodes.
+
+    Each fan includes all boundary vertices on the edges of its node in
+    counter-clockwise order, starting at the top left corner.
+    """
+    perimeter = 4 * sizes
+    leaf = np.repeat(np.arange(len(sizes)), perimeter)
+    step = np.arange(perimeter.sum()) - np.repeat(np.cumsum(perimeter) -
+            perimeter, perimeter)
+
+    size = sizes[leaf]
+    side, t = step // size, step % size
+
+    row = rows[leaf] + np.choose(side, [0, t, size, size - t])
+    col = cols[leaf] + np.choose(side, [t, size, size - t, 0])
+
+    used = boundary[row, col]
+    leaf, ring = leaf[used], index[row[used], col[used]]
+
+    # Following vertex in each ring, wrapping at its end
+    following = np.arange(1, len(ring) + 1)
+    last = np.flatnonzero(np.append(leaf[1:] != leaf[:-1], True))
+    first = np.append(0, last[:-1] + 1)
+    following[last] = first
+
+    center = index[rows + sizes // 2, cols + sizes // 2][leaf]
+
+    return np.stack([center, ring[following], ring], axis=1)
+
+def _mesh(kcm, leaves, vertices, cell_size, height_scale):
+    heights = kcm.height_map[..., 0]
+    rows, cols, sizes = leaves
+
+    fans = sizes > 1
+    boundary = vertices.copy()
+    vertices[rows[fans] + sizes[fans] // 2, cols[fans] + sizes[fans] // 2] = True
+
+    index = np.full(vertices.shape, -1, np.int64)
+    index[vertices] = np.arange(np.count_nonzero(vertices))
+
+    # Single cells are split into two triangles
+    r, c = rows[~fans], cols[~fans]
+    a, b = index[r, c], index[r, c + 1]
+    d, e = index[r + 1, c], index[r + 1, c + 1]
+
+    triangles = [
+        np.stack([a, d, e, a, e, b], axis=1).reshape(-1, 3),
+        _fans(index, boundary, rows[fans], cols[fans], sizes[fans]),
+    ]
+
+    row, col = np.nonzero(vertices)
+
+    mesh = TerrainMesh()
+    mesh.x = kcm.x
+    mesh.y = kcm.y
+
+    mesh.positions = np.stack([
+        (kcm.x * TILE_SIZE + col) * cell_size,
+        heights[row, col] * float(height_scale),
+        (kcm.y * TILE_SIZE + row) * cell_size,
+    ], axis=1).astype(np.float32)
+
+    # Central differences of the height map
+    gradient_z, gradient_x = np.gradient(heights.astype(np.float64))
+    scale = height_scale / cell_size
+
+    normals = np.stack([-gradient_x[row, col] * scale, np.ones(len(row)),
+            -gradient_z[row, col] * scale], axis=1)
+    mesh.normals = (normals / np.linalg.norm(normals, axis=1,
+        keepdims=True)).astype(np.float32)
+
+    # Colors are stored per cell, the last vertices use the last cells
+    mesh.colors = kcm.color_map[np.minimum(row, TILE_SIZE - 1),
+            np.minimum(col, TILE_SIZE - 1)]
+    mesh.uvs = np.stack([col, row], axis=1).astype(np.float32) / TILE_SIZE
+
+    mesh.indices = np.concatenate(triangles).astype(np.uint32)
+
+    mesh.alpha_ids = kcm.alpha_ids
+    mesh.alpha_maps = kcm.alpha_maps
+    mesh.decal_ids = kcm.decal_ids
+    mesh.decal_map = kcm.decal_map
+
+    return mesh
+
+def build_mesh(kcm, max_error=64, neighbours=None, cell_size=1.0,
+        height_scale=1.0):
+    """Build the terrain mesh of a KCMFile.
+
+    max_error is the largest height difference in height map units between
+    the samples and the fan of each quadtree node. Corners of adjacent nodes
+    on the edges of a node are added to its fan, which keeps the mesh free
+    of cracks, but can change this difference slightly.
+
+    neighbours maps (dx, dy) tile offsets to the height maps of adjacent
+    tiles. Their leaf corners on the shared edges are included, so adjacent
+    meshes have the same edge vertices and no cracks between them.
+    """
+    leaves, vertices = _leaves(kcm.height_map, max_error)
+
+    for offset, heights in (neighbours or {}).items():
+        edge, other = _EDGES[offset]
+        vertices[edge] |= _leaves(heights, max_error)[1][other]
+
+    return _mesh(kcm, leaves, vertices, cell_size, height_scale)
+
+def build_meshes(tiles, max_error=64, cell_size=1.0, height_scale=1.0):
+    """Yield the seamless terrain meshes of {(x, y): KCMFile or path} tiles.
+
+    The quadtree of each tile is built once and shared with its neighbours.
+    """
+    cache = {}
+
+    def load(tile):
+        kcm = tiles[tile]
+        if not isinstance(kcm, KCMFile):
+            kcm = KCMFile().parse(utility.map_file(kcm))
+        return kcm
+
+    def leaves(tile):
+        if tile not in cache:
+            cache[tile] = _leaves(load(tile).height_map, max_error)
+        return cache[tile]
+
+    for x, y in sorted(tiles):
+        own, vertices = leaves((x, y))
+        vertices = vertices.copy()
+
+        for (dx, dy), (edge, other) in _EDGES.items():
+            if (x + dx, y + dy) in tiles:
+                vertices[edge] |= leaves((x + dx, y + dy))[1][other]
+
+        yield _mesh(load((x, y)), own, vertices, cell_size, height_scale)
+
+        # Tiles are visited by x, so earlier columns are no longer needed
+        for tile in [t for t in cache if t[0] < x - 1]:
+            del cache[tile]
+
+
+def _metadata_path(path):
+    return os.path.splitext(path)[0] + '.json'
+
+def _grid_shape(shape):
+    return shape[0] * TILE_SIZE + 1, shape[1] * TILE_SIZE + 1
+
+def find_tiles(source):
+    """Return the tile coordinates and paths of all KCM files below source"""
+    tiles = {}
+
+    for root, _, files in os.walk(source):
+        for name in files:
+            if os.path.splitext(name)[1].lower() != '.kcm':
+                continue
+
+            path = os.path.join(root, name)
+
+            # Only the header is needed to place the tile
+            with open(path, 'rb') as stream:
+                header = stream.read(36)
+
+            if len(header) != 36:
+                raise ValidationError('Invalid KCM structure: %s' % path)
+
+            _, _, x, y, _, _, _, _, version = unpack('<9I', header)
+
+            if version != 7:
+                raise VersionError('KCM version %d is unsupported: %s' % (
+                    version, path))
+
+            if (x, y) in tiles:
+                raise ValidationError('Duplicate KCM tile %d, %d: %s' % (
+                    x, y, path))
+
+            tiles[x, y] = path
+
+    return tiles
+
+def _tile_slices(tiles, x, y):
+    """Return the (rows, columns) slices of the samples a tile writes.
+
+    Shared samples are written by the tile, which holds them at its first
+    row and column, or by the nearest other tile, if that one is missing.
+    Every world sample therefore has a single writer, which allows tiles
+    to be written in parallel.
+    """
+    def missing(dx, dy):
+        return (x + dx, y + dy) not in tiles
+
+    n = TILE_SIZE
+
+    parts = [(slice(0, n), slice(0, n))]
+
+    # Shared column of the following tile in x
+    if missing(1, 0):
+        parts.append((slice(0, n), slice(n, n + 1)))
+
+    # Shared row of the following tile in y, its first sample might be held
+    # by the tile preceding that one in x
+    if missing(0, 1):
+        parts.append((slice(n, n + 1), slice(1, n)))
+
+        if missing(-1, 1):
+            parts.append((slice(n, n + 1), slice(0, 1)))
+
+    # Shared corner
+    if missing(1, 0) and missing(0, 1) and missing(1, 1):
+        parts.append((slice(n, n + 1), slice(n, n + 1)))
+
+    return parts
+
+def _write_tile(job):
+    path, output, row, col, parts = job
+
+    kcm = KCMFile().parse(utility.map_file(path))
+    heights = np.load(output, mmap_mode='r+')
+
+    for rows, cols in parts:
+        heights[row + rows.start:row + rows.stop,
+                col + cols.start:col + cols.stop] = kcm.height_map[rows, cols, 0]
+
+    heights.flush()
+
+def build(source, output, jobs=None):
+    """Build the height field of all KCM tiles below source.
+
+    Tiles are written in a process pool directly into the memory-mapped
+    output file, missing tiles keep a height of zero.
+    """
+    tiles = find_tiles(source)
+
+    if not tiles:
+        raise ValidationError('No KCM tiles found')
+
+    xs = [x for x, _ in tiles]
+    ys = [y for _, y in tiles]
+
+    x_min, y_min = min(xs), min(ys)
+
+    coverage = np.zeros((max(ys) - y_min + 1, max(xs) - x_min + 1), bool)
+    for x, y in tiles:
+        coverage[y - y_min, x - x_min] = True
+
+    heights = np.lib.format.open_memmap(output, 'w+', np.uint16,
+            _grid_shape(coverage.shape))
+    del heights
+
+    tasks = [(path, output, (y - y_min) * TILE_SIZE, (x - x_min) * TILE_SIZE,
+            _tile_slices(tiles, x, y)) for (x, y), path in sorted(tiles.items())]
+
+    with ProcessPoolExecutor(jobs) as executor:
+        for _ in executor.map(_write_tile, tasks, chunksize=16):
+            pass
+
+    with open(_metadata_path(output), 'w') as stream:
+        json.dump({
+            'x'     : x_min,
+            'y'     : y_min,
+            'shape' : coverage.shape,
+            'tiles' : coverage.ravel().astype(int).tolist(),
+        }, stream)
+
+    return HeightField().open(output)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+            description='Build the world height field of KCM tiles.')
+
+    parser.add_argument('source', help='map directory with KCM files')
+    parser.add_argument('output', help='height field .npy file')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+            help='number of worker processes (default: CPU count)')
+
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    field = build(args.source, args.output, args.jobs)
+
+    print('%d tiles, %dx%d samples in %.2f s' % (field.tiles.sum(),
+        field.heights.shape[1], field.heights.shape[0],
+        time.perf_counter() - start))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
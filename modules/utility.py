@@ -1,8 +1,14 @@
+import functools
+import io
 import os
+import mmap
+import zlib
 import numpy as np
 
+from struct import Struct
 from struct import pack
 from struct import unpack
+from struct import unpack_from
 
 
 class ValidationError(Exception):
@@ -14,41 +20,6 @@ class VersionError(Exception):
         super().__init__(message)
 
 
-_CRC32_TABLE = [
-    0x00000000, 0x77073096, 0xEE0E612C, 0x990951BA, 0x076DC419, 0x706AF48F, 0xE963A535, 0x9E6495A3,
-    0x0EDB8832, 0x79DCB8A4, 0xE0D5E91E, 0x97D2D988, 0x09B64C2B, 0x7EB17CBD, 0xE7B82D07, 0x90BF1D91,
-    0x1DB71064, 0x6AB020F2, 0xF3B97148, 0x84BE41DE, 0x1ADAD47D, 0x6DDDE4EB, 0xF4D4B551, 0x83D385C7,
-    0x136C9856, 0x646BA8C0, 0xFD62F97A, 0x8A65C9EC, 0x14015C4F, 0x63066CD9, 0xFA0F3D63, 0x8D080DF5,
-    0x3B6E20C8, 0x4C69105E, 0xD56041E4, 0xA2677172, 0x3C03E4D1, 0x4B04D447, 0xD20D85FD, 0xA50AB56B,
-    0x35B5A8FA, 0x42B2986C, 0xDBBBC9D6, 0xACBCF940, 0x32D86CE3, 0x45DF5C75, 0xDCD60DCF, 0xABD13D59,
-    0x26D930AC, 0x51DE003A, 0xC8D75180, 0xBFD06116, 0x21B4F4B5, 0x56B3C423, 0xCFBA9599, 0xB8BDA50F,
-    0x2802B89E, 0x5F058808, 0xC60CD9B2, 0xB10BE924, 0x2F6F7C87, 0x58684C11, 0xC1611DAB, 0xB6662D3D,
-    0x76DC4190, 0x01DB7106, 0x98D220BC, 0xEFD5102A, 0x71B18589, 0x06B6B51F, 0x9FBFE4A5, 0xE8B8D433,
-    0x7807C9A2, 0x0F00F934, 0x9609A88E, 0xE10E9818, 0x7F6A0DBB, 0x086D3D2D, 0x91646C97, 0xE6635C01,
-    0x6B6B51F4, 0x1C6C6162, 0x856530D8, 0xF262004E, 0x6C0695ED, 0x1B01A57B, 0x8208F4C1, 0xF50FC457,
-    0x65B0D9C6, 0x12B7E950, 0x8BBEB8EA, 0xFCB9887C, 0x62DD1DDF, 0x15DA2D49, 0x8CD37CF3, 0xFBD44C65,
-    0x4DB26158, 0x3AB551CE, 0xA3BC0074, 0xD4BB30E2, 0x4ADFA541, 0x3DD895D7, 0xA4D1C46D, 0xD3D6F4FB,
-    0x4369E96A, 0x346ED9FC, 0xAD678846, 0xDA60B8D0, 0x44042D73, 0x33031DE5, 0xAA0A4C5F, 0xDD0D7CC9,
-    0x5005713C, 0x270241AA, 0xBE0B1010, 0xC90C2086, 0x5768B525, 0x206F85B3, 0xB966D409, 0xCE61E49F,
-    0x5EDEF90E, 0x29D9C998, 0xB0D09822, 0xC7D7A8B4, 0x59B33D17, 0x2EB40D81, 0xB7BD5C3B, 0xC0BA6CAD,
-    0xEDB88320, 0x9ABFB3B6, 0x03B6E20C, 0x74B1D29A, 0xEAD54739, 0x9DD277AF, 0x04DB2615, 0x73DC1683,
-    0xE3630B12, 0x94643B84, 0x0D6D6A3E, 0x7A6A5AA8, 0xE40ECF0B, 0x9309FF9D, 0x0A00AE27, 0x7D079EB1,
-    0xF00F9344, 0x8708A3D2, 0x1E01F268, 0x6906C2FE, 0xF762575D, 0x806567CB, 0x196C3671, 0x6E6B06E7,
-    0xFED41B76, 0x89D32BE0, 0x10DA7A5A, 0x67DD4ACC, 0xF9B9DF6F, 0x8EBEEFF9, 0x17B7BE43, 0x60B08ED5,
-    0xD6D6A3E8, 0xA1D1937E, 0x38D8C2C4, 0x4FDFF252, 0xD1BB67F1, 0xA6BC5767, 0x3FB506DD, 0x48B2364B,
-    0xD80D2BDA, 0xAF0A1B4C, 0x36034AF6, 0x41047A60, 0xDF60EFC3, 0xA867DF55, 0x316E8EEF, 0x4669BE79,
-    0xCB61B38C, 0xBC66831A, 0x256FD2A0, 0x5268E236, 0xCC0C7795, 0xBB0B4703, 0x220216B9, 0x5505262F,
-    0xC5BA3BBE, 0xB2BD0B28, 0x2BB45A92, 0x5CB36A04, 0xC2D7FFA7, 0xB5D0CF31, 0x2CD99E8B, 0x5BDEAE1D,
-    0x9B64C2B0, 0xEC63F226, 0x756AA39C, 0x026D930A, 0x9C0906A9, 0xEB0E363F, 0x72076785, 0x05005713,
-    0x95BF4A82, 0xE2B87A14, 0x7BB12BAE, 0x0CB61B38, 0x92D28E9B, 0xE5D5BE0D, 0x7CDCEFB7, 0x0BDBDF21,
-    0x86D3D2D4, 0xF1D4E242, 0x68DDB3F8, 0x1FDA836E, 0x81BE16CD, 0xF6B9265B, 0x6FB077E1, 0x18B74777,
-    0x88085AE6, 0xFF0F6A70, 0x66063BCA, 0x11010B5C, 0x8F659EFF, 0xF862AE69, 0x616BFFD3, 0x166CCF45,
-    0xA00AE278, 0xD70DD2EE, 0x4E048354, 0x3903B3C2, 0xA7672661, 0xD06016F7, 0x4969474D, 0x3E6E77DB,
-    0xAED16A4A, 0xD9D65ADC, 0x40DF0B66, 0x37D83BF0, 0xA9BCAE53, 0xDEBB9EC5, 0x47B2CF7F, 0x30B5FFE9,
-    0xBDBDF21C, 0xCABAC28A, 0x53B39330, 0x24B4A3A6, 0xBAD03605, 0xCDD70693, 0x54DE5729, 0x23D967BF,
-    0xB3667A2E, 0xC4614AB8, 0x5D681B02, 0x2A6F2B94, 0xB40BBE37, 0xC30C8EA1, 0x5A05DF1B, 0x2D02EF8D,
-]
-
 CRC_SEED_GB  = 0x35BFD8A4
 CRC_SEED_MAP = 0x35BFD8A5
 CRC_SEED_OPL = 0xA0B0C0D0
@@ -56,122 +27,455 @@ CRC_SEED_KCM = 0xA0B0C0D0
 CRC_SEED_ENV = 0xA0B0C0D0
 
 def compute_crc32(crc32, values):
-    for value in values:
-        crc32 = _CRC32_TABLE[(crc32 ^ value) & 0xFF] ^ (crc32 >> 8)
+    # The game uses the reflected CRC-32 table without the pre and post
+    # inversion, which zlib applies. Inverting the seed and result cancels it.
+    if not isinstance(values, (bytes, bytearray, memoryview, mmap.mmap)):
+        values = bytes(values)
 
-    return crc32
+    return zlib.crc32(values, crc32 ^ 0xFFFFFFFF) ^ 0xFFFFFFFF
 
+def verify_crc32(data, offset, seed, name):
+    """Verify the checksum at offset against all bytes following it"""
+    if len(data) < offset + 4:
+        raise ValidationError('Invalid %s structure' % name)
 
-def _get_crypt_table(name):
-    path = os.path.join(os.path.dirname(__file__), 'resources', name)
+    checksum = unpack_from('<I', data, offset)[0]
 
-    with open(path) as data:
-        return [[int(v, 16) for v in line.split()] for line in data]
+    if compute_crc32(seed, memoryview(data)[offset + 4:]) != checksum:
+        raise ValidationError('Invalid %s checksum' % name)
+
+def read_verified(stream, offset, seed, name):
+    """Verify the remaining stream or buffer, returning it as a reader"""
+    reader = as_reader(stream)
+    verify_crc32(reader.buffer[reader.offset:], offset, seed, name)
+    return reader
+
+
+_CRYPT_TABLES = {}
 
 _TABLE_ENCRYPT = [
-    _get_crypt_table('table_encrypt_1'),
-    _get_crypt_table('table_encrypt_2'),
+    'table_encrypt_1',
+    'table_encrypt_2',
 ]
 
 _TABLE_DECRYPT = [
-    _get_crypt_table('table_decrypt_1'),
-    _get_crypt_table('table_decrypt_2'),
+    'table_decrypt_1',
+    'table_decrypt_2',
 ]
 
+def _parse_crypt_table(path):
+    with open(path) as data:
+        return b''.join(bytes(int(v, 16) for v in line.split()) for line in data)
+
+def _load_crypt_table(name):
+    """Map a binary crypt table, creating it from the text table if needed"""
+    path = os.path.join(os.path.dirname(__file__), 'resources', name)
+
+    if not os.path.exists(path + '.bin'):
+        data = _parse_crypt_table(path)
+
+        try:
+            temp = '%s.bin.%d' % (path, os.getpid())
+            with open(temp, 'wb') as target:
+                target.write(data)
+
+            os.replace(temp, path + '.bin')
+
+        except OSError:
+            data = memoryview(data)  # Read-only installation
+            return [data[i:i + 256] for i in range(0, len(data), 256)]
+
+    # A read-only mapping is shared between all processes
+    with open(path + '.bin', 'rb') as source:
+        data = memoryview(
+                mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ))
+
+    # Each row is a 256 byte translation table for bytes.translate
+    return [data[i:i + 256] for i in range(0, len(data), 256)]
+
+def _get_translation(name, key):
+    table = _CRYPT_TABLES.get(name)
+    if table is None:
+        table = _CRYPT_TABLES[name] = _load_crypt_table(name)
+
+    return table[key]
+
 def decrypt_value(key, value, table=0):
-    return _TABLE_DECRYPT[table][key][value]
+    return _get_translation(_TABLE_DECRYPT[table], key)[value]
 
 def encrypt_value(key, value, table=0):
-    return _TABLE_ENCRYPT[table][key][value]
+    return _get_translation(_TABLE_ENCRYPT[table], key)[value]
 
 def decrypt(key, values, table=0):
-    return [_TABLE_DECRYPT[table][key][v] for v in values]
+    return bytes(values).translate(_get_translation(_TABLE_DECRYPT[table], key))
 
 def encrypt(key, values, table=0):
-    return [_TABLE_ENCRYPT[table][key][v] for v in values]
+    return bytes(values).translate(_get_translation(_TABLE_ENCRYPT[table], key))
 
-def decrypt_stream(key, source, target, table=0):
+def _translate_stream(translation, source, target):
     for data in iter(lambda: source.read(128 * 1024), b''):
-        target.write(bytearray(decrypt(key, data, table=table)))
+        target.write(data.translate(translation))
+
+def decrypt_stream(key, source, target, table=0):
+    _translate_stream(
+            _get_translation(_TABLE_DECRYPT[table], key), source, target)
 
 def encrypt_stream(key, source, target, table=0):
+    _translate_stream(
+            _get_translation(_TABLE_ENCRYPT[table], key), source, target)
+
+
+def _copy_range(source_fd, target_fd, offset, count):
+    if hasattr(os, 'copy_file_range'):
+        try:
+            return os.copy_file_range(source_fd, target_fd, count, offset)
+        except OSError:
+            pass  # E.g. unsupported file system, use sendfile instead
+
+    return os.sendfile(target_fd, source_fd, offset, count)
+
+def copy_stream(source, target):
+    """Copy the remaining source stream, in kernel space if possible"""
+    try:
+        source_fd = source.fileno()
+        target_fd = target.fileno()
+
+        offset = source.tell()
+        count = os.fstat(source_fd).st_size - offset
+
+        # Flush buffered data before writing to the descriptor
+        target.flush()
+        position = target.tell()
+
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        count = 0  # Not a regular file, copy in user space
+
+    copied = 0
+    try:
+        while copied < count:
+            size = _copy_range(source_fd, target_fd,
+                    offset + copied, count - copied)
+            if not size:
+                break
+
+            copied += size
+
+    except OSError:
+        pass  # Unsupported by the kernel, copy the rest in user space
+
+    if count > 0:
+        # Synchronize the buffered stream positions
+        source.seek(offset + copied)
+        target.seek(position + copied)
+
     for data in iter(lambda: source.read(128 * 1024), b''):
-        target.write(bytearray(encrypt(key, data, table=table)))
+        target.write(data)
 
 
 def decrypt_gtx(source, target):
-    preamble = unpack('<Q', source.read(8))[0]
-    if preamble != 0x7C204C414B:
+    preamble = source.read(8)
+    if len(preamble) != 8 or unpack('<Q', preamble)[0] != 0x7C204C414B:
         raise ValidationError('Not a valid GTX image')
 
+    header = source.read(64)
+    if len(header) != 64:
+        raise ValidationError('Too few bytes in GTX image')
+
     target.write(pack('<B', ord('D')))
     target.write(pack('<B', ord('D')))
     target.write(pack('<B', ord('S')))
     target.write(pack('<B', ord(' ')))
     target.write(pack('<I', 124))
-    target.write(bytearray(decrypt(4, source.read(64))))
+    target.write(decrypt(4, header))
 
-    for data in iter(lambda: source.read(128 * 1024), b''):
-        target.write(data)
+    copy_stream(source, target)
 
 def encrypt_dds(source, target):
-    preamble = unpack('<Q', source.read(8))[0]
-    if preamble != 0x7C20534444:
+    preamble = source.read(8)
+    if len(preamble) != 8 or unpack('<Q', preamble)[0] != 0x7C20534444:
         raise ValidationError('Not a valid DDS image')
 
+    header = source.read(64)
+    if len(header) != 64:
+        raise ValidationError('Too few bytes in DDS image')
+
     target.write(pack('<B', ord('K')))
     target.write(pack('<B', ord('A')))
     target.write(pack('<B', ord('L')))
     target.write(pack('<B', ord(' ')))
     target.write(pack('<I', 124))
-    target.write(bytearray(encrypt(4, source.read(64))))
+    target.write(encrypt(4, header))
 
-    for data in iter(lambda: source.read(128 * 1024), b''):
-        target.write(data)
+    copy_stream(source, target)
 
 
+@functools.lru_cache(maxsize=None)
 def get_root_path(path):
     """Return the asset root directory"""
-    path = os.path.split(path)
+    head, tail = os.path.split(path)
 
-    if not path[0] or not path[1]:
-        return ''
+    while head and tail:
+        if tail.lower() == 'data' or tail.lower() == 'map':
+            return head
 
-    if path[1] == 'data' or path[1] == 'map':
-        return path[0]
+        head, tail = os.path.split(head)
 
-    return get_root_path(path[0])
+    return ''
 
 def get_common_path(path):
     return os.path.join(get_root_path(path),
             os.path.join('data', 'objects', 'common'))
 
 
+class TextureResolver(object):
+    """Case-insensitive lookup of texture files.
+
+    Every directory is listed once, so repeated lookups neither access the
+    file system nor depend on the case of paths and names.
+    """
+    __slots__ = [
+        '_listings',
+    ]
+
+    def __init__(self):
+        self._listings = {}
+
+    def clear(self):
+        """Forget all listed directories, e.g. after adding textures"""
+        self._listings.clear()
+
+    def _listing(self, path):
+        """Map the lowercase entry names of a directory to their paths"""
+        listing = self._listings.get(path)
+
+        if listing is None:
+            listing = {}
+
+            # The scandir context manager needs Python 3.6, whereas the
+            # add-on runs on Blender's Python 3.5
+            try:
+                for name in os.listdir(path or '.'):
+                    listing.setdefault(name.lower(), os.path.join(path, name))
+            except OSError:
+                pass
+
+            self._listings[path] = listing
+
+        return listing
+
+    def _resolve(self, path, names):
+        for name in names:
+            path = self._listing(path).get(name.lower())
+
+            if path is None:
+                return None
+
+        return path
+
+    def find(self, path, name):
+        """Return the path of a texture or None if it does not exist.
+
+        Searches the tex directory of the object directory path, followed
+        by the tex directory of the common object directory.
+        """
+        return (self._resolve(path, ['tex', name]) or
+                self._resolve(get_root_path(path),
+                        ['data', 'objects', 'common', 'tex', name]))
+
+    def find_relative(self, root, path):
+        """Return the path of a file relative to root or None"""
+        return self._resolve(root,
+                [name for name in path.replace('\\', '/').split('/') if name])
+
+_TEXTURE_RESOLVER = TextureResolver()
+
+def find_texture(path, name):
+    """Return the path of a texture using a shared TextureResolver"""
+    return _TEXTURE_RESOLVER.find(path, name)
+
+def find_relative(root, path):
+    """Return the path of a file using a shared TextureResolver"""
+    return _TEXTURE_RESOLVER.find_relative(root, path)
+
+def clear_textures():
+    """Forget the directories listed by the shared TextureResolver"""
+    _TEXTURE_RESOLVER.clear()
+
+
+class BufferReader(object):
+    """Stream-like cursor over a bytes, bytearray, memoryview or mmap buffer.
+
+    Small reads return slices of the buffer, whereas arrays are read-only
+    views into it, so large blocks are never copied while parsing.
+    """
+    __slots__ = [
+        'data',
+        'buffer',
+        'offset',
+    ]
+
+    def __init__(self, data, offset=0):
+        if isinstance(data, bytearray):
+            data = memoryview(data)
+
+        self.data = data
+        self.buffer = memoryview(data).cast('B')
+        self.offset = offset
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def tell(self):
+        return self.offset
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.offset
+        elif whence == io.SEEK_END:
+            offset += len(self.buffer)
+
+        self.offset = offset
+        return offset
+
+    def read(self, size=-1):
+        if size < 0:
+            data = self.data[self.offset:]
+        else:
+            data = self.data[self.offset:self.offset + size]
+
+        self.offset += len(data)
+        return data
+
+    def view(self, size):
+        """Return a memoryview of the next size bytes"""
+        data = self.buffer[self.offset:self.offset + size]
+        self.offset += len(data)
+        return data
+
+    def unpack(self, fmt):
+        """Unpack a precompiled Struct or format string at the cursor"""
+        if not isinstance(fmt, Struct):
+            fmt = _get_struct(fmt)
+
+        if self.offset + fmt.size > len(self.buffer):
+            raise ValidationError('Unexpected end of buffer')
+
+        values = fmt.unpack_from(self.buffer, self.offset)
+        self.offset += fmt.size
+        return values
+
+    def array(self, dtype, shape):
+        """Return a read-only array view at the cursor"""
+        size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+
+        if self.offset + size > len(self.buffer):
+            raise ValidationError('Unexpected end of buffer')
+
+        array = np.ndarray(shape, dtype, self.buffer, self.offset)
+        self.offset += size
+        return array
+
+    def read_zero(self):
+        """Read up to and excluding the next zero byte"""
+        start = self.offset
+        end = start
+
+        while end < len(self.buffer):
+            index = bytes(self.buffer[end:end + 256]).find(b'\0')
+            if index >= 0:
+                end += index
+                self.offset = end + 1
+                return self.data[start:end]
+
+            end += 256
+
+        self.offset = len(self.buffer)
+        return self.data[start:]
+
+_STRUCTS = {}
+
+def _get_struct(fmt):
+    result = _STRUCTS.get(fmt)
+    if result is None:
+        result = _STRUCTS[fmt] = Struct(fmt)
+
+    return result
+
+def read_array(stream, dtype, shape):
+    """Read an array, which is a view if the stream is a BufferReader"""
+    if isinstance(stream, BufferReader):
+        return stream.array(dtype, shape)
+
+    size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+    return np.ndarray(shape, dtype, stream.read(size))
+
+def map_file(path):
+    """Map a file read-only, the mapping is shared between processes"""
+    with open(path, 'rb') as source:
+        if not os.fstat(source.fileno()).st_size:
+            return b''  # Empty files cannot be mapped
+
+        return mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+
+@functools.lru_cache(maxsize=None)
+def file_mode():
+    """Return the permission bits of new files under the umask"""
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+def as_reader(stream):
+    """Wrap a buffer or the remaining stream in a BufferReader.
+
+    Streams are read into memory. Arrays are views into the page cache
+    only for buffers from map_file, where each mapping that is still
+    referenced keeps a file descriptor open.
+    """
+    if isinstance(stream, BufferReader):
+        return stream
+
+    if isinstance(stream, (bytes, bytearray, memoryview, mmap.mmap)):
+        return BufferReader(stream)
+
+    return BufferReader(stream.read())
+
+
+def _read_exact(stream, size):
+    data = stream.read(size)
+
+    if len(data) != size:
+        raise ValidationError('Unexpected end of stream')
+
+    return data
+
 def read_d3d_color(stream):
-    return np.frombuffer(stream.read(4), np.uint8) / 255
+    return np.frombuffer(_read_exact(stream, 4), np.uint8) / 255
 
 def read_d3dx_color(stream):
-    return np.frombuffer(stream.read(4 * 4), np.float32)
+    return np.frombuffer(_read_exact(stream, 4 * 4), np.float32)
 
 def read_d3dx_vector2(stream):
-    return np.frombuffer(stream.read(2 * 4), np.float32)
+    return np.frombuffer(_read_exact(stream, 2 * 4), np.float32)
 
 def read_d3dx_vector3(stream):
-    return np.frombuffer(stream.read(3 * 4), np.float32)
+    return np.frombuffer(_read_exact(stream, 3 * 4), np.float32)
 
 def read_d3dx_quaternion(stream):
     # Reorders quaternion as [w, x, y, z]
-    return np.frombuffer(stream.read(4 * 4), np.float32)[[3, 0, 1, 2]]
+    return np.frombuffer(_read_exact(stream, 4 * 4), np.float32)[[3, 0, 1, 2]]
 
 def read_d3dx_matrix4(stream):
     # Transposes matrix
-    return np.frombuffer(stream.read(16 * 4),
+    return np.frombuffer(_read_exact(stream, 16 * 4),
             np.float32).reshape((4, 4), order='F')
 
 def read_range_pre(stream):
     return stream.read(unpack('<I', stream.read(4))[0])
 
 def read_range_zero(stream):
+    if isinstance(stream, BufferReader):
+        return stream.read_zero()
+
     result = b''
 
     while True:
@@ -187,10 +491,10 @@ def read_string_pre(stream, offset=None, charset='cp949'):
     if offset is not None:
         stream.seek(offset)
 
-    return read_range_pre(stream).decode(charset)
+    return str(read_range_pre(stream), charset)
 
 def read_string_zero(stream, offset=None, charset='cp949'):
     if offset is not None:
         stream.seek(offset)
 
-    return read_range_zero(stream).decode(charset)
+    return str(read_range_zero(stream), charset)
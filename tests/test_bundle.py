@@ -0,0 +1,213 @@
+#!/usr/bin/python3.5
+
+import io
+import os
+import sys
+import tempfile
+import unittest
+import numpy as np
+
+from struct import pack
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+        '..', 'modules'))
+
+import bundle
+
+from structs.env import ENVFile
+from structs.kcm import KCMFile
+from structs.ksm import KSMFile
+from structs.opl import OPLFile
+from utility import ValidationError
+
+
+def make_kcm(x, y, alpha_ids, seed=0):
+    random = np.random.RandomState(seed)
+
+    data = pack('<9I', 0, 0, x, y, 0, 0, 0, 0, 7)
+    data += bytes(alpha_ids + [0xFF] * (8 - len(alpha_ids)))
+    data += bytes([0, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF])
+
+    # Alpha maps of all layers but the first, heights, colors and decals
+    size = (256 * 256 * (len(alpha_ids) - 1) + 257 * 257 * 2 +
+            256 * 256 * 3 + 256 * 256)
+    return data + random.randint(0, 256, size).astype(np.uint8).tobytes()
+
+def make_ksm(seed=0):
+    random = np.random.RandomState(seed)
+
+    area = np.zeros((256, 256), [('move', '<u2'), ('zone', '<u2')])
+    area['move'] = random.randint(0, 2, area.shape)
+    area['zone'] = random.randint(0, 32, area.shape)
+    return pack('<I', 1) + area.tobytes()
+
+def make_opl(x, y, paths):
+    data = pack('<9I', 0, 0, x, y, 0, 0, 0, 0, 7)
+    data += pack('<I', len(paths))
+
+    for i, path in enumerate(paths):
+        data += pack('<I', len(path)) + path.encode('ascii')
+        data += pack('<10f', i, 2 * i, 3 * i, 1, 0, 0, 0, 1, 1, 1 + i)
+
+    return data
+
+def make_env(paths):
+    data = pack('<9I', 0, 0, 0, 0, 0, 0, 0, 0, 7)
+    data += pack('<I', 1) + pack('<2I', 3, 9) + b'decal.gtx'
+
+    for i in range(24):
+        data += pack('<I4f', 1, i / 24, 0.5, 0.25, 1)
+
+    data += pack('<I', len(paths))
+
+    for i, path in enumerate(paths):
+        data += pack('<3I', i + 1, i + 2, len(path)) + path.encode('ascii')
+
+    return data
+
+
+def assert_same(test, expected, value, slots):
+    for slot in slots:
+        a, b = getattr(expected, slot), getattr(value, slot)
+
+        if isinstance(a, np.ndarray):
+            test.assertEqual(a.dtype, b.dtype)
+            np.testing.assert_array_equal(a, b)
+        elif isinstance(a, list) and a and hasattr(a[0], '__slots__'):
+            test.assertEqual(
+                    [[getattr(o, s) for s in o.__slots__] for o in a],
+                    [[getattr(o, s) for s in o.__slots__] for o in b])
+        elif slot == 'alpha_maps':
+            test.assertEqual(len(a), len(b))
+
+            for p, q in zip(a, b):
+                if p is None:
+                    test.assertIsNone(q)
+                else:
+                    np.testing.assert_array_equal(p, q)
+        else:
+            test.assertEqual(a, b, slot)
+
+
+class EntryTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        arrays = {
+            'empty'  : np.zeros((0, 3), np.float32),
+            'nested' : np.zeros(4, [('a', '<u2', (2,)),
+                ('b', [('c', 'S4'), ('d', '<f8')])]),
+        }
+        arrays['nested']['a'] = [[1, 2]] * 4
+        arrays['nested']['b']['c'] = b'abc'
+
+        # Record sizes around each alignment step move the array offsets
+        for count in range(0, 3 * bundle.ALIGNMENT, 7):
+            arrays['values'] = np.arange(count, dtype='<i8').reshape(-1, 1)
+            scalars = {'name' : 'x' * count, 'ids' : [1, 2]}
+
+            stream = io.BytesIO()
+            stream.write(bytes(count % 5))
+
+            offset, length = bundle.write_entry(stream, scalars, arrays)
+            self.assertEqual(offset % bundle.ALIGNMENT, 0)
+
+            result, loaded = bundle.read_entry(stream.getbuffer(), offset,
+                    length)
+
+            self.assertEqual(result, scalars)
+            self.assertEqual(sorted(loaded), sorted(arrays))
+
+            for name, array in arrays.items():
+                self.assertEqual(loaded[name].dtype, array.dtype)
+                self.assertEqual(loaded[name].shape, array.shape)
+                self.assertEqual(loaded[name].tobytes(), array.tobytes())
+
+
+class BundleTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.directory.name, 'n_001')
+        self.output = os.path.join(self.directory.name, 'n_001.bundle')
+
+        os.makedirs(self.source)
+
+        self.files = {}
+
+        for x, y in ((0, 0), (1, 0), (0, 1)):
+            self.files['KCM', x, y] = self.write('n_%03d_%03d.kcm' % (x, y),
+                    make_kcm(x, y, list(range(1 + x + 2 * y)), x + y))
+            self.files['KSM', x, y] = self.write('N_%03d_%03d.KSM' % (x, y),
+                    make_ksm(x + y))
+            self.files['OPL', x, y] = self.write('n_%03d_%03d.opl' % (x, y),
+                    make_opl(x, y, ['a.gb', 'b.gb', 'a.gb'][:x + y + 1]))
+
+        self.files['ENV', 0, 0] = self.write('n_001.env',
+                make_env(['layer0.gtx', 'layer1.gtx']))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, name, data):
+        path = os.path.join(self.source, name)
+
+        with open(path, 'wb') as f:
+            f.write(data)
+
+        return path
+
+    def test_round_trip(self):
+        bundle.pack(self.source, self.output, jobs=2)
+        loaded = bundle.Bundle().open(self.output)
+
+        self.assertEqual(sorted(loaded.keys()), sorted(self.files))
+
+        slots = {
+            'KCM' : KCMFile.__slots__,
+            'KSM' : KSMFile.__slots__,
+            'OPL' : ['x', 'y', 'paths', 'path_ids', 'positions', 'rotations',
+                'scales'],
+            'ENV' : ENVFile.__slots__,
+        }
+
+        for (kind, x, y), path in self.files.items():
+            with open(path, 'rb') as stream:
+                expected = bundle.TYPES[kind][1]().parse(stream)
+
+            assert_same(self, expected, loaded.load(kind, x, y), slots[kind])
+
+        # Arrays are read-only views, aligned in the file
+        _, arrays = loaded.entry('KCM', 0, 1)
+        base = np.frombuffer(loaded.buffer, np.uint8).ctypes.data
+
+        for array in arrays.values():
+            self.assertFalse(array.flags.writeable)
+            self.assertEqual((array.ctypes.data - base) % bundle.ALIGNMENT, 0)
+
+        with self.assertRaises(KeyError):
+            loaded.load('KCM', 5, 5)
+
+    def test_duplicate_tiles(self):
+        os.makedirs(os.path.join(self.source, 'copy'))
+        self.write(os.path.join('copy', 'n_000_000.kcm'),
+                make_kcm(0, 0, [0]))
+
+        with self.assertRaises(ValidationError):
+            bundle.pack(self.source, self.output, jobs=1)
+
+        self.assertFalse(os.path.exists(self.output))
+        self.assertEqual(os.listdir(self.directory.name), ['n_001'])
+
+    def test_truncated(self):
+        bundle.pack(self.source, self.output, jobs=1)
+
+        with open(self.output, 'rb') as f:
+            data = f.read()
+
+        for size in (0, 10, len(data) - 1):
+            with self.assertRaises(ValidationError):
+                bundle.Bundle().parse(data[:size])
+
+
+if __name__ == '__main__':
+    unittest.main()
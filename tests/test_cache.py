@@ -0,0 +1,192 @@
+#!/usr/bin/python3.5
+
+import os
+import sys
+import tempfile
+import types
+import unittest
+import numpy as np
+
+from struct import pack
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+        '..', 'modules'))
+
+import cache
+
+from structs.env import ENVFile
+from structs.kcm import KCMFile
+
+
+def make_kcm(x, y, alpha_ids, seed=0):
+    random = np.random.RandomState(seed)
+
+    data = pack('<9I', 0, 0, x, y, 0, 0, 0, 0, 7)
+    data += bytes(alpha_ids + [0xFF] * (8 - len(alpha_ids)))
+    data += bytes([0xFF] * 8)
+
+    # Alpha maps of all layers but the first, heights, colors and decals
+    size = (256 * 256 * (len(alpha_ids) - 1) + 257 * 257 * 2 +
+            256 * 256 * 3 + 256 * 256)
+    return data + random.randint(0, 256, size).astype(np.uint8).tobytes()
+
+def make_env(paths):
+    data = pack('<9I', 0, 0, 0, 0, 0, 0, 0, 0, 7)
+    data += pack('<I', 0)
+    data += pack('<I4f', 1, 0.5, 0.25, 0, 1) * 24
+    data += pack('<I', len(paths))
+
+    for path in paths:
+        data += pack('<3I', 2, 4, len(path)) + path.encode('ascii')
+
+    return data
+
+
+class ParseCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = cache.ParseCache(os.path.join(self.directory.name, 'c'))
+
+        self.kcm = [self.write('n_%03d_000.kcm' % i, make_kcm(i, 0, [0, 1], i))
+                for i in range(3)]
+        self.env = self.write('n_001.env', make_env(['a.gtx', 'b.gtx']))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, name, data):
+        path = os.path.join(self.directory.name, name)
+
+        with open(path, 'wb') as f:
+            f.write(data)
+
+        return path
+
+    def entries(self):
+        return sorted(name for name in os.listdir(self.cache.directory)
+                if name.endswith('.entry'))
+
+    def assert_kcm(self, value, path):
+        with open(path, 'rb') as stream:
+            expected = KCMFile().parse(stream)
+
+        self.assertEqual((value.x, value.y, value.alpha_ids, value.decal_ids),
+                (expected.x, expected.y, expected.alpha_ids,
+                    expected.decal_ids))
+        self.assertIsNone(value.alpha_maps[0])
+
+        for a, b in zip(expected.alpha_maps[1:] + [expected.height_map,
+                expected.color_map], value.alpha_maps[1:] + [value.height_map,
+                    value.color_map]):
+            np.testing.assert_array_equal(a, b)
+
+    def test_round_trip(self):
+        missed = self.cache.parse(KCMFile, self.kcm[0])
+        loaded = self.cache.parse(KCMFile, self.kcm[0])
+
+        self.assertEqual(len(self.entries()), 1)
+        self.assert_kcm(missed, self.kcm[0])
+        self.assert_kcm(loaded, self.kcm[0])
+        self.assertFalse(loaded.height_map.flags.writeable)
+
+        copied = self.cache.parse(KCMFile, self.kcm[0], copy=True)
+        self.assertTrue(copied.height_map.flags.writeable)
+
+        self.cache.parse(ENVFile, self.env)
+        env = self.cache.parse(ENVFile, self.env)
+
+        self.assertEqual([(l.scale_u, l.scale_v, l.path) for l in env.layers],
+                [(2, 4, 'a.gtx'), (2, 4, 'b.gtx')])
+        self.assertEqual([(l.r, l.g, l.b, l.a) for l in env.lights],
+                [(0.5, 0.25, 0, 1)] * 24)
+
+    def test_shared_objects(self):
+        with open(self.env, 'rb') as stream:
+            env = ENVFile().parse(stream)
+
+        env.layers.append(env.layers[0])
+
+        arrays = {}
+        objects = []
+        value = cache.decode(cache.encode(env, arrays, {}), arrays, objects)
+
+        self.assertIs(value.layers[0], value.layers[2])
+        self.assertIsNot(value.layers[0], value.layers[1])
+        self.assertEqual(len(objects), 1 + 24 + 2)
+
+    def test_damaged_entry(self):
+        self.cache.parse(KCMFile, self.kcm[0])
+
+        entry = os.path.join(self.cache.directory, self.entries()[0])
+        size = os.path.getsize(entry)
+
+        for length in (size // 2, 3):
+            with open(entry, 'r+b') as f:
+                f.truncate(length)
+
+            self.assert_kcm(self.cache.parse(KCMFile, self.kcm[0]),
+                    self.kcm[0])
+            self.assertEqual(os.path.getsize(entry), size)
+
+    def test_modified_file(self):
+        self.cache.parse(KCMFile, self.kcm[0])
+
+        with open(self.kcm[0], 'wb') as f:
+            f.write(make_kcm(0, 0, [0, 1, 2], 7))
+        os.utime(self.kcm[0], ns=(1, 1))
+
+        self.assert_kcm(self.cache.parse(KCMFile, self.kcm[0]), self.kcm[0])
+        self.assertEqual(len(self.entries()), 2)
+
+    def test_parser_source(self):
+        source = self.write('parser.py', b'class Parser: pass\n')
+
+        module = types.ModuleType('cache_test_parser')
+        module.__file__ = source
+        sys.modules[module.__name__] = module
+
+        parser = type('Parser', (object,), {'__module__' : module.__name__})
+
+        try:
+            key = self.cache.key(parser, self.kcm[0], {})
+
+            cache.parser_version.cache_clear()
+            self.assertEqual(self.cache.key(parser, self.kcm[0], {}), key)
+
+            self.write('parser.py', b'class Parser: changed = True\n')
+            cache.parser_version.cache_clear()
+            self.assertNotEqual(self.cache.key(parser, self.kcm[0], {}), key)
+
+        finally:
+            del sys.modules[module.__name__]
+            cache.parser_version.cache_clear()
+
+    def test_evict(self):
+        for path in self.kcm:
+            self.cache.parse(KCMFile, path)
+
+        keys = [self.cache.key(KCMFile, path, {}) + '.entry'
+                for path in self.kcm]
+        size = os.path.getsize(os.path.join(self.cache.directory, keys[0]))
+
+        self.assertEqual(self.entries(), sorted(keys))
+
+        # The second tile was used least recently
+        for key, time in zip(keys, (2, 1, 3)):
+            os.utime(os.path.join(self.cache.directory, key), ns=(time, time))
+
+        self.cache.max_size = 2 * size + size // 2
+        self.cache.evict()
+
+        self.assertEqual(self.entries(), sorted([keys[0], keys[2]]))
+        self.assertLessEqual(self.cache.size()[1], self.cache.max_size)
+
+        self.cache.max_size = size // 2
+        self.cache.evict()
+
+        self.assertEqual(self.cache.size(), (0, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
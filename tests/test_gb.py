@@ -0,0 +1,77 @@
+#!/usr/bin/python3.5
+
+import math
+import os
+import sys
+import unittest
+
+from struct import pack
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+        '..', 'modules'))
+
+import utility
+
+from structs.gb import GBAnimation
+from structs.gb import GBFile
+from structs.gb import GBHeader
+from utility import ValidationError
+
+
+def make_animation(frames, b_count=2):
+    data = pack('<IH', 0, len(frames))
+
+    for i, frame in enumerate(frames):
+        data += pack('<HI', frame, i)
+
+    data += bytes(2 * len(frames) * b_count)
+    return data
+
+
+class AnimationTest(unittest.TestCase):
+
+    def test_long_keyframes(self):
+        frames = [0, 1000, 2185, 3000, 65535]
+
+        animation = GBAnimation().parse(
+                utility.BufferReader(make_animation(frames)), 2)
+
+        self.assertEqual(animation.keyframe_frames, frames)
+        self.assertEqual(animation.keyframes.shape, (5, 2))
+
+        # Frames at 30 fps, as placed by the Blender importer
+        self.assertEqual([math.ceil(frame * 30 / 1000)
+            for frame in animation.keyframe_frames], [0, 30, 66, 90, 1967])
+
+
+
+def make_header(version=12):
+    data = pack('<4B', version, 0, 0, 0)
+    data += pack('<I', 0) + bytes(64) + pack('<I', 0)
+    data += bytes(24 + 6) + pack('<HII', 0, 0, 0) + pack('<HB', 0, 0)
+    data += bytes(1) + pack('<HH', 0, 0) + pack('<6f', -1, -1, -1, 1, 1, 1)
+    return data + bytes(16)
+
+
+class HeaderTest(unittest.TestCase):
+
+    def test_parse(self):
+        header = GBHeader().parse(utility.BufferReader(make_header()))
+
+        self.assertEqual(header.version, 12)
+        self.assertEqual(header.bounding_box_max.tolist(), [1, 1, 1])
+
+    def test_truncated(self):
+        data = make_header()
+
+        # The final reserved bytes are skipped without a check
+        for size in range(len(data) - 16):
+            with self.assertRaises(ValidationError):
+                GBHeader().parse(utility.BufferReader(data[:size]))
+
+            with self.assertRaises(ValidationError):
+                GBFile().parse(data[:size])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+#!/usr/bin/python3.5
+
+import io
+import os
+import stat
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+        '..', 'modules'))
+
+import gtx
+import utility
+
+from utility import ValidationError
+
+
+def make_dds(size=256):
+    header = b'DDS ' + bytes([124, 0, 0, 0]) + bytes(range(64))
+    return header + bytes(i % 251 for i in range(size))
+
+
+class DecryptTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        data = make_dds()
+
+        encrypted = io.BytesIO()
+        utility.encrypt_dds(io.BytesIO(data), encrypted)
+
+        decrypted = io.BytesIO()
+        utility.decrypt_gtx(io.BytesIO(encrypted.getvalue()), decrypted)
+
+        self.assertEqual(decrypted.getvalue(), data)
+
+    def test_truncated(self):
+        encrypted = io.BytesIO()
+        utility.encrypt_dds(io.BytesIO(make_dds()), encrypted)
+
+        for size in (0, 5, 8, 40):
+            with self.assertRaises(ValidationError):
+                utility.decrypt_gtx(io.BytesIO(encrypted.getvalue()[:size]),
+                        io.BytesIO())
+
+            with self.assertRaises(ValidationError):
+                utility.encrypt_dds(io.BytesIO(make_dds()[:size]),
+                        io.BytesIO())
+
+
+class ConvertDirectoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.directory.name, 'source')
+        self.target = os.path.join(self.directory.name, 'target')
+
+        os.makedirs(self.source)
+
+        for name in ('a', 'b'):
+            with open(os.path.join(self.source, name + '.dds'), 'wb') as f:
+                f.write(make_dds())
+
+        # Truncated and empty images fail on their own
+        with open(os.path.join(self.source, 'truncated.dds'), 'wb') as f:
+            f.write(make_dds()[:20])
+        open(os.path.join(self.source, 'empty.dds'), 'wb').close()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_truncated_files_fail_alone(self):
+        stats = gtx.convert_directory(self.source, self.target, 'encrypt',
+                jobs=2)
+
+        self.assertEqual(stats['converted'], 2)
+        self.assertEqual(stats['failed'], 2)
+        self.assertEqual(sorted(os.path.basename(path)
+            for path, _ in stats['errors']), ['empty.dds', 'truncated.dds'])
+
+        self.assertTrue(os.path.exists(os.path.join(self.target, 'a.gtx')))
+        self.assertFalse(os.path.exists(
+            os.path.join(self.target, 'truncated.gtx')))
+        self.assertEqual([name for name in os.listdir(self.target)
+            if name.endswith('.tmp')], [])
+
+    def test_permissions(self):
+        path = os.path.join(self.source, 'a.dds')
+        os.chmod(path, 0o644)
+
+        gtx.convert_file(path, os.path.join(self.target, 'a.gtx'), 'encrypt')
+
+        mode = os.stat(os.path.join(self.target, 'a.gtx')).st_mode
+        self.assertEqual(stat.S_IMODE(mode), 0o644)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+#!/usr/bin/python3.5
+
+import heapq
+import math
+import os
+import sys
+import unittest
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+        '..', 'modules'))
+
+import navigation
+
+from structs.ksm import KSMFile
+
+
+SIZE = 48
+
+_STEPS = [(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1) if dx or dy]
+
+
+def make_finder(walkable):
+    ksm = KSMFile()
+    ksm.area = np.zeros((KSMFile.SIZE, KSMFile.SIZE),
+            [('move', '<u2'), ('zone', '<u2')])
+    ksm.area['move'][:SIZE, :SIZE] = walkable
+
+    return navigation.PathFinder(navigation.ZoneIndex().build({(0, 0): ksm}))
+
+def dijkstra(walkable, start):
+    """Return the path costs from an [x, y] cell to all cells"""
+    costs = np.full(walkable.shape, np.inf)
+    costs[start[1], start[0]] = 0
+
+    queue = [(0.0, start[0], start[1])]
+
+    def is_open(x, y):
+        return 0 <= x < SIZE and 0 <= y < SIZE and walkable[y, x]
+
+    while queue:
+        cost, x, y = heapq.heappop(queue)
+
+        if cost > costs[y, x]:
+            continue
+
+        for dx, dy in _STEPS:
+            if not is_open(x + dx, y + dy):
+                continue
+
+            # Corners are not cut
+            if dx and dy and not (is_open(x + dx, y) and is_open(x, y + dy)):
+                continue
+
+            total = cost + (math.sqrt(2) if dx and dy else 1)
+
+            if total < costs[y + dy, x + dx]:
+                costs[y + dy, x + dx] = total
+                heapq.heappush(queue, (total, x + dx, y + dy))
+
+    return costs
+
+
+class PathFinderTest(unittest.TestCase):
+
+    def setUp(self):
+        random = np.random.RandomState(0)
+        self.walkable = random.rand(SIZE, SIZE) < 0.7
+        self.finder = make_finder(self.walkable)
+
+    def path_cost(self, path):
+        cost = 0.0
+
+        for (x0, y0), (x1, y1) in zip(path[:-1].tolist(), path[1:].tolist()):
+            dx, dy = x1 - x0, y1 - y0
+
+            self.assertIn((dx, dy), _STEPS)
+            self.assertTrue(self.walkable[y1, x1])
+
+            if dx and dy:
+                self.assertTrue(self.walkable[y0, x1])
+                self.assertTrue(self.walkable[y1, x0])
+
+            cost += math.sqrt(2) if dx and dy else 1
+
+        return cost
+
+    def test_dijkstra(self):
+        random = np.random.RandomState(1)
+        cells = np.argwhere(self.walkable)[:, ::-1]
+
+        unreachable = 0
+
+        for start in cells[random.randint(0, len(cells), 8)].tolist():
+            costs = dijkstra(self.walkable, start)
+
+            for goal in cells[random.randint(0, len(cells), 50)].tolist():
+                path = self.finder.find_path(start, goal)
+                expected = costs[goal[1], goal[0]]
+
+                if np.isinf(expected):
+                    self.assertIsNone(path)
+                    unreachable += 1
+                    continue
+
+                self.assertEqual(path[0].tolist(), start)
+                self.assertEqual(path[-1].tolist(), goal)
+                self.assertAlmostEqual(self.path_cost(path), expected)
+
+        # The grid has several regions
+        self.assertGreater(unreachable, 0)
+
+    def test_same_cell(self):
+        start = np.argwhere(self.walkable)[0, ::-1].tolist()
+
+        self.assertEqual(self.finder.find_path(start, start).tolist(),
+                [start])
+
+    def test_blocked(self):
+        blocked = np.argwhere(~self.walkable)[0, ::-1].tolist()
+        start = np.argwhere(self.walkable)[0, ::-1].tolist()
+
+        self.assertIsNone(self.finder.find_path(start, blocked))
+        self.assertIsNone(self.finder.find_path(blocked, start))
+        self.assertIsNone(self.finder.find_path(blocked, blocked))
+        self.assertIsNone(self.finder.find_path(start, [-5, 3]))
+
+
+if __name__ == '__main__':
+    unittest.main()
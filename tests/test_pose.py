@@ -0,0 +1,88 @@
+#!/usr/bin/python3.5
+
+import os
+import sys
+import unittest
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+        '..', 'modules'))
+
+import pose
+
+from structs.gb import GBArmature
+from structs.gb import GBBone
+from structs.gb import GBMesh
+
+
+def make_mesh(v_type, bones, count=4):
+    mesh = GBMesh()
+    mesh.bones = bones
+    mesh.vertices = np.zeros(count, GBMesh._VERTEX_DTYPES[v_type])
+    mesh.vertices['v'] = np.arange(count * 3).reshape(count, 3)
+    mesh.vertices['vn'] = [0, 0, 1]
+    mesh._attributes = {}
+    return mesh
+
+def make_armature(count):
+    armature = GBArmature()
+    armature.bones = []
+
+    for _ in range(count):
+        bone = GBBone()
+        bone.matrix = np.eye(4, dtype=np.float32)
+        bone.parent = pose.NO_PARENT
+        armature.bones.append(bone)
+
+    return armature
+
+def translation(x, y, z):
+    matrix = np.eye(4)
+    matrix[:3, 3] = x, y, z
+    return matrix
+
+
+class VertexInfluencesTest(unittest.TestCase):
+
+    def test_rigid_single_bone(self):
+        bones, weights = pose.vertex_influences(make_mesh(0, [2]))
+
+        np.testing.assert_array_equal(bones, [[2]] * 4)
+        np.testing.assert_array_equal(weights, [[1]] * 4)
+
+    def test_rigid_palette_shares_weights(self):
+        # The importer adds rigid vertices to every palette bone group
+        bones, weights = pose.vertex_influences(make_mesh(0, [1, 3]))
+
+        np.testing.assert_array_equal(bones, [[1, 3]] * 4)
+        np.testing.assert_allclose(weights, [[0.5, 0.5]] * 4)
+
+    def test_static(self):
+        self.assertEqual(pose.vertex_influences(make_mesh(0, [])),
+                (None, None))
+
+    def test_blended(self):
+        mesh = make_mesh(3, [0, 1, 2])
+        mesh.vertices['weights'] = [0.5, 0.25]
+        mesh.vertices['indexes'] = [2, 0, 1, 0]
+
+        bones, weights = pose.vertex_influences(mesh)
+
+        np.testing.assert_array_equal(bones, [[2, 0, 1]] * 4)
+        np.testing.assert_allclose(weights, [[0.5, 0.25, 0.25]] * 4)
+
+
+class SkinTest(unittest.TestCase):
+
+    def test_rigid_palette(self):
+        mesh = make_mesh(0, [0, 1])
+        matrices = np.stack([translation(2, 0, 0), translation(0, 4, 0)])
+
+        positions, normals = pose.skin(mesh, make_armature(2), matrices)
+
+        np.testing.assert_allclose(positions, mesh.positions + [1, 2, 0])
+        np.testing.assert_allclose(normals, mesh.normals)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+#!/usr/bin/python3.5
+
+import io
+import json
+import os
+import stat
+import sys
+import tempfile
+import unittest
+import numpy as np
+
+from struct import pack
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+        '..', 'modules'))
+
+import dds
+import splat
+import utility
+
+
+def make_kcm(x, y, alpha_ids):
+    data = pack('<9I', 0, 0, x, y, 0, 0, 0, 0, 7)
+    data += bytes(alpha_ids + [0xFF] * (8 - len(alpha_ids)))
+    data += bytes([0xFF] * 8)
+
+    # Alpha maps of all layers but the first, heights, colors and decals
+    data += bytes(256 * 256 * (len(alpha_ids) - 1))
+    data += bytes(257 * 257 * 2 + 256 * 256 * 3 + 256 * 256)
+    return data
+
+def make_env(paths):
+    data = pack('<9I', 0, 0, 0, 0, 0, 0, 0, 0, 7)
+    data += pack('<I', 0)
+    data += pack('<I4f', 1, 0, 0, 0, 0) * 24
+    data += pack('<I', len(paths))
+
+    for path in paths:
+        data += pack('<3I', 1, 1, len(path)) + path.encode('ascii')
+
+    return data
+
+def make_gtx(color):
+    image = np.empty((4, 4, 4), np.uint8)
+    image[...] = color
+
+    data = io.BytesIO()
+    dds.write_dds(data, [image])
+
+    result = io.BytesIO()
+    utility.encrypt_dds(io.BytesIO(data.getvalue()), result)
+    return result.getvalue()
+
+
+class BakeDirectoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.directory.name, 'map')
+        self.output = os.path.join(self.directory.name, 'out')
+
+        os.makedirs(self.source)
+
+        files = {
+            'layer0.gtx'      : make_gtx((255, 0, 0, 255)),
+            'layer1.gtx'      : make_gtx((0, 255, 0, 255))[:20],
+            'n_000_000.kcm'   : make_kcm(0, 0, [0]),
+            'n_000_001.kcm'   : make_kcm(0, 1, [0, 1]),
+            'map.env'         : make_env(['layer0.gtx', 'layer1.gtx']),
+        }
+
+        for name, data in files.items():
+            with open(os.path.join(self.source, name), 'wb') as f:
+                f.write(data)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def bake(self):
+        return splat.bake_directory(self.source,
+                os.path.join(self.source, 'map.env'), self.output, size=16,
+                root=self.source, jobs=2)
+
+    def test_truncated_layer_fails_alone(self):
+        stats = self.bake()
+
+        self.assertEqual(stats['baked'], 1)
+        self.assertEqual(stats['failed'], 1)
+        self.assertEqual([os.path.basename(path)
+            for path, _ in stats['errors']], ['n_000_001.kcm'])
+
+        with open(os.path.join(self.output, 'bake.json')) as stream:
+            self.assertEqual(list(json.load(stream)), ['n_000_000.dds'])
+
+        with open(os.path.join(self.output, 'n_000_000.dds'), 'rb') as f:
+            image = dds.read_dds(f.read())
+
+        self.assertTrue((image == (255, 0, 0, 255)).all())
+
+        # Only the failed tile is baked again
+        stats = self.bake()
+        self.assertEqual((stats['skipped'], stats['failed']), (1, 1))
+
+    def test_permissions(self):
+        self.bake()
+
+        for name in ('n_000_000.dds', 'bake.json'):
+            mode = os.stat(os.path.join(self.output, name)).st_mode
+            self.assertEqual(stat.S_IMODE(mode), utility.file_mode())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+#!/usr/bin/python3.5
+
+import os
+import sys
+import unittest
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+        '..', 'modules'))
+
+import terrain
+
+from structs.kcm import KCMFile
+
+
+def make_tile(x, y):
+    """Tile of heights rising by one per world sample along x and z"""
+    samples = np.arange(terrain.TILE_SIZE + 1, dtype=np.uint16)
+
+    kcm = KCMFile()
+    kcm.height_map = (samples[None, :] + x * terrain.TILE_SIZE +
+            samples[:, None] + y * terrain.TILE_SIZE)[..., None]
+    return kcm
+
+
+class HeightSamplerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sampler = terrain.HeightSampler(
+                {(x, y): make_tile(x, y) for x, y in ((0, 0), (1, 0))},
+                cache_size=1)
+
+    def test_inside(self):
+        heights = self.sampler.sample([[0, 0], [10.5, 20.25], [300, 100]])
+        np.testing.assert_allclose(heights, [0, 30.75, 400])
+
+    def test_far_edges(self):
+        # The last row and column of the map belong to its last tiles
+        heights, normals = self.sampler.sample([[512, 0], [100, 256],
+            [512, 256], [256, 256]], normals=True)
+
+        np.testing.assert_allclose(heights, [512, 356, 768, 512])
+        self.assertFalse(np.isnan(normals).any())
+
+    def test_outside(self):
+        positions = [[np.nan, 0], [0, np.inf], [-1, 0], [513, 0],
+                [1e300, -1e300], [1e12, 0]]
+
+        # A single bad position fails only its own sample
+        for position in positions:
+            heights, normals = self.sampler.sample([position, [5, 5]],
+                    normals=True)
+
+            self.assertTrue(np.isnan(heights[0]))
+            self.assertTrue(np.isnan(normals[0]).all())
+            self.assertEqual(heights[1], 10)
+
+        self.assertTrue(np.isnan(self.sampler.sample(positions)).all())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+#!/usr/bin/python3.5
+
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+        '..', 'modules'))
+
+import utility
+
+
+class TextureResolverTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.tex = os.path.join(self.directory.name, 'Tex')
+
+        os.makedirs(self.tex)
+
+    def tearDown(self):
+        self.directory.cleanup()
+        utility.clear_textures()
+
+    def test_case_insensitive(self):
+        path = os.path.join(self.tex, 'Stone.DDS')
+        open(path, 'wb').close()
+
+        self.assertEqual(utility.find_texture(self.directory.name,
+            'stone.dds'), path)
+
+    def test_clear(self):
+        self.assertIsNone(utility.find_texture(self.directory.name, 'a.dds'))
+
+        path = os.path.join(self.tex, 'a.dds')
+        open(path, 'wb').close()
+
+        # Listings are kept until they are cleared
+        self.assertIsNone(utility.find_texture(self.directory.name, 'a.dds'))
+
+        utility.clear_textures()
+        self.assertEqual(utility.find_texture(self.directory.name, 'a.dds'),
+                path)
+
+
+if __name__ == '__main__':
+    unittest.main()